@@ -0,0 +1,262 @@
+""" The main file for using Cache in asyncio """
+
+import asyncio
+import time
+from typing import Callable
+
+from redis.asyncio import ConnectionPool, Redis
+from redis.asyncio.cluster import RedisCluster
+from redis.exceptions import RedisError
+
+from cache import Cache
+from querybuilder.async_sub import AsyncSub
+from querybuilder.loader import AsyncGetLoader
+from querybuilder.metered import AsyncMeteredSub
+from querybuilder.metrics import AsyncMeteredConnection
+from querybuilder.replication import AsyncReplicatedRedis
+from querybuilder.sharding import AsyncShardedRedis
+
+
+class AsyncCache(Cache):
+    """
+    AsyncCache class, the blueprint is shared with Cache and every redis call is awaitable
+
+    methods:
+        connect() -> redis(redis.asyncio.Redis | redis.asyncio.RedisCluster | AsyncShardedRedis |
+            AsyncReplicatedRedis)
+        connect_node(host,port) -> redis(redis.asyncio.Redis)
+        add_node(host,port,passphrase,batch_size) -> moved(int)
+        ping() -> is_connected(bool)
+        close() -> None
+        aclose() -> None
+        refresh_blueprint() -> is_changed(bool)
+        check_blueprint() -> None
+        delete_sub(sub_name,passphrase,batch_size,is_background,on_progress) -> is_success(bool)
+        delete_sub_rows(sub,batch_size,on_progress) -> removed(int)
+        is_sub_deleting(sub_name) -> is_deleting(bool)
+    """
+
+    LOADER = AsyncGetLoader
+    SUB = AsyncSub
+    METERED_SUB = AsyncMeteredSub
+    CONNECTION = AsyncMeteredConnection
+    blueprint_task: asyncio.Task | None = None
+
+    def connect(self) -> Redis | RedisCluster | AsyncShardedRedis | AsyncReplicatedRedis:
+        """
+        Open the redis.asyncio connection, the connection is made on the first command,
+        await "ping()" to check it, and to load the slot map in cluster mode
+
+        :return: redis.asyncio.Redis connection, redis.asyncio.RedisCluster in cluster mode,
+            AsyncShardedRedis if sharded, AsyncReplicatedRedis with replicas
+        """
+        if self.is_sharded:
+            for host, port in self.nodes:
+                self.node_clients[f'{host}:{port}'] = self.connect_node(host, port)
+            return AsyncShardedRedis(self.node_clients)
+        if self.is_cluster:
+            # redis.asyncio.RedisCluster takes no retry_on_timeout
+            pool_options = {option: data for option, data in self.pool_options.items()
+                            if option != 'retry_on_timeout'}
+            redis = RedisCluster(host=self.redis_host, port=self.redis_port, **pool_options)
+            # redis.asyncio.RedisCluster takes no connection class, it is set on its nodes
+            redis.connection_kwargs['connection_class'] = self.CONNECTION
+            for node in redis.nodes_manager.startup_nodes.values():
+                node.connection_class = self.CONNECTION
+            return redis
+        redis = self.connect_node(self.redis_host, self.redis_port)
+        if self.replicas:
+            return AsyncReplicatedRedis(redis, [self.connect_node(host, port)
+                                                for host, port in self.replicas],
+                                        self.read_routing, self.read_your_writes)
+        return redis
+
+    def connect_node(self, host: str, port: int) -> Redis:
+        """
+        Open a redis.asyncio connection to a single cluster node, shard or replica
+
+        :param host: the IP address of the node
+        :param port: the port of the node
+        :return: redis.asyncio.Redis connection
+        """
+        return Redis.from_pool(ConnectionPool(host=host, port=port,
+                                              connection_class=self.CONNECTION,
+                                              **self.pool_options))
+
+    async def ping(self) -> bool:
+        """
+        Check the redis connection
+
+        :return: is_connected(bool)
+        """
+        if self.is_sharded:
+            return all([await redis.ping() for redis in self.node_clients.values()])
+        return await self.redis.ping()
+
+    def close(self) -> None:
+        """
+        The connections of AsyncCache are closed on the event loop, await "aclose()" instead
+
+        :return: None
+        """
+        raise ValueError('AsyncCache is closed with "await cache.aclose()"')
+
+    async def aclose(self) -> None:
+        """
+        Close the redis connection pool, the connections to the cluster nodes, shards or
+        replicas, and the blueprint connection
+
+        :return: None
+        """
+        for redis in self.node_clients.values():
+            await redis.aclose()
+        self.node_clients.clear()
+        if not self.is_sharded:
+            await self.redis.aclose()
+        if self.blueprint_task is not None:
+            self.blueprint_task.cancel()
+            self.blueprint_task = None
+        if self.blueprint_redis is not None:
+            self.blueprint_redis.close()
+
+    # pylint: disable=W0236,W0221
+    async def refresh_blueprint(self) -> bool:
+        """
+        Load the blueprint again if another process has changed it, only its version is read
+        otherwise. The blueprint connection is sync, so it is read in a thread
+
+        :return: is_changed(bool)
+        """
+        self.blueprint_checked_at = time.monotonic()
+        try:
+            changed = await asyncio.to_thread(self.read_changed_blueprint)
+        except (IOError, RedisError):
+            return False
+        if changed is None:
+            return False
+        self.apply_blueprint(*changed)
+        return True
+
+    def check_blueprint(self) -> None:
+        """
+        Refresh the blueprint in a background task, sub() keeps returning the subs of the current
+        blueprint until the task has read it. The ValueError of a refresh that failed is raised by
+        the next check. Without a running event loop the blueprint is refreshed in place
+
+        :return: None
+        """
+        task = self.blueprint_task
+        if task is not None:
+            if not task.done():
+                return
+            self.blueprint_task = None
+            if not task.cancelled():
+                task.result()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            Cache.refresh_blueprint(self)
+            return
+        self.blueprint_checked_at = time.monotonic()
+        self.blueprint_task = loop.create_task(self.refresh_blueprint())
+
+    # pylint: disable=W0236,W0221
+    async def add_node(self, host: str, port: int, passphrase: str | None = None,
+                       batch_size: int = 1000) -> int:
+        """
+        Add a standalone redis instance to a sharded cache and move the keys it takes over.
+        The moved keys are missing until they arrive, writes during the move are kept
+
+        :param host: the IP address of the new node
+        :param port: the port of the new node
+        :param passphrase: passphrase for administrative level methods
+        :param batch_size: number of keys per SCAN page and per move batch
+        :return: number of keys moved(int)
+        """
+        if passphrase is None:
+            err_msg = 'Please provide "passphrase" in the args to perform administrative methods.'
+            raise ValueError(err_msg)
+        if not self.is_admin(passphrase):
+            raise ValueError('The given passphrase is not match, node addition failed.')
+        if not self.is_sharded:
+            raise ValueError('Nodes can only be added to a cache created with "nodes".')
+
+        with self.measure('', 'add_node'):
+            node_name = f'{host}:{port}'
+            redis = self.connect_node(host, port)
+            await redis.ping()
+            self.node_clients[node_name] = redis
+            moved = await self.redis.add_node(node_name, redis, self.get_key_patterns(), batch_size)
+            self.nodes.append((host, port))
+            self.reset_near_caches()
+            self.subs.clear()
+
+            print(f'Node `{node_name}` has been added, {moved} keys have been moved.')
+            return moved
+
+    async def delete_sub(self, sub_name: str, passphrase: str | None = None,
+                         batch_size: int = 1000, is_background: bool = False,
+                         on_progress: Callable[[str, int], None] | None = None) -> bool:
+        """
+        Delete existing sub from the cache, and its cache
+
+        :param sub_name: sub name, similar to table in SQL
+        :param passphrase: passphrase for administrative level methods
+        :param batch_size: number of keys per registry or SCAN page and per UNLINK batch
+        :param is_background: remove the cache rows in a background task
+        :param on_progress: called as on_progress(sub_name, removed) after every batch
+        :return: is_success(bool)
+        """
+        sub = self.sub(sub_name) if self.is_sub_exists(sub_name) else None
+        if not self.remove_sub_blueprint(sub_name, passphrase):
+            return False
+
+        if is_background:
+            task = asyncio.create_task(self.delete_sub_rows(sub, batch_size, on_progress),
+                                       name=f'delete_sub-{self.cache_name}/{sub_name}')
+            self.teardowns[sub_name] = task
+            print(f'Sub `{sub_name}` has been deleted, its cache is being removed.')
+            return True
+
+        with self.measure(sub_name, 'delete_sub'):
+            await self.delete_sub_rows(sub, batch_size, on_progress)
+        print(f'Sub `{sub_name}` has been deleted.')
+        return True
+
+    @staticmethod
+    async def delete_sub_rows(sub: AsyncSub, batch_size: int = 1000,
+                              on_progress: Callable[[str, int], None] | None = None) -> int:
+        """
+        Remove all cache rows of a sub with batched UNLINK, the keys are read from the key
+        registry of a registered sub or by SCAN otherwise
+
+        :param sub: AsyncSub object of the sub to be emptied
+        :param batch_size: number of keys per registry or SCAN page and per UNLINK batch
+        :param on_progress: called as on_progress(sub_name, removed) after every batch
+        :return: number of keys removed(int)
+        """
+        removed = 0
+        async for complete_keys in sub.iter_complete_keys(batch_size):
+            removed += await sub.unset_many(complete_keys, is_key_complete=True, is_unlink=True)
+            if on_progress is not None:
+                on_progress(sub.query_builder.sub_name, removed)
+
+        await sub.drop_indexes()
+        return removed
+    # pylint: enable=W0236,W0221
+
+    def is_sub_deleting(self, sub_name: str) -> bool:
+        """
+        Check if the cache rows of a deleted sub are still being removed in the background
+
+        :param sub_name: sub name, similar to table in SQL
+        :return: is_deleting(bool)
+        """
+        task = self.teardowns.get(sub_name)
+        if task is None:
+            return False
+        if not task.done():
+            return True
+
+        del self.teardowns[sub_name]
+        return False
@@ -0,0 +1,322 @@
+""" Benchmark suite of the Sub and Cache operations, against a local redis or fakeredis """
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Iterator
+
+from redis import Redis
+from redis.connection import AbstractConnection
+
+from cache import Cache
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+PASSPHRASE = 'benchmark'
+
+
+class FakeCache(Cache):
+    """
+    Cache on an in-process fakeredis server, no redis-server or network is needed
+
+    methods:
+        connect() -> redis(fakeredis.FakeRedis)
+    """
+
+    server = None
+
+    def connect(self) -> Redis:
+        """
+        Open a fakeredis connection, every FakeCache shares one server
+
+        :return: fakeredis.FakeRedis connection
+        """
+        if FakeCache.server is None:
+            FakeCache.server = fakeredis.FakeServer()
+        return fakeredis.FakeRedis(server=FakeCache.server)
+
+
+class RoundTrips:
+    """
+    Counts the round trips to redis, a single command or a whole pipeline is sent with one
+    "send_packed_command" call
+
+    methods:
+        count() -> None
+    """
+
+    calls = 0
+
+    @classmethod
+    @contextlib.contextmanager
+    def count(cls) -> Iterator[None]:
+        """
+        Count the round trips made inside the with block, in "RoundTrips.calls"
+
+        :return: None
+        """
+        send_packed_command = AbstractConnection.send_packed_command
+
+        def counted(self, *args, **kwargs):
+            cls.calls += 1
+            return send_packed_command(self, *args, **kwargs)
+
+        AbstractConnection.send_packed_command = counted
+        try:
+            yield
+        finally:
+            AbstractConnection.send_packed_command = send_packed_command
+
+
+def measure(calls: list[Callable[[], object]], rows_per_call: int,
+            setup: Callable[[], object] | None = None) -> dict:
+    """
+    Run calls one after the other and report their throughput and latency
+
+    :param calls: the calls to measure
+    :param rows_per_call: number of rows read or written by one call
+    :param setup: called before every call, neither timed nor counted
+    :return: result(dict)
+    """
+    latencies = []
+    round_trips = 0
+    for call in calls:
+        if setup is not None:
+            setup()
+        call_round_trips = RoundTrips.calls
+        call_started_at = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - call_started_at)
+        round_trips += RoundTrips.calls - call_round_trips
+    seconds = sum(latencies)
+
+    latencies.sort()
+    return {
+        'calls': len(calls),
+        'rows_per_call': rows_per_call,
+        'ops_per_sec': round(len(calls) / seconds, 1),
+        'rows_per_sec': round(len(calls) * rows_per_call / seconds, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 4),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 4),
+        'round_trips_per_call': round(round_trips / len(calls), 2),
+    }
+
+
+def trace_peak(calls: list[Callable[[], object]]) -> int:
+    """
+    Run calls under tracemalloc, apart from the measured runs since tracing slows down every
+    allocation
+
+    :param calls: the calls to trace
+    :return: peak_bytes(int), the most memory allocated by the calls at once
+    """
+    is_tracing = tracemalloc.is_tracing()
+    if not is_tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        started_with = tracemalloc.get_traced_memory()[0]
+        for call in calls:
+            call()
+        return tracemalloc.get_traced_memory()[1] - started_with
+    finally:
+        if not is_tracing:
+            tracemalloc.stop()
+
+
+def get_used_memory(cache: Cache) -> int | None:
+    """
+    Get the memory used by redis, None on fakeredis
+
+    :param cache: the benchmarked cache
+    :return: used_memory(int) | None
+    """
+    if isinstance(cache, FakeCache):
+        return None
+    return cache.redis.info('memory')['used_memory']
+
+
+def run_case(cache: Cache, rows: int, cols: int, value_size: int, batch_size: int) -> list[dict]:
+    """
+    Benchmark every operation on a new sub
+
+    :param cache: the benchmarked cache
+    :param rows: number of rows of the sub
+    :param cols: number of columns, the key and cols - 1 TEXT columns
+    :param value_size: characters per TEXT column
+    :param batch_size: keys per get_many call
+    :return: results(list[dict])
+    """
+    sub_name = f'bench_{rows}_{cols}_{value_size}'
+    sub_attr = {'uid': 'INTEGER', **{f'c{i}': 'TEXT' for i in range(1, cols)}}
+    val = {f'c{i}': 'x' * value_size for i in range(1, cols)}
+    key_vals = {uid: val for uid in range(rows)}
+    keys = list(key_vals)
+    batches = [keys[i:i + batch_size] for i in range(0, rows, batch_size)]
+    # Whole-sub operations are repeated on small subs for a steadier median
+    repeat = max(1, min(10, 10000 // rows))
+
+    if cache.is_sub_exists(sub_name):
+        cache.delete_sub(sub_name, PASSPHRASE)
+    used_memory = get_used_memory(cache)
+    cache.create_sub(sub_name, sub_attr, PASSPHRASE)
+    sub = cache.sub(sub_name)
+
+    def restore() -> None:
+        sub.set_many(key_vals)
+
+    results = {
+        'set': measure([lambda uid=uid: sub.set(uid, val) for uid in keys], 1),
+    }
+    memory = get_used_memory(cache)
+    results['get'] = measure([lambda uid=uid: sub.get(uid) for uid in keys], 1)
+    results['get_many'] = measure([lambda batch=batch: sub.get_many(batch) for batch in batches],
+                                  batch_size)
+    results['get_all'] = measure([sub.get_all] * repeat, rows)
+    results['set_many'] = measure([restore] * repeat, rows)
+    results['unset_many'] = measure([lambda: sub.unset_many(keys)] * repeat, rows, restore)
+    results['unset_all'] = measure([sub.unset_all] * repeat, rows, restore)
+    restore()
+    # One call of every operation, the client memory peaks on the whole-sub ones
+    peak_bytes = trace_peak([lambda: sub.set(keys[0], val), lambda: sub.get(keys[0]),
+                             lambda: sub.get_many(batches[0]), sub.get_all, restore,
+                             lambda: sub.unset_many(keys), restore, sub.unset_all, restore])
+    results['delete_sub'] = measure([lambda: cache.delete_sub(sub_name, PASSPHRASE)], rows)
+
+    bytes_per_row = None
+    if used_memory is not None:
+        bytes_per_row = round((memory - used_memory) / rows, 1)
+    return [{'operation': operation, 'rows': rows, 'cols': cols, 'value_size': value_size,
+             **result, 'bytes_per_row': bytes_per_row,
+             'client_peak_kb': round(peak_bytes / 1024, 1)}
+            for operation, result in results.items()]
+
+
+def get_meta(cache: Cache, backend: str) -> dict:
+    """
+    Describe the benchmarked version and environment
+
+    :param cache: the benchmarked cache
+    :param backend: redis or fakeredis
+    :return: meta(dict)
+    """
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True,
+                                  capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    redis_version = None
+    if backend == 'redis':
+        redis_version = cache.redis.info('server')['redis_version']
+    return {
+        'revision': revision,
+        'backend': backend,
+        'redis_version': redis_version,
+        'python': platform.python_version(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results: list[dict], baseline: list[dict]) -> None:
+    """
+    Print the rows per second of every result against a baseline run
+
+    :param results: results of this run
+    :param baseline: results of an earlier run
+    :return: None
+    """
+    def get_case(result: dict) -> tuple:
+        return result['operation'], result['rows'], result['cols'], result['value_size']
+
+    baseline_by_case = {get_case(result): result for result in baseline}
+    for result in results:
+        old = baseline_by_case.get(get_case(result))
+        if old is None:
+            continue
+        change = result['rows_per_sec'] / old['rows_per_sec'] - 1
+        print(f'{result["operation"]:<11} rows={result["rows"]:<6} cols={result["cols"]:<3} '
+              f'size={result["value_size"]:<5} {old["rows_per_sec"]:>12} -> '
+              f'{result["rows_per_sec"]:>12} rows/s ({change:+.1%})')
+
+
+def parse_args(args: list[str] | None = None) -> argparse.Namespace:
+    """
+    Parse the command line arguments
+
+    :param args: command line arguments, sys.argv if not given
+    :return: parsed arguments(argparse.Namespace)
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the Sub and Cache operations.')
+    parser.add_argument('--backend', choices=('redis', 'fakeredis'), default='redis',
+                        help='a local redis-server, or fakeredis in-process')
+    parser.add_argument('--host', default='127.0.0.1', help='redis host')
+    parser.add_argument('--port', type=int, default=6379, help='redis port')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--cols', type=int, nargs='+', default=[3, 10])
+    parser.add_argument('--value-sizes', type=int, nargs='+', default=[16, 1024])
+    parser.add_argument('--batch-size', type=int, default=100, help='keys per get_many call')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file of the results')
+    parser.add_argument('--compare', default=None, help='JSON file of an earlier run')
+    return parser.parse_args(args)
+
+
+def main(args: list[str] | None = None) -> int:
+    """
+    Run the benchmark suite and write the results to a JSON file
+
+    :param args: command line arguments, sys.argv if not given
+    :return: exit code(int)
+    """
+    args = parse_args(args)
+    if args.backend == 'fakeredis' and fakeredis is None:
+        print('fakeredis is not installed, please run "pip install fakeredis".')
+        return 1
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, 'r', encoding='UTF-8') as file:
+            baseline = json.loads(file.read())['results']
+
+    # The blueprint file of the benchmark cache is kept out of the working directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as blueprint_dir:
+        os.chdir(blueprint_dir)
+        try:
+            cache_class = FakeCache if args.backend == 'fakeredis' else Cache
+            cache = cache_class('benchmark', args.host, args.port)
+            cache.setup_passphrase(PASSPHRASE)
+
+            results = []
+            with RoundTrips.count():
+                for rows in args.rows:
+                    for cols in args.cols:
+                        for value_size in args.value_sizes:
+                            results.extend(run_case(cache, rows, cols, value_size,
+                                                    args.batch_size))
+                            print(f'rows={rows} cols={cols} value_size={value_size} done')
+            meta = get_meta(cache, args.backend)
+        finally:
+            os.chdir(cwd)
+
+    with open(output, 'w+', encoding='UTF-8') as file:
+        file.write(json.dumps({'meta': meta, 'results': results}, indent=4))
+    print(f'Results have been written to `{output}`.')
+    if baseline is not None:
+        compare(results, baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
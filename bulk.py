@@ -0,0 +1,70 @@
+""" Command line entry point to import and export the rows of a sub """
+
+import argparse
+import sys
+
+from cache import Cache
+
+
+def parse_args(args: list[str] | None = None) -> argparse.Namespace:
+    """
+    Parse the command line arguments
+
+    :param args: command line arguments, sys.argv if not given
+    :return: parsed arguments(argparse.Namespace)
+    """
+    parser = argparse.ArgumentParser(description='Import or export the rows of a sub.')
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('cache_name', help='name of the cache')
+    parser.add_argument('sub_name', help='name of the sub')
+    parser.add_argument('path', help='input or output file, "-" for stdin or stdout')
+    parser.add_argument('--format', dest='format_', choices=('ndjson', 'csv'), default='ndjson')
+    parser.add_argument('--host', default='127.0.0.1', help='redis host')
+    parser.add_argument('--port', type=int, default=6379, help='redis port')
+    parser.add_argument('--cluster', action='store_true', help='connect to a Redis Cluster')
+    parser.add_argument('--blueprint-storage', choices=('file', 'redis'), default='file')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='rows per pipeline on import, keys per MGET on export')
+    parser.add_argument('--ttl', type=int, default=None,
+                        help='seconds before the imported cache expires, 0 for no expiry')
+    parser.add_argument('--fields', nargs='+', default=None, help='only export these columns')
+    parser.add_argument('--quiet', action='store_true', help='do not print the progress')
+    return parser.parse_args(args)
+
+
+def main(args: list[str] | None = None) -> int:
+    """
+    Run an import or an export, the progress is printed to stderr
+
+    :param args: command line arguments, sys.argv if not given
+    :return: exit code(int), 1 if rows have been rejected
+    """
+    args = parse_args(args)
+    cache = Cache(args.cache_name, args.host, args.port, is_cluster=args.cluster,
+                  blueprint_storage=args.blueprint_storage)
+    sub = cache.sub(args.sub_name)
+
+    def print_progress(report: dict) -> None:
+        if not args.quiet:
+            print(f'{report["rows"]} rows, {report["rows_per_second"]} rows/s', file=sys.stderr)
+
+    def print_error(record: int, invalid_cols: list[str]) -> None:
+        if not args.quiet:
+            cols = ', '.join(invalid_cols) or 'unreadable row'
+            print(f'Rejected record {record}: {cols}', file=sys.stderr)
+
+    if args.action == 'import':
+        source = sys.stdin.buffer if args.path == '-' else args.path
+        report = sub.import_from(source, args.format_, args.chunk_size, args.ttl, print_error,
+                                 print_progress)
+    else:
+        target = sys.stdout if args.path == '-' else args.path
+        report = sub.export_to(target, args.format_, args.chunk_size, args.fields,
+                               print_progress)
+
+    print(report, file=sys.stderr)
+    return 1 if report.get('rejected') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
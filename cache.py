@@ -1,9 +1,24 @@
 """ The main file for using Cache """
 
+import contextlib
 import json
-from redis import Redis
-
+import time
+from threading import Thread
+from typing import Callable
+
+from redis import ConnectionPool, Redis
+from redis.cluster import RedisCluster
+from redis.exceptions import RedisError
+
+from querybuilder import scripts
+from querybuilder.loader import GetLoader
+from querybuilder.metered import MeteredQueryBuilder, MeteredSub
+from querybuilder.metrics import MeteredConnection, Metrics
+from querybuilder.near_cache import NearCache, NearCacheInvalidator
 from querybuilder.querybuilder import QueryBuilder
+from querybuilder.replication import ReplicatedRedis
+from querybuilder.schema import Schema
+from querybuilder.sharding import ShardedRedis
 from querybuilder.sub import Sub
 
 
@@ -12,37 +27,271 @@ class Cache:
     Cache class
 
     methods:
+        connect() -> redis(Redis | RedisCluster | ShardedRedis | ReplicatedRedis)
+        connect_node(host,port) -> redis(Redis)
+        connect_blueprint() -> redis(Redis | RedisCluster) | None
+        node_client(key) -> redis(Redis)
+        close() -> None
+        get_key_patterns() -> patterns(list[str])
+        add_node(host,port,passphrase,batch_size) -> moved(int)
         setup_passphrase(new_passphrase) -> None
+        read_blueprint() -> blueprint(dict), version(int)
+        read_changed_blueprint() -> blueprint(dict), version(int) | None
+        apply_blueprint(blueprint,version) -> None
         load_blueprint() -> is_success(bool)
         save_blueprint() -> is_success(bool)
+        refresh_blueprint() -> is_changed(bool)
+        check_blueprint() -> None
         is_admin(passphrase) -> is_admin(bool)
         is_sub_exists(sub_name) -> is_exists(bool)
-        create_sub(sub_name,sub_attr,passphrase) -> is_success(bool)
-        delete_sub(sub_name,passphrase) -> is_success(bool)
+        create_sub(sub_name,sub_attr,passphrase,codec,is_positional,storage,ttl,indexes,
+            is_registered,is_hash_tagged,compression,compression_min_size) -> is_success(bool)
+        set_compression(sub_name,compression,min_size,passphrase) -> is_success(bool)
+        delete_sub(sub_name,passphrase,batch_size,is_background,on_progress) -> is_success(bool)
+        remove_sub_blueprint(sub_name,passphrase) -> is_success(bool)
+        delete_sub_rows(sub,batch_size,on_progress) -> removed(int)
+        is_sub_deleting(sub_name) -> is_deleting(bool)
+        setup_near_cache(sub_name,max_entries,max_bytes,ttl,is_tracking) -> near_cache(NearCache)
+        remove_near_cache(sub_name) -> None
+        reset_near_caches() -> None
+        setup_loader(sub_name,window_ms,max_batch) -> loader(GetLoader)
+        remove_loader(sub_name) -> None
+        setup_metrics(metrics,hooks) -> metrics(Metrics)
+        remove_metrics() -> None
+        measure(sub_name,operation_name) -> context manager
         sub(sub_name) -> sub(Sub)
+        query_builder(sub_name) -> query_builder(QueryBuilder)
     """
 
-    def __init__(self, cache_name: str, redis_host: str, redis_port: int):
+    # Blueprint file entry holding the options of every sub, e.g. {"users": {"codec": "msgpack"}}
+    OPTIONS_KEY = '__options__'
+    # Blueprint hash entry holding the version of the blueprint
+    VERSION_KEY = '__version__'
+    BLUEPRINT_STORAGES = ('file', 'redis')
+    # Connection pool options taken by "pool_options"
+    POOL_OPTIONS = ('max_connections', 'socket_timeout', 'socket_connect_timeout',
+                    'socket_keepalive', 'socket_keepalive_options', 'health_check_interval',
+                    'retry_on_timeout')
+    # Loader class of the get calls, AsyncCache coalesces coroutines instead of threads
+    LOADER = GetLoader
+    # Sub class returned by "sub()", AsyncCache returns AsyncSub
+    SUB = Sub
+    # Sub class returned by "sub()" once metrics are set up
+    METERED_SUB = MeteredSub
+    # Connection class of the redis clients, it counts the round trips of measured operations
+    CONNECTION = MeteredConnection
+
+    def __init__(self, cache_name: str, redis_host: str, redis_port: int,
+                 is_cluster: bool = False, nodes: list[tuple[str, int]] | None = None,
+                 blueprint_storage: str = 'file', blueprint_refresh: float | None = 5.0,
+                 replicas: list[tuple[str, int]] | None = None, read_routing: str = 'round_robin',
+                 read_your_writes: float | None = None, pool_options: dict | None = None):
         """
         Cache initialization
 
         :param cache_name: name of the cache
         :param redis_host: the IP address where the redis is hosted
         :param redis_port: the port where the redis is hosted
+        :param is_cluster: connect to a Redis Cluster, the host and port of any of its nodes
+        :param nodes: more standalone redis instances, e.g. [("10.0.0.2", 6379)], the keys are
+            sharded over them and the redis_host one by consistent hashing
+        :param blueprint_storage: file keeps the blueprint in "<cache_name>_blueprint.json",
+            redis keeps it in a redis hash shared by every process using the cache
+        :param blueprint_refresh: seconds between the checks of the blueprint version made by
+            "sub()" with redis storage, None to refresh only by "refresh_blueprint()"
+        :param replicas: replicas of the redis_host redis, e.g. [("10.0.0.3", 6379)], the reads
+            are sent to them and fall back to the primary if they fail
+        :param read_routing: round_robin or least_latency, how the replica of a read is picked
+        :param read_your_writes: seconds the reads of a thread or task are sent to the primary
+            after it writes, None to always read from the replicas
+        :param pool_options: options of every connection pool, e.g. {"max_connections": 50,
+            "socket_timeout": 0.5, "socket_keepalive": True}
         """
+        if blueprint_storage not in self.BLUEPRINT_STORAGES:
+            err_msg = f'Unknown blueprint storage `{blueprint_storage}`, available blueprint ' \
+                      f'storages: file, redis.'
+            raise ValueError(err_msg)
+        if replicas and (is_cluster or nodes):
+            err_msg = 'Replicas can only be added to a standalone redis, a cluster or a ' \
+                      'sharded cache reads from its primaries.'
+            raise ValueError(err_msg)
+        pool_options = pool_options if pool_options is not None else {}
+        for option in pool_options:
+            if option not in self.POOL_OPTIONS:
+                err_msg = f'Unknown pool option `{option}`, available pool options: ' \
+                          f'{", ".join(self.POOL_OPTIONS)}.'
+                raise ValueError(err_msg)
+
         self.cache_name = cache_name
         self.redis_host = redis_host
         self.redis_port = redis_port
+        self.is_cluster = is_cluster
+        self.is_sharded = bool(nodes)
+        self.nodes = [(redis_host, redis_port), *nodes] if nodes else []
+        self.node_clients = {}
+        self.replicas = list(replicas) if replicas else []
+        self.read_routing = read_routing
+        self.read_your_writes = read_your_writes
+        self.pool_options = pool_options
         self.passphrase = None
         self.blueprint = {}
-        self.blueprint_path = f'{self.cache_name}_blueprint.json'
+        self.sub_options = {}
+        self.schemas = {}
+        self.teardowns = {}
+        self.near_caches = {}
+        self.loaders = {}
+        self.metrics = None
+        # Sub objects are built once per sub and dropped whenever their setup changes
+        self.subs = {}
+        self.blueprint_storage = blueprint_storage
+        self.blueprint_refresh = blueprint_refresh
+        self.blueprint_version = 0
+        self.blueprint_checked_at = time.monotonic()
+        if blueprint_storage == 'redis':
+            self.blueprint_path = f'__blueprint__/{self.cache_name}'
+        else:
+            self.blueprint_path = f'{self.cache_name}_blueprint.json'
+        self.blueprint_redis = self.connect_blueprint()
         self.load_blueprint()
 
+        self.redis = self.connect()
+
+    def connect(self) -> Redis | RedisCluster:
+        """
+        Open the redis connection
+
+        :return: Redis connection, RedisCluster in cluster mode, ShardedRedis if sharded,
+            ReplicatedRedis with replicas
+        """
         try:
-            self.redis = Redis(host=redis_host, port=redis_port)
-            self.redis.ping()
+            if self.is_sharded:
+                for host, port in self.nodes:
+                    self.node_clients[f'{host}:{port}'] = self.connect_node(host, port)
+                    self.node_clients[f'{host}:{port}'].ping()
+                return ShardedRedis(self.node_clients)
+
+            if self.is_cluster:
+                # The nodes of a cluster only take a connection class from a url
+                redis = RedisCluster.from_url(f'redis://{self.redis_host}:{self.redis_port}',
+                                              connection_class=self.CONNECTION,
+                                              **self.pool_options)
+            else:
+                redis = self.connect_node(self.redis_host, self.redis_port)
+            redis.ping()
         except ConnectionError as exc:
             raise exc
+        if self.replicas:
+            # The replicas are not pinged, the reads skip a replica that is down
+            return ReplicatedRedis(redis, [self.connect_node(host, port)
+                                           for host, port in self.replicas],
+                                   self.read_routing, self.read_your_writes)
+        return redis
+
+    def connect_node(self, host: str, port: int) -> Redis:
+        """
+        Open a connection to a single cluster node, shard or replica
+
+        :param host: the IP address of the node
+        :param port: the port of the node
+        :return: Redis connection
+        """
+        return Redis.from_pool(ConnectionPool(host=host, port=port,
+                                              connection_class=self.CONNECTION,
+                                              **self.pool_options))
+
+    def connect_blueprint(self) -> Redis | RedisCluster | None:
+        """
+        Open the connection the blueprint is read and written with, it is kept on the
+        redis_host node of a sharded cache. The connection is sync, the blueprint is read and
+        written the same way from AsyncCache
+
+        :return: Redis connection, RedisCluster in cluster mode, None with file storage
+        """
+        if self.blueprint_storage != 'redis':
+            return None
+        if self.is_cluster:
+            return RedisCluster(host=self.redis_host, port=self.redis_port, **self.pool_options)
+        return Redis(host=self.redis_host, port=self.redis_port, **self.pool_options)
+
+    def node_client(self, key: str) -> Redis:
+        """
+        Get the connection to the cluster node or shard owning a key, for MULTI/EXEC, WATCH
+        and Lua on the keys of a single slot. Cluster nodes are resolved from the slot map of
+        the cluster client, which is refreshed when a command of the cluster client is
+        redirected
+
+        :param key: a redis key
+        :return: Redis connection
+        """
+        if self.is_sharded:
+            return self.redis.get_client(key)
+
+        node = self.redis.get_node_from_key(key)
+        redis = self.node_clients.get(node.name)
+        if redis is None:
+            redis = self.connect_node(node.host, node.port)
+            self.node_clients[node.name] = redis
+        return redis
+
+    def close(self) -> None:
+        """
+        Close the redis connection pool, the connections to the cluster nodes, shards or
+        replicas, the thread pool of a sharded cache, and the blueprint connection
+
+        :return: None
+        """
+        if not self.is_sharded:
+            for redis in self.node_clients.values():
+                redis.close()
+        self.node_clients.clear()
+        self.redis.close()
+        if self.blueprint_redis is not None:
+            self.blueprint_redis.close()
+
+    def get_key_patterns(self) -> list[str]:
+        """
+        Get the patterns matching every row, index, registry, registry expiry, lock and
+        recompute time key of the cache
+
+        :return: patterns(list[str])
+        """
+        return [f'{prefix}{tag}{self.cache_name}/*'
+                for prefix in ('', '__index__/', '__registry__/', '__expiry__/', '__lock__/',
+                               '__delta__/')
+                for tag in ('', '{')]
+
+    def add_node(self, host: str, port: int, passphrase: str | None = None,
+                 batch_size: int = 1000) -> int:
+        """
+        Add a standalone redis instance to a sharded cache and move the keys it takes over.
+        The moved keys are missing until they arrive, writes during the move are kept
+
+        :param host: the IP address of the new node
+        :param port: the port of the new node
+        :param passphrase: passphrase for administrative level methods
+        :param batch_size: number of keys per SCAN page and per move batch
+        :return: number of keys moved(int)
+        """
+        if passphrase is None:
+            err_msg = 'Please provide "passphrase" in the args to perform administrative methods.'
+            raise ValueError(err_msg)
+        if not self.is_admin(passphrase):
+            raise ValueError('The given passphrase is not match, node addition failed.')
+        if not self.is_sharded:
+            raise ValueError('Nodes can only be added to a cache created with "nodes".')
+
+        with self.measure('', 'add_node'):
+            node_name = f'{host}:{port}'
+            redis = self.connect_node(host, port)
+            redis.ping()
+            self.node_clients[node_name] = redis
+            moved = self.redis.add_node(node_name, redis, self.get_key_patterns(), batch_size)
+            self.nodes.append((host, port))
+            self.reset_near_caches()
+            self.subs.clear()
+
+            print(f'Node `{node_name}` has been added, {moved} keys have been moved.')
+            return moved
 
     def setup_passphrase(self, new_passphrase: str):
         """
@@ -54,32 +303,123 @@ class Cache:
         self.passphrase = new_passphrase
         print('New passphrase has been set.')
 
+    def read_blueprint(self) -> tuple[dict, int]:
+        """
+        Read the saved blueprint and its version, raises IOError or RedisError if it can not be read
+
+        :return: blueprint(dict), version(int)
+        """
+        if self.blueprint_redis is None:
+            with open(self.blueprint_path, 'r', encoding='UTF-8') as file:
+                return json.loads(file.read()), 0
+
+        fields = self.blueprint_redis.hgetall(self.blueprint_path)
+        version = int(fields.pop(self.VERSION_KEY.encode('utf-8'), 0))
+        return {field.decode('utf-8'): json.loads(data) for field, data in fields.items()}, version
+
+    def read_changed_blueprint(self) -> tuple[dict, int] | None:
+        """
+        Read the saved blueprint if another process has changed it, only its version is read
+        otherwise. A blueprint file is always read
+
+        :return: blueprint(dict), version(int) | None if it has not changed
+        """
+        if self.blueprint_redis is not None:
+            version = int(self.blueprint_redis.hget(self.blueprint_path, self.VERSION_KEY) or 0)
+            if version == self.blueprint_version:
+                return None
+        return self.read_blueprint()
+
+    def apply_blueprint(self, blueprint: dict, version: int) -> None:
+        """
+        Replace the current blueprint by a blueprint that has been read, raises ValueError if a
+        sub needs a codec or a compression that is not installed
+
+        :param blueprint: blueprint read by read_blueprint
+        :param version: version of the blueprint
+        :return: None
+        """
+        # A sub whose codec or compression is not installed raises before anything is replaced
+        sub_options = blueprint.pop(self.OPTIONS_KEY, {})
+        schemas = {sub_name: Schema(sub_attr, sub_options.get(sub_name))
+                   for sub_name, sub_attr in blueprint.items()}
+        self.blueprint = blueprint
+        self.blueprint_version = version
+        self.sub_options = sub_options
+        self.schemas = schemas
+        self.subs.clear()
+
     def load_blueprint(self) -> bool:
         """
-        Load saved blueprint
+        Load saved blueprint, raises ValueError if a sub needs a codec or a compression that is
+        not installed
 
         :return: is_success(bool)
         """
         try:
-            with open(self.blueprint_path, 'r', encoding='UTF-8') as file:
-                self.blueprint = json.loads(file.read())
-        except IOError:
+            blueprint, version = self.read_blueprint()
+        except (IOError, RedisError):
             return False
+        self.apply_blueprint(blueprint, version)
         return True
 
     def save_blueprint(self) -> bool:
         """
-        Save the current blueprint
+        Save the current blueprint, with redis storage only if no other process has changed it
+        since it was loaded
 
         :return: is_success(bool)
         """
         try:
-            with open(self.blueprint_path, 'w+', encoding='UTF-8') as file:
-                file.write(json.dumps(self.blueprint, indent=4))
-        except IOError:
+            blueprint = self.blueprint
+            if self.sub_options:
+                blueprint = {**self.blueprint, self.OPTIONS_KEY: self.sub_options}
+            if self.blueprint_redis is None:
+                with open(self.blueprint_path, 'w+', encoding='UTF-8') as file:
+                    file.write(json.dumps(blueprint, indent=4))
+                return True
+
+            args = []
+            for field, data in blueprint.items():
+                args.extend((field, json.dumps(data)))
+            version = self.blueprint_redis.eval(scripts.BLUEPRINT_SAVE, 1, self.blueprint_path,
+                                                self.blueprint_version, *args)
+        except (IOError, RedisError):
+            return False
+
+        if version == -1:
+            print('The blueprint has been changed by another process, '
+                  'please call "refresh_blueprint()" and try again.')
+            return False
+        self.blueprint_version = version
+        return True
+
+    def refresh_blueprint(self) -> bool:
+        """
+        Load the blueprint again if another process has changed it, only its version is read
+        otherwise
+
+        :return: is_changed(bool)
+        """
+        self.blueprint_checked_at = time.monotonic()
+        try:
+            changed = self.read_changed_blueprint()
+        except (IOError, RedisError):
+            return False
+        if changed is None:
             return False
+        self.apply_blueprint(*changed)
         return True
 
+    def check_blueprint(self) -> None:
+        """
+        Refresh the blueprint, called by sub() once blueprint_refresh seconds have passed since
+        its version was checked
+
+        :return: None
+        """
+        self.refresh_blueprint()
+
     def is_admin(self, passphrase: str) -> bool:
         """
         Check if you can perform administrative task or not
@@ -106,13 +446,34 @@ class Cache:
             return True
         return False
 
-    def create_sub(self, sub_name: str, sub_attr: dict, passphrase: str | None = None) -> bool:
+    def create_sub(self, sub_name: str, sub_attr: dict, passphrase: str | None = None,
+                   codec: str = 'json', is_positional: bool = False,
+                   storage: str = 'string', ttl: int | None = None,
+                   indexes: list[str] | None = None, is_registered: bool = False,
+                   is_hash_tagged: bool = False, compression: str | None = None,
+                   compression_min_size: int = 1024) -> bool:
         """
         Creates new sub in the cache
 
         :param sub_name: sub name, similar to table in SQL
         :param sub_attr: sub attributes, e.g. {"name": "TEXT"}
         :param passphrase: passphrase for administrative level methods
+        :param codec: value codec, json, orjson or msgpack, its package must be installed
+            wherever the cache is used
+        :param is_positional: store the values only, in sub_attr order and without the key
+        :param storage: string stores a row as one value, hash stores a row as a redis hash
+            with one field per column
+        :param ttl: default seconds before a cache expires, None for no expiry
+        :param indexes: columns with a secondary index, for "Sub.find" and "Sub.range"
+        :param is_registered: keep a sorted registry of the sub keys, for "Sub.count",
+            "Sub.page" and enumerating the sub without scanning the whole keyspace. Expired
+            keys are removed from the registry by the writes of expiring cache and by
+            "Sub.count", INTEGER keys beyond 2**53 are rejected
+        :param is_hash_tagged: wrap "<cache_name>/<sub_name>" of the keys in a hash tag, so
+            every key of the sub is kept in one cluster slot, needed by indexes and the
+            registry in cluster mode
+        :param compression: compress the values, zlib, lzma, lz4 or zstd, None for no compression
+        :param compression_min_size: minimum size in bytes of an encoded value to compress
         :return: is_success(bool)
         """
         if passphrase is None:
@@ -122,25 +483,133 @@ class Cache:
             raise ValueError('The given passphrase is not match, sub creation failed.')
         if self.is_sub_exists(sub_name):
             raise KeyError(f'Sub named `{sub_name}` is already exists, sub creation failed.')
+        if sub_name == self.OPTIONS_KEY:
+            raise KeyError(f'Sub name `{sub_name}` is reserved, sub creation failed.')
+        if self.is_sub_deleting(sub_name):
+            raise KeyError(f'Sub named `{sub_name}` is still being deleted, sub creation failed.')
 
         sub_attr_list = list(sub_attr.items())
         key_type = sub_attr_list[0][1]
         if 'real' in key_type or 'boolean' in key_type:
             raise ValueError('The key should be in a TEXT or INTEGER data type.')
 
+        is_spread = (self.is_cluster or self.is_sharded) and not is_hash_tagged
+        if is_spread and (indexes or is_registered):
+            err_msg = 'Indexes and the key registry need "is_hash_tagged=True" on a cluster ' \
+                      'or a sharded cache.'
+            raise ValueError(err_msg)
+
+        sub_options = {}
+        if codec != 'json':
+            sub_options['codec'] = codec
+        if is_positional:
+            sub_options['is_positional'] = True
+        if storage != 'string':
+            sub_options['storage'] = storage
+        if ttl:
+            sub_options['ttl'] = ttl
+        if indexes:
+            sub_options['indexes'] = list(indexes)
+        if is_registered:
+            sub_options['is_registered'] = True
+        if is_hash_tagged:
+            sub_options['is_hash_tagged'] = True
+        if compression:
+            sub_options['compression'] = compression
+            sub_options['compression_min_size'] = compression_min_size
+        schema = Schema(sub_attr, sub_options)
+
         self.blueprint[sub_name] = sub_attr
+        if sub_options:
+            self.sub_options[sub_name] = sub_options
         if self.save_blueprint():
+            self.schemas[sub_name] = schema
             print(f'Sub `{sub_name}` has been created.')
             return True
 
         print(f'Sub creation failed, cannot access `{self.blueprint_path}`.')
         del self.blueprint[sub_name]
+        self.sub_options.pop(sub_name, None)
         return False
 
-    def delete_sub(self, sub_name: str, passphrase: str | None = None) -> bool:
+    def set_compression(self, sub_name: str, compression: str | None = None,
+                        min_size: int = 1024, passphrase: str | None = None) -> bool:
+        """
+        Change the compression of an existing sub, the cache already written is still read,
+        compressed or not
+
+        :param sub_name: sub name, similar to table in SQL
+        :param compression: compress the values, zlib, lzma, lz4 or zstd, None for no compression
+        :param min_size: minimum size in bytes of an encoded value to compress
+        :param passphrase: passphrase for administrative level methods
+        :return: is_success(bool)
+        """
+        if passphrase is None:
+            err_msg = 'Please provide "passphrase" in the args to perform administrative methods.'
+            raise ValueError(err_msg)
+        if not self.is_admin(passphrase):
+            raise ValueError('The given passphrase is not match, compression change failed.')
+        if not self.is_sub_exists(sub_name):
+            raise KeyError(f'There is no Sub named `{sub_name}`. Compression change failed.')
+
+        temp_sub_options = self.sub_options.get(sub_name)
+        sub_options = dict(temp_sub_options or {})
+        sub_options.pop('compression', None)
+        sub_options.pop('compression_min_size', None)
+        if compression:
+            sub_options['compression'] = compression
+            sub_options['compression_min_size'] = min_size
+        schema = Schema(self.blueprint[sub_name], sub_options)
+
+        self.sub_options[sub_name] = sub_options
+        if not sub_options:
+            del self.sub_options[sub_name]
+        if self.save_blueprint():
+            self.schemas[sub_name] = schema
+            self.subs.pop(sub_name, None)
+            print(f'Compression of sub `{sub_name}` has been set to `{compression or "none"}`.')
+            return True
+
+        print(f'Compression change failed, cannot access `{self.blueprint_path}`.')
+        self.sub_options.pop(sub_name, None)
+        if temp_sub_options is not None:
+            self.sub_options[sub_name] = temp_sub_options
+        return False
+
+    def delete_sub(self, sub_name: str, passphrase: str | None = None, batch_size: int = 1000,
+                   is_background: bool = False,
+                   on_progress: Callable[[str, int], None] | None = None) -> bool:
         """
         Delete existing sub from the cache, and its cache
 
+        :param sub_name: sub name, similar to table in SQL
+        :param passphrase: passphrase for administrative level methods
+        :param batch_size: number of keys per registry or SCAN page and per UNLINK batch
+        :param is_background: remove the cache rows in a background thread
+        :param on_progress: called as on_progress(sub_name, removed) after every batch
+        :return: is_success(bool)
+        """
+        sub = self.sub(sub_name) if self.is_sub_exists(sub_name) else None
+        if not self.remove_sub_blueprint(sub_name, passphrase):
+            return False
+
+        if is_background:
+            thread = Thread(target=self.delete_sub_rows, args=(sub, batch_size, on_progress),
+                            name=f'delete_sub-{self.cache_name}/{sub_name}', daemon=True)
+            self.teardowns[sub_name] = thread
+            thread.start()
+            print(f'Sub `{sub_name}` has been deleted, its cache is being removed.')
+            return True
+
+        with self.measure(sub_name, 'delete_sub'):
+            self.delete_sub_rows(sub, batch_size, on_progress)
+        print(f'Sub `{sub_name}` has been deleted.')
+        return True
+
+    def remove_sub_blueprint(self, sub_name: str, passphrase: str | None = None) -> bool:
+        """
+        Remove existing sub from the blueprint, leaving its cache rows untouched
+
         :param sub_name: sub name, similar to table in SQL
         :param passphrase: passphrase for administrative level methods
         :return: is_success(bool)
@@ -153,40 +622,238 @@ class Cache:
         if not self.is_sub_exists(sub_name):
             raise KeyError(f'There is no Sub named `{sub_name}`. Sub deletion failed.')
 
-        temp_sub = self.blueprint[sub_name]
-        del self.blueprint[sub_name]
+        temp_sub = self.blueprint.pop(sub_name)
+        temp_sub_options = self.sub_options.pop(sub_name, None)
 
-        is_del_rows_success = False
-        temp_redis = {}
-        try:
-            prefix = f'{self.cache_name}/{sub_name}/'
-            for key in self.redis.scan_iter(f'prefix:{prefix}*'):
-                temp_redis[key] = self.redis.get(key)
-                self.redis.delete(key)
-            is_del_rows_success = True
-        except NameError:
-            pass
-
-        if is_del_rows_success:
-            if self.save_blueprint():
-                print(f'Sub `{sub_name}` has been deleted.')
-                return True
+        # The blueprint goes first, the rows are not copied so they can not be restored
+        if not self.save_blueprint():
+            print('Sub deletion failed. No sub has been deleted.')
+            self.blueprint[sub_name] = temp_sub
+            if temp_sub_options is not None:
+                self.sub_options[sub_name] = temp_sub_options
+            return False
 
-        print('Sub deletion failed. No sub has been deleted.')
-        self.blueprint[sub_name] = temp_sub
-        self.redis.mset(temp_redis)
+        self.schemas.pop(sub_name, None)
+        self.subs.pop(sub_name, None)
+        self.remove_near_cache(sub_name)
+        self.remove_loader(sub_name)
+        return True
+
+    @staticmethod
+    def delete_sub_rows(sub: Sub, batch_size: int = 1000,
+                        on_progress: Callable[[str, int], None] | None = None) -> int:
+        """
+        Remove all cache rows of a sub with batched UNLINK, the keys are read from the key
+        registry of a registered sub or by SCAN otherwise
+
+        :param sub: Sub object of the sub to be emptied
+        :param batch_size: number of keys per registry or SCAN page and per UNLINK batch
+        :param on_progress: called as on_progress(sub_name, removed) after every batch
+        :return: number of keys removed(int)
+        """
+        removed = 0
+        for complete_keys in sub.iter_complete_keys(batch_size):
+            removed += sub.unset_many(complete_keys, is_key_complete=True, is_unlink=True)
+            if on_progress is not None:
+                on_progress(sub.query_builder.sub_name, removed)
+
+        sub.drop_indexes()
+        return removed
+
+    def is_sub_deleting(self, sub_name: str) -> bool:
+        """
+        Check if the cache rows of a deleted sub are still being removed in the background
+
+        :param sub_name: sub name, similar to table in SQL
+        :return: is_deleting(bool)
+        """
+        thread = self.teardowns.get(sub_name)
+        if thread is None:
+            return False
+        if thread.is_alive():
+            return True
+
+        del self.teardowns[sub_name]
         return False
 
+    def setup_near_cache(self, sub_name: str, max_entries: int | None = 10000,
+                         max_bytes: int | None = None, ttl: float | None = 60.0,
+                         is_tracking: bool = True) -> NearCache:
+        """
+        Set up an in-process cache of decoded rows in front of a sub, used by get and get_many
+
+        :param sub_name: sub name, similar to table in SQL
+        :param max_entries: maximum number of rows, None for no limit
+        :param max_bytes: maximum estimated size of the rows in bytes, None for no limit
+        :param ttl: seconds a row is served before it is read from redis again, None for no ttl
+        :param is_tracking: keep the rows coherent with the writes of other clients, through
+            CLIENT TRACKING or keyspace notifications, a ValueError is raised if the server
+            supports neither CLIENT TRACKING nor the "Kg$hxe" keyspace events
+        :return: NearCache object
+        """
+        if not self.is_sub_exists(sub_name):
+            raise NameError(f'There is no sub named `{sub_name}.`')
+
+        connection_kwargs = {'host': self.redis_host, 'port': self.redis_port}
+        query_builder = self.query_builder(sub_name)
+        if is_tracking and (self.is_cluster or self.is_sharded):
+            # The writes of a sub are only tracked on one node if the sub is hash tagged
+            if query_builder.is_cluster:
+                err_msg = 'A tracked near cache needs "is_hash_tagged=True" on a cluster or ' \
+                          'a sharded cache.'
+                raise ValueError(err_msg)
+            node_kwargs = query_builder.redis.connection_pool.connection_kwargs
+            connection_kwargs = {'host': node_kwargs['host'], 'port': node_kwargs['port']}
+
+        self.remove_near_cache(sub_name)
+        near_cache = NearCache(max_entries, max_bytes, ttl)
+        if is_tracking:
+            near_cache.invalidator = NearCacheInvalidator(
+                near_cache, connection_kwargs, query_builder.key_prefix)
+            near_cache.invalidator.start()
+            near_cache.invalidator.is_ready.wait(5)
+            if near_cache.invalidator.error is not None:
+                raise near_cache.invalidator.error
+
+        self.near_caches[sub_name] = near_cache
+        self.subs.pop(sub_name, None)
+        return near_cache
+
+    def remove_near_cache(self, sub_name: str) -> None:
+        """
+        Remove the in-process cache of a sub, if any
+
+        :param sub_name: sub name, similar to table in SQL
+        :return: None
+        """
+        near_cache = self.near_caches.pop(sub_name, None)
+        if near_cache is None:
+            return
+        self.subs.pop(sub_name, None)
+
+        if near_cache.invalidator is not None:
+            near_cache.invalidator.stop()
+        near_cache.clear()
+
+    def reset_near_caches(self) -> None:
+        """
+        Set up the tracked near caches again, after the node owning their sub might have changed
+
+        :return: None
+        """
+        for sub_name, near_cache in list(self.near_caches.items()):
+            if near_cache.invalidator is not None:
+                self.setup_near_cache(sub_name, near_cache.max_entries, near_cache.max_bytes,
+                                      near_cache.ttl)
+
+    def setup_loader(self, sub_name: str, window_ms: float = 1.0,
+                     max_batch: int = 1000) -> GetLoader:
+        """
+        Coalesce the concurrent get calls of a sub into one get_many per window, a key already
+        being read is not read again
+
+        :param sub_name: sub name, similar to table in SQL
+        :param window_ms: milliseconds the first get of a window waits for more calls
+        :param max_batch: number of keys that ends the window early
+        :return: GetLoader object
+        """
+        if not self.is_sub_exists(sub_name):
+            raise NameError(f'There is no sub named `{sub_name}.`')
+
+        loader = self.LOADER(window_ms, max_batch)
+        self.loaders[sub_name] = loader
+        self.subs.pop(sub_name, None)
+        return loader
+
+    def remove_loader(self, sub_name: str) -> None:
+        """
+        Stop coalescing the get calls of a sub, if it does
+
+        :param sub_name: sub name, similar to table in SQL
+        :return: None
+        """
+        self.loaders.pop(sub_name, None)
+        self.subs.pop(sub_name, None)
+
+    def setup_metrics(self, metrics: Metrics | None = None,
+                      hooks: list[Callable[[dict], None]] | None = None) -> Metrics:
+        """
+        Record the latency of every sub operation, split into the validate, serialize, network
+        and deserialize phases, with counters of round trips, keys, bytes and validation
+        failures. Subs are not measured until it is called
+
+        :param metrics: a Metrics object to share between caches, a new one if not given
+        :param hooks: called as hook(event) after every operation, see Metrics
+        :return: Metrics object
+        """
+        if metrics is None:
+            metrics = Metrics()
+        for hook in hooks or []:
+            metrics.add_hook(hook)
+
+        self.metrics = metrics
+        self.subs.clear()
+        return metrics
+
+    def remove_metrics(self) -> None:
+        """
+        Stop recording the sub operations
+
+        :return: None
+        """
+        self.metrics = None
+        self.subs.clear()
+
+    def measure(self, sub_name: str, operation_name: str):
+        """
+        Measure the operation run inside the with block, if metrics are set up
+
+        :param sub_name: sub name, empty for an operation of the whole cache
+        :param operation_name: operation name, e.g. delete_sub
+        :return: context manager
+        """
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.measure(self.cache_name, sub_name, operation_name)
+
     def sub(self, sub_name: str) -> Sub:
         """
-        The cache query builder starts here, get the specified sub to starts query
+        The cache query builder starts here, get the specified sub to starts query.
+        The Sub object of a sub is built once and reused
 
         :param sub_name: sub name, similar to table in SQL
         :return: Sub object
         """
+        if self.blueprint_refresh is not None and self.blueprint_redis is not None and \
+                time.monotonic() - self.blueprint_checked_at >= self.blueprint_refresh:
+            self.check_blueprint()
+
+        sub = self.subs.get(sub_name)
+        if sub is None:
+            if not self.is_sub_exists(sub_name):
+                raise NameError(f'There is no sub named `{sub_name}.`')
+            sub_class = self.SUB if self.metrics is None else self.METERED_SUB
+            sub = self.subs[sub_name] = sub_class(self.query_builder(sub_name))
+        return sub
+
+    def query_builder(self, sub_name: str) -> QueryBuilder:
+        """
+        Get the QueryBuilder of the specified sub
+
+        :param sub_name: sub name, similar to table in SQL
+        :return: QueryBuilder object
+        """
         if not self.is_sub_exists(sub_name):
             raise NameError(f'There is no sub named `{sub_name}.`')
 
-        qb = QueryBuilder(self.redis, self.cache_name, sub_name, self.blueprint[sub_name])
-
-        return Sub(qb)
+        redis = self.redis
+        near_cache = self.near_caches.get(sub_name)
+        if self.replicas and near_cache is not None and near_cache.invalidator is not None:
+            # A lagging replica could refill a row after its invalidation, a tracked near cache
+            # reads from the primary
+            redis = self.redis.primary
+        query_builder_class = QueryBuilder if self.metrics is None else MeteredQueryBuilder
+        return query_builder_class(redis, self.cache_name, sub_name,
+                                   self.blueprint[sub_name], self.schemas[sub_name], near_cache,
+                                   self.node_client if self.is_cluster or self.is_sharded else None,
+                                   self.loaders.get(sub_name), self.metrics)
@@ -0,0 +1,219 @@
+""" Server-side aggregations of sub rows """
+
+import json
+
+from querybuilder.compression import HEADERS
+from querybuilder.schema import Schema
+
+AGGREGATIONS = ('count', 'sum', 'min', 'max', 'avg')
+
+
+class Aggregation:
+    """
+    An aggregation of a column of the sub, optionally grouped by another column and filtered by
+    the values of some columns. Chunks of rows are aggregated on the server by the AGGREGATE
+    script, their partial results are merged here with the rows it could not decode
+
+    methods:
+        get_tag(data) -> tag(str)
+        get_spec() -> spec(str)
+        add(tag,rows,count,total,low,high) -> None
+        add_results(results) -> (skipped_keys, missing_keys)
+        add_rows(complete_vals) -> None
+        get_group(tag) -> group
+        build() -> result
+    """
+
+    def __init__(self, schema: Schema, func: str = 'count', col_name: str | None = None,
+                 group_by: str | None = None, conditions: dict | None = None):
+        """
+        Aggregation initialization
+
+        :param schema: the schema of the sub
+        :param func: count, sum, min, max or avg
+        :param col_name: the aggregated column, None to count the rows
+        :param group_by: the column to group the rows by, None for a single group
+        :param conditions: column and value pairs the rows must match, e.g. {"status": True}
+        """
+        if func not in AGGREGATIONS:
+            err_msg = f'Unknown aggregation `{func}`, available aggregations: ' \
+                      f'{", ".join(AGGREGATIONS)}.'
+            raise ValueError(err_msg)
+        if col_name is None and func != 'count':
+            raise ValueError(f'Please provide the column to {func}.')
+        conditions = conditions if conditions is not None else {}
+        for name in (col_name, group_by, *conditions):
+            if name is None:
+                continue
+            if name not in schema.checks_by_col:
+                raise ValueError(f'Can not aggregate `{name}`, it is not a column of the sub.')
+            if name == schema.key_name:
+                raise ValueError(f'Can not aggregate `{name}`, it is the key of the sub.')
+        if func != 'count' and schema.checks_by_col[col_name][2] not in (int, float):
+            raise ValueError(f'Can not {func} `{col_name}`, it is not an INTEGER or REAL column.')
+
+        self.schema = schema
+        self.func = func
+        self.col_name = col_name
+        self.group_by = group_by
+        self.conditions = conditions
+        self.condition_tags = [(name, self.get_tag(data)) for name, data in conditions.items()]
+        # Partial results of every group: rows, non-null values, sum, min and max
+        self.groups = {}
+
+        # The columns read from every row, the script refers to them by their index
+        self.ref_names = []
+        for name in (col_name, group_by, *conditions):
+            if name is not None and name not in self.ref_names:
+                self.ref_names.append(name)
+        self.spec = self.get_spec()
+
+    @staticmethod
+    def get_tag(data) -> str:
+        """
+        Tag a value the way the AGGREGATE script does, the values are grouped and compared by
+        their tag, so 1 and 1.0 are equal and True and 1 are not
+
+        :param data: a column value
+        :return: tag(str)
+        """
+        if data is None:
+            return 'n'
+        if isinstance(data, bool):
+            return 't' if data else 'f'
+        if isinstance(data, (int, float)):
+            return f'd{float(data):.17g}'
+        return f's{data}'
+
+    def get_spec(self) -> str:
+        """
+        Generates the ARGV[1] of the AGGREGATE script
+
+        :return: spec(str)
+        """
+        codec = self.schema.codec
+        refs = self.ref_names
+        if not self.schema.is_hash and codec.is_positional:
+            # Lua arrays start at 1
+            refs = [codec.val_names.index(name) + 1 for name in refs]
+
+        def get_index(name: str | None) -> int:
+            return 0 if name is None else self.ref_names.index(name) + 1
+
+        return json.dumps({
+            'decoder': 'msgpack' if codec.name == 'msgpack' else 'json',
+            'is_hash': self.schema.is_hash,
+            'headers': list(HEADERS),
+            'refs': refs,
+            'col': get_index(self.col_name),
+            'group': get_index(self.group_by),
+            'where': [[get_index(name), data] for name, data in self.conditions.items()],
+        })
+
+    def add(self, tag: str, rows: int, count: int, total: int | float,
+            low: int | float | None, high: int | float | None) -> None:
+        """
+        Merge a partial result into its group
+
+        :param tag: the tag of the group value, empty without group_by
+        :param rows: number of rows
+        :param count: number of non-null values of the column
+        :param total: sum of the values
+        :param low: min of the values, None if there is none
+        :param high: max of the values, None if there is none
+        :return: None
+        """
+        group = self.groups.get(tag)
+        if group is None:
+            self.groups[tag] = [rows, count, total, low, high]
+            return
+        group[0] += rows
+        group[1] += count
+        group[2] += total
+        if low is not None and (group[3] is None or low < group[3]):
+            group[3] = low
+        if high is not None and (group[4] is None or high > group[4]):
+            group[4] = high
+
+    def add_results(self, results: list) -> tuple[list, list]:
+        """
+        Merge the result of the AGGREGATE script on a chunk of rows
+
+        :param results: the script result
+        :return: (skipped_keys, missing_keys), the complete keys of the rows the script could
+            not decode, and of the rows that do not exist
+        """
+        partials, skipped_keys, missing_keys = results
+        as_number = int if self.col_name is not None and \
+            self.schema.checks_by_col[self.col_name][2] is int else float
+        for i in range(0, len(partials), 6):
+            tag, rows, count, total, low, high = (
+                data.decode('utf-8') if isinstance(data, bytes) else data
+                for data in partials[i:i + 6])
+            self.add(tag, int(rows), int(count), as_number(float(total)),
+                     as_number(float(low)) if low else None,
+                     as_number(float(high)) if high else None)
+        return skipped_keys, missing_keys
+
+    def add_rows(self, complete_vals: list[dict | None]) -> None:
+        """
+        Aggregate rows decoded in python, the rows the script could not decode
+
+        :param complete_vals: complete cache values, None for every key that does not exist
+        :return: None
+        """
+        for complete_val in complete_vals:
+            if complete_val is None:
+                continue
+            if any(self.get_tag(complete_val.get(name)) != tag
+                   for name, tag in self.condition_tags):
+                continue
+            tag = '' if self.group_by is None else self.get_tag(complete_val.get(self.group_by))
+            data = None if self.col_name is None else complete_val.get(self.col_name)
+            if isinstance(data, (int, float)) and not isinstance(data, bool):
+                self.add(tag, 1, 1, data, data, data)
+            else:
+                self.add(tag, 1, int(data is not None), 0, None, None)
+
+    def get_group(self, tag: str):
+        """
+        Convert the tag of a group back into the value of the group_by column
+
+        :param tag: the tag of the group value
+        :return: the group value
+        """
+        if tag == 'n':
+            return None
+        if tag in ('t', 'f'):
+            return tag == 't'
+        if tag[0] == 'd':
+            return int(float(tag[1:])) if self.schema.checks_by_col[self.group_by][2] is int \
+                else float(tag[1:])
+        return tag[1:]
+
+    def build(self):
+        """
+        Build the result of the aggregation
+
+        :return: result, a number or None if there is no value to aggregate, or a dict of group
+            value and result pairs with group_by
+        """
+        results = {}
+        for tag, (rows, count, total, low, high) in self.groups.items():
+            if self.func == 'count':
+                result = rows if self.col_name is None else count
+            elif count == 0:
+                result = None
+            elif self.func == 'sum':
+                result = total
+            elif self.func == 'min':
+                result = low
+            elif self.func == 'max':
+                result = high
+            else:
+                result = total / count
+            results[tag] = result
+
+        if self.group_by is None:
+            return results.get('', 0 if self.func == 'count' else None)
+        return {self.get_group(tag): result for tag, result in results.items()}
@@ -0,0 +1,142 @@
+""" Cache sub class for asyncio """
+
+import asyncio
+from contextlib import closing
+from typing import Any, AsyncIterator, Awaitable, Callable, Generator
+
+from querybuilder.base_sub import BaseSub
+from querybuilder.batch_writer import AsyncBatchWriter
+
+
+class AsyncSub(BaseSub):
+    """
+    Cache sub class for asyncio, the awaitable counterpart of Sub. The queries are the plans of
+    BaseSub, AsyncSub awaits their redis calls, so every query returns an awaitable, and
+    iter_complete_keys and iter_all return async iterators
+
+    methods:
+        run(plan_) -> result
+        iterate(plan_) -> items(AsyncIterator)
+        execute(queue,is_transaction,raise_on_error) -> results(list)
+        merge(complete_key,partial_val) -> is_updated(bool)
+        next_of(iterator) -> item
+        run_blocking(func,*args) -> result
+        sleep(seconds) -> None
+        single_loader(loader) -> batch_loader(Callable)
+    """
+
+    BATCH_WRITER = AsyncBatchWriter
+
+    # pylint: disable=W0236,W0221,W0718
+    async def run(self, plan_: Generator) -> Any:
+        """
+        Await the redis calls of a plan, an error of a call is raised into the plan
+
+        :param plan_: generator yielding the redis calls
+        :return: the value the plan returns
+        """
+        result, error = None, None
+        while True:
+            try:
+                call = plan_.send(result) if error is None else plan_.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = await call(), None
+            except BaseException as exc:
+                result, error = None, exc
+
+    async def iterate(self, plan_: Generator) -> AsyncIterator:
+        """
+        Await the redis calls of an iterator plan and yield its items, an error of a call is
+        raised into the plan
+
+        :param plan_: generator yielding the redis calls and the items
+        :return: an async iterator of the items
+        """
+        result, error = None, None
+        with closing(plan_):
+            while True:
+                try:
+                    step = plan_.send(result) if error is None else plan_.throw(error)
+                except StopIteration:
+                    return
+                if not callable(step):
+                    result, error = None, None
+                    yield step
+                    continue
+                try:
+                    result, error = await step(), None
+                except BaseException as exc:
+                    result, error = None, exc
+
+    async def execute(self, queue: Callable, is_transaction: bool = True,
+                      raise_on_error: bool = True) -> list:
+        """
+        Queue commands into a pipeline and send it
+
+        :param queue: called as queue(pipe)
+        :param is_transaction: wrap the commands in MULTI/EXEC
+        :param raise_on_error: raise the first command error instead of returning it
+        :return: the command results
+        """
+        async with self.query_builder.pipeline(is_transaction) as pipe:
+            queue(pipe)
+            return await pipe.execute(raise_on_error=raise_on_error)
+
+    async def merge(self, complete_key: str, partial_val: dict) -> bool:
+        """
+        Update some columns of an existing string row in a WATCH transaction
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param partial_val: the validated columns to update
+        :return: is_updated(bool), False if the row does not exist
+        """
+        async def update_val(pipe) -> bool:
+            return self.query_builder.queue_merge(pipe, complete_key, await pipe.get(complete_key),
+                                                  partial_val)
+
+        redis = self.query_builder.get_redis(complete_key)
+        return await redis.transaction(update_val, complete_key, value_from_callable=True)
+
+    def next_of(self, iterator: AsyncIterator) -> Awaitable:
+        """
+        Get the next item of an async iterator
+
+        :param iterator: an async iterator
+        :return: an awaitable of the next item, None once the iterator is exhausted
+        """
+        return anext(iterator, None)
+
+    def run_blocking(self, func: Callable, *args) -> Awaitable:
+        """
+        Call a function that blocks on file I/O in a thread
+
+        :param func: the blocking function
+        :param args: its arguments
+        :return: an awaitable of its result
+        """
+        return asyncio.to_thread(func, *args)
+
+    def sleep(self, seconds: float) -> Awaitable:
+        """
+        Wait before the next attempt
+
+        :param seconds: the time to wait
+        :return: an awaitable
+        """
+        return asyncio.sleep(seconds)
+
+    def single_loader(self, loader: Callable[[str | int], Awaitable[dict | None]])\
+            -> Callable[[list], Awaitable[dict]]:
+        """
+        Make the batch_loader of get_many_or_load out of the loader of get_or_load
+
+        :param loader: awaited as loader(key), returns the val of the cache
+        :return: batch_loader, awaited as batch_loader([key])
+        """
+        async def load_one(keys: list) -> dict:
+            return {keys[0]: await loader(keys[0])}
+
+        return load_one
+    # pylint: enable=W0236,W0221,W0718
@@ -0,0 +1,1069 @@
+""" Cache sub logic shared by Sub and AsyncSub """
+
+import functools
+import os
+import time
+import uuid
+from typing import IO, Callable, Generator, Iterator
+
+from querybuilder.aggregation import Aggregation
+from querybuilder.batch_writer import BatchWriter
+from querybuilder.bulk import RowWriter, get_report
+from querybuilder.columns import ColumnBuilder, check_result_format
+from querybuilder.querybuilder import QueryBuilder
+
+
+def plan(method: Callable) -> Callable:
+    """
+    Make a sub method out of a plan, a generator that yields every redis call to make as a
+    callable and is sent its result back. The method returns what "run" makes of the plan,
+    its return value with Sub, or an awaitable of it with AsyncSub
+
+    :param method: the plan, a generator function
+    :return: the sub method
+    """
+    @functools.wraps(method)
+    def run_plan(self, *args, **kwargs):
+        return self.run(method(self, *args, **kwargs))
+
+    return run_plan
+
+
+def iter_plan(method: Callable) -> Callable:
+    """
+    Make an iterator sub method out of a plan that also yields the items of the iterator,
+    every callable it yields is a redis call and anything else is an item. The method returns
+    what "iterate" makes of the plan, an iterator with Sub, or an async iterator with AsyncSub
+
+    :param method: the plan, a generator function
+    :return: the sub method
+    """
+    @functools.wraps(method)
+    def iterate_plan(self, *args, **kwargs):
+        return self.iterate(method(self, *args, **kwargs))
+
+    return iterate_plan
+
+
+class BaseSub:
+    """
+    Cache sub logic shared by Sub and AsyncSub. Every operation is a plan yielding its redis
+    calls, Sub and AsyncSub only make the calls, with redis or redis.asyncio
+
+    methods:
+        get_complete_key(key) -> complete_key(str)
+        get(key,is_key_complete,fields,format_) -> value(dict) | None
+        get_many(keys,is_key_complete,fields,format_) -> values(list[dict | None]) | columns(dict)
+        fetch(complete_key,fields,format_) -> value(dict) | None
+        fetch_many(complete_keys,fields,format_) -> values(list[dict | None])
+        fetch_columns(complete_keys,builder,is_missing_skipped) -> missing_keys(list)
+        fetch_existing(complete_keys,fields) -> values(list[dict])
+        get_all(batch_size,fields,format_) -> values(list[dict]) | columns(dict)
+        iter_complete_keys(batch_size) -> complete_keys(Iterator[list[str]])
+        iter_all(batch_size,fields) -> values(Iterator[dict])
+        get_complete_val(key,val) -> complete_val(dict)
+        set(key,val,is_key_complete,is_val_complete,ttl) -> is_success(bool)
+        set_many(key_vals,is_key_complete,is_val_complete,ttl) -> is_success(bool)
+        write_batch(complete_key_vals,ttl) -> None
+        batch_writer(max_items,max_delay_ms,max_pending,ttl,on_error) -> writer(BatchWriter)
+        get_or_load(key,loader,ttl,fields,lock_ms,wait_ms,beta) -> value(dict) | None
+        get_many_or_load(keys,batch_loader,ttl,fields,lock_ms,wait_ms,beta) -> values(list)
+        load_rows(complete_keys,keys_by_complete_key,batch_loader,ttl,token) -> rows(dict)
+        update(key,partial_val,is_key_complete) -> is_success(bool)
+        ttl(key,is_key_complete) -> ttl(int)
+        touch(keys,is_key_complete,ttl) -> touched(int)
+        find(limit,fields,**conditions) -> values(list[dict])
+        range(col_name,low,high,limit,fields,is_desc) -> values(list[dict])
+        get_indexed(complete_keys,fields) -> values(list[dict])
+        prune(complete_keys) -> None
+        expire(limit) -> checked(int)
+        drop_indexes() -> removed(int)
+        count() -> count(int)
+        aggregate(func,col_name,group_by,batch_size,**conditions) -> result
+        aggregate_keys(complete_keys,aggregation) -> None
+        page(after,limit,fields) -> values(list[dict])
+        import_from(path_or_stream,format_,chunk_size,ttl,on_error,on_progress) -> report(dict)
+        export_to(path_or_stream,format_,batch_size,fields,on_progress) -> report(dict)
+        unset(key,is_key_complete) -> is_success(bool)
+        unset_many(keys,is_key_complete,is_unlink,chunk_size) -> removed(int)
+        unset_all(batch_size,is_unlink) -> removed(int)
+    """
+
+    # Writer returned by "batch_writer()", AsyncSub returns AsyncBatchWriter
+    BATCH_WRITER = BatchWriter
+
+    def __init__(self, query_builder: QueryBuilder):
+        """
+        Query Builder initialization
+
+        :param query_builder: QueryBuilder object contains redis connection and sub info
+        """
+        self.query_builder = query_builder
+
+    def get_complete_key(self, key: str | int) -> str:
+        """
+        Generates a complete key "<cache_name>/<sub_name>/<key>"
+
+        :param key: the key of a sub, the value of first element in the sub_attr
+        :return: complete_key in "<cache_name>/<sub_name>/<key>" format
+        """
+        return self.query_builder.get_complete_key(key)
+
+    # noinspection PyTypeChecker
+    @plan
+    def get(self, key: str | int, is_key_complete: bool = False,
+            fields: list[str] | None = None, format_: str = 'rows') -> dict | None:
+        """
+        Get cache from a key
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :param fields: only return these columns, read with HMGET on hash storage
+        :param format_: rows for a dict, lazy for a LazyRow decoded on first access, raw for
+            the value as it is stored, lazy and raw rows are read from redis
+        :return: value(dict)
+        """
+        complete_key = key if is_key_complete else self.get_complete_key(key)
+        if format_ != 'rows':
+            return (yield lambda: self.fetch(complete_key, fields, format_))
+        near_cache = self.query_builder.near_cache
+        loader = self.query_builder.loader
+        if near_cache is None and loader is None:
+            return (yield lambda: self.fetch(complete_key, fields))
+
+        complete_val = near_cache.get(complete_key) if near_cache is not None else None
+        if complete_val is None and loader is not None:
+            # Concurrent misses are read with one get_many, which fills the near cache too
+            complete_val = yield lambda: loader.load(
+                complete_key, lambda complete_keys: self.get_many(complete_keys, True))
+        elif complete_val is None:
+            generation = near_cache.generation
+            complete_val = yield lambda: self.fetch(complete_key)
+            near_cache.put(complete_key, complete_val, generation)
+
+        return self.query_builder.project(complete_val, fields)
+
+    @plan
+    def fetch(self, complete_key: str, fields: list[str] | None = None,
+              format_: str = 'rows') -> dict | None:
+        """
+        Get cache from a complete key from redis, skipping the near cache
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param fields: only return these columns, read with HMGET on hash storage
+        :param format_: rows for a dict, lazy for a LazyRow decoded on first access, raw for
+            the value as it is stored
+        :return: value(dict)
+        """
+        if format_ != 'rows':
+            self.query_builder.check_row_format(format_, fields)
+        val = yield lambda: self.query_builder.queue_get(self.query_builder.redis, complete_key,
+                                                         fields)
+        return self.query_builder.decode_row(val, complete_key, fields, format_)
+
+    @plan
+    def get_many(self, keys: list[str] | list[int], is_key_complete: bool = False,
+                 fields: list[str] | None = None,
+                 format_: str = 'rows') -> list[dict | None] | dict:
+        """
+        Get cache from a key list
+
+        :param keys: a key list
+        :param is_key_complete: is key already in complete form or not
+        :param fields: only return these columns, read with pipelined HMGET on hash storage
+        :param format_: rows for a list of dicts, columns for one list per column, or one NumPy
+            masked array per column typed from sub_attr if NumPy is installed, lazy for LazyRow
+            objects decoded on first access, raw for the values as they are stored, lazy and
+            raw rows are read from redis
+        :return: value list, or {"columns": {col_name: column}, "missing": mask} with columns,
+            the mask is True for every key that does not exist
+        """
+        complete_keys = self.query_builder.get_complete_keys(keys, is_key_complete)
+        near_cache = self.query_builder.near_cache
+        if format_ in ('lazy', 'raw'):
+            return (yield lambda: self.fetch_many(complete_keys, fields, format_))
+        if format_ != 'rows':
+            check_result_format(format_)
+            builder = ColumnBuilder(self.query_builder.schema, fields)
+            if near_cache is None:
+                yield lambda: self.fetch_columns(complete_keys, builder)
+                return builder.build()
+            builder.add_rows((yield lambda: self.get_many(complete_keys, True, fields)))
+            return builder.build()
+
+        if near_cache is None:
+            return (yield lambda: self.fetch_many(complete_keys, fields))
+
+        complete_vals = near_cache.get_many(complete_keys)
+        missing_keys = self.query_builder.get_missing_keys(complete_keys, complete_vals)
+        if missing_keys:
+            generation = near_cache.generation
+            missing_vals = yield lambda: self.fetch_many(missing_keys)
+            near_cache.put_many(missing_keys, missing_vals, generation)
+            complete_vals = self.query_builder.fill_missing(complete_vals, missing_vals)
+
+        return self.query_builder.project_many(complete_vals, fields)
+
+    @plan
+    def fetch_many(self, complete_keys: list[str], fields: list[str] | None = None,
+                   format_: str = 'rows') -> list[dict | None]:
+        """
+        Get cache from a complete key list from redis, skipping the near cache
+
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param fields: only return these columns, read with pipelined HMGET on hash storage
+        :param format_: rows for dicts, lazy for LazyRow objects decoded on first access, raw
+            for the values as they are stored
+        :return: value list
+        """
+        if format_ != 'rows':
+            self.query_builder.check_row_format(format_, fields)
+        vals = yield lambda: self.read_rows(complete_keys, fields)
+        return self.query_builder.decode_rows(vals, complete_keys, fields, format_)
+
+    @plan
+    def fetch_columns(self, complete_keys: list[str], builder: ColumnBuilder,
+                      is_missing_skipped: bool = False) -> list[str]:
+        """
+        Get cache from a complete key list from redis into a column builder, skipping the near
+        cache
+
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param builder: collects the columns, only its fields are read
+        :param is_missing_skipped: leave the keys that do not exist out of the columns
+        :return: missing_keys(list), the complete keys that do not exist
+        """
+        vals = yield lambda: self.read_rows(complete_keys, builder.fields)
+        return self.query_builder.decode_columns(builder, vals, complete_keys,
+                                                 is_missing_skipped)
+
+    def read_rows(self, complete_keys: list[str], fields: list[str] | None = None):
+        """
+        Read the stored values of a complete key list, with pipelined HMGET on hash storage
+        or MGET on string storage
+
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param fields: only read these columns of a hash row
+        :return: the values as they are stored, or an awaitable of them with AsyncSub
+        """
+        if self.query_builder.schema.is_hash:
+            return self.execute(lambda pipe: self.query_builder.queue_get_many(
+                pipe, complete_keys, fields), False)
+        return self.query_builder.queue_mget(self.query_builder.redis, complete_keys)
+
+    @plan
+    def fetch_existing(self, complete_keys: list[bytes | str],
+                       fields: list[str] | None = None) -> list[dict]:
+        """
+        Get the cache of a complete key list that still exist from redis, the index and
+        registry entries of the keys unset or expired since they were listed are pruned
+
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param fields: only return these columns
+        :return: list of values
+        """
+        vals = yield lambda: self.fetch_many(complete_keys, fields)
+        expired_keys = self.query_builder.get_missing_keys(complete_keys, vals)
+        if expired_keys:
+            yield lambda: self.prune(expired_keys)
+        return [val for val in vals if val is not None]
+
+    @plan
+    def get_all(self, batch_size: int = 1000, fields: list[str] | None = None,
+                format_: str = 'rows') -> list[dict] | dict:
+        """
+        Get all cache in the current cache context
+
+        :param batch_size: number of keys per SCAN page and per MGET
+        :param fields: only return these columns
+        :param format_: rows for a list of dicts, columns for one list per column, or one NumPy
+            masked array per column typed from sub_attr if NumPy is installed
+        :return: list of values, or {"columns": {col_name: column}, "missing": mask} with
+            columns
+        """
+        pages = self.iter_complete_keys(batch_size)
+        if format_ == 'rows':
+            vals = []
+            while (complete_keys := (yield lambda: self.next_of(pages))) is not None:
+                vals.extend((yield lambda: self.fetch_existing(complete_keys, fields)))
+            return vals
+
+        check_result_format(format_)
+        builder = ColumnBuilder(self.query_builder.schema, fields)
+        while (complete_keys := (yield lambda: self.next_of(pages))) is not None:
+            # The key might be unset or expired between SCAN and MGET
+            expired_keys = yield lambda: self.fetch_columns(complete_keys, builder, True)
+            if expired_keys:
+                yield lambda: self.prune(expired_keys)
+        return builder.build()
+
+    @iter_plan
+    def iter_complete_keys(self, batch_size: int = 1000) -> Iterator[list[str]]:
+        """
+        Iterate all complete keys in the current cache context. A registered sub pages
+        through its key registry in key order, otherwise the SCAN cursor is followed until
+        the whole keyspace has been visited
+
+        :param batch_size: SCAN COUNT hint and the maximum number of keys per yielded list
+        :return: an iterator of complete key lists, an async iterator with AsyncSub
+        """
+        if self.query_builder.schema.is_registered:
+            after = None
+            while True:
+                complete_keys = yield lambda: self.query_builder.queue_page(
+                    self.query_builder.redis, after, batch_size)
+                if complete_keys:
+                    yield complete_keys
+                if len(complete_keys) < batch_size:
+                    return
+                after = complete_keys[-1]
+
+        key_prefix = self.get_complete_key('')
+        scan = self.query_builder.redis.scan_iter(match=f'{key_prefix}*', count=batch_size)
+        complete_keys = []
+        while (complete_key := (yield lambda: self.next_of(scan))) is not None:
+            complete_keys.append(complete_key)
+            if len(complete_keys) >= batch_size:
+                yield complete_keys
+                complete_keys = []
+
+        if complete_keys:
+            yield complete_keys
+
+    @iter_plan
+    def iter_all(self, batch_size: int = 1000, fields: list[str] | None = None)\
+            -> Iterator[dict]:
+        """
+        Iterate all cache in the current cache context, fetching the values with one MGET
+        per batch so memory stays flat on big subs
+
+        :param batch_size: number of keys per SCAN page and per MGET
+        :param fields: only return these columns
+        :return: an iterator of values, an async iterator with AsyncSub
+        """
+        pages = self.iter_complete_keys(batch_size)
+        while (complete_keys := (yield lambda: self.next_of(pages))) is not None:
+            # The key might be unset or expired between SCAN and MGET
+            yield from (yield lambda: self.fetch_existing(complete_keys, fields))
+
+    def get_complete_val(self, key: str | int, val: dict) -> dict:
+        """
+        Generates a complete cache value, including the key itself
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param val: the val of a cache, the value of the rest in the sub_attr
+        :return:  complete_val(dict)
+        """
+        return self.query_builder.get_complete_val(key, val)
+
+    @plan
+    def set(self, key: str | int, val: dict, is_key_complete: bool = False,
+            is_val_complete: bool = False, ttl: int | None = None) -> bool:
+        """
+        Set cache with a single key
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param val: the val of a cache, the value of the rest in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :param is_val_complete: is val already in complete form or not
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :return: is_success(bool)
+        """
+        complete_key = key if is_key_complete else self.get_complete_key(key)
+        complete_val = val if is_val_complete else self.get_complete_val(key, val)
+
+        if not self.query_builder.validate(complete_val):
+            return False
+
+        ttl = self.query_builder.get_ttl(ttl)
+        yield lambda: self.execute(lambda pipe: self.query_builder.queue_write(
+            pipe, {complete_key: complete_val}, ttl))
+        if self.query_builder.is_expiring(ttl):
+            yield lambda: self.expire()
+
+        self.query_builder.invalidate_near_cache([complete_key])
+        return True
+
+    @plan
+    def set_many(self, key_vals: dict[str, dict] | dict[int, dict], is_key_complete: bool = False,
+                 is_val_complete: bool = False, ttl: int | None = None) -> bool:
+        """
+        Set cache with multiple keys and values
+
+        :param key_vals: a dict contains  key and value pairs
+        :param is_key_complete: is key already in complete form or not
+        :param is_val_complete: is val already in complete form or not
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :return: is_success(bool)
+        """
+        complete_key_vals = self.query_builder.get_complete_key_vals(key_vals, is_key_complete,
+                                                                     is_val_complete)
+        if self.query_builder.validate_many(complete_key_vals):
+            return False
+
+        ttl = self.query_builder.get_ttl(ttl)
+        yield lambda: self.execute(lambda pipe: self.query_builder.queue_write(
+            pipe, complete_key_vals, ttl))
+        if self.query_builder.is_expiring(ttl):
+            yield lambda: self.expire(max(len(complete_key_vals),
+                                          self.query_builder.EXPIRE_BATCH))
+
+        self.query_builder.invalidate_near_cache(list(complete_key_vals))
+        return True
+
+    @plan
+    def write_batch(self, complete_key_vals: dict[str, dict | None],
+                    ttl: int | None = None) -> None:
+        """
+        Set and unset validated cache in one pipeline, used by the batch writer
+
+        :param complete_key_vals: a dict contains complete key and complete value pairs,
+            None values are unset
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :return: None
+        """
+        if not complete_key_vals:
+            return
+
+        ttl = self.query_builder.get_ttl(ttl)
+        yield lambda: self.execute(lambda pipe: self.query_builder.queue_write_batch(
+            pipe, complete_key_vals, ttl))
+        if self.query_builder.is_expiring(ttl):
+            yield lambda: self.expire(max(len(complete_key_vals),
+                                          self.query_builder.EXPIRE_BATCH))
+
+        self.query_builder.invalidate_near_cache(list(complete_key_vals))
+
+    def batch_writer(self, max_items: int = 1000, max_delay_ms: float = 50,
+                     max_pending: int | None = None, ttl: int | None = None,
+                     on_error: Callable[[str | int, list[str]], None] | None = None,
+                     max_errors: int = 100) -> BatchWriter:
+        """
+        Get a write-behind writer, sets and unsets are buffered and written in batches,
+        use it with "with", or call its "close()", "async with" and await with AsyncSub
+
+        :param max_items: number of buffered rows that triggers a write
+        :param max_delay_ms: milliseconds a row may wait in the buffer
+        :param max_pending: number of buffered rows that blocks set and unset until the
+            buffer is written, 10 times max_items if not given
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :param on_error: called as on_error(key, invalid_cols) for every invalid row
+        :param max_errors: number of the latest invalid rows kept in the errors of the writer
+        :return: BatchWriter object, AsyncBatchWriter with AsyncSub
+        """
+        return self.BATCH_WRITER(self, max_items, max_delay_ms, max_pending, ttl, on_error,
+                                 max_errors)
+
+    @plan
+    def get_or_load(self, key: str | int, loader: Callable[[str | int], dict | None],
+                    ttl: int | None = None, fields: list[str] | None = None,
+                    lock_ms: int = 5000, wait_ms: int = 5000, beta: float = 1.0) -> dict | None:
+        """
+        Get cache from a key, a missing cache is computed by loader and set (cache-aside).
+        Only the worker holding the recompute lock of a key runs loader, the others wait for
+        its result, and a cache about to expire is refreshed early while the others are served
+        the current one
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param loader: called as loader(key), and awaited with AsyncSub, returns the val of the
+            cache, None to cache nothing
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :param fields: only return these columns
+        :param lock_ms: milliseconds before the lock of a worker that never finished expires
+        :param wait_ms: milliseconds to wait for another worker before running loader anyway
+        :param beta: above 1 refreshes earlier, 0 never refreshes early
+        :return: value(dict) | None
+        """
+        vals = yield lambda: self.get_many_or_load([key], self.single_loader(loader), ttl,
+                                                   fields, lock_ms, wait_ms, beta)
+        return vals[0]
+
+    @plan
+    def get_many_or_load(self, keys: list[str] | list[int],
+                         batch_loader: Callable[[list], dict], ttl: int | None = None,
+                         fields: list[str] | None = None, lock_ms: int = 5000,
+                         wait_ms: int = 5000, beta: float = 1.0) -> list[dict | None]:
+        """
+        Get cache from a key list, the missing caches are computed by one batch_loader call and
+        set, with the recompute locks of get_or_load
+
+        :param keys: a key list
+        :param batch_loader: called as batch_loader(keys), and awaited with AsyncSub, returns a
+            dict of key and val pairs, keys left out are not cached
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :param fields: only return these columns
+        :param lock_ms: milliseconds before the lock of a worker that never finished expires
+        :param wait_ms: milliseconds to wait for another worker before running loader anyway
+        :param beta: above 1 refreshes earlier, 0 never refreshes early
+        :return: value list
+        """
+        complete_keys = self.query_builder.get_complete_keys(keys)
+        keys_by_complete_key = dict(zip(complete_keys, keys))
+        unique_keys = list(keys_by_complete_key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait_ms / 1000
+
+        results = yield lambda: self.execute(lambda pipe: self.query_builder.queue_load_read(
+            pipe, unique_keys), False)
+        complete_vals, missing, refresh = self.query_builder.split_load_read(results,
+                                                                             unique_keys, beta)
+
+        def queue_lock(pipe) -> None:
+            self.query_builder.queue_lock(pipe, lock_keys, token, lock_ms)
+            self.query_builder.queue_load_read(pipe, lock_keys)
+
+        lock_keys = missing + refresh
+        while lock_keys:
+            # The rows are read again after the lock, another worker might have just set them
+            load_keys, unlock_keys = self.query_builder.split_lock_read(
+                (yield lambda: self.execute(queue_lock, False)), lock_keys, refresh,
+                complete_vals)
+            if unlock_keys:
+                yield lambda: self.execute(lambda pipe: self.query_builder.queue_unlock(
+                    pipe, unlock_keys, token), False)
+            if load_keys:
+                complete_vals.update((yield lambda: self.load_rows(
+                    load_keys, keys_by_complete_key, batch_loader, ttl, token)))
+
+            # Only the missing rows are waited for, the others are served while refreshed
+            lock_keys = [complete_key for complete_key in missing
+                         if complete_key not in complete_vals and complete_key not in load_keys]
+            refresh = []
+            missing = lock_keys
+            if lock_keys and time.monotonic() >= deadline:
+                complete_vals.update((yield lambda: self.load_rows(
+                    lock_keys, keys_by_complete_key, batch_loader, ttl)))
+                break
+            if lock_keys:
+                yield lambda: self.sleep(self.query_builder.LOAD_RETRY)
+
+        return [self.query_builder.project(complete_vals.get(complete_key), fields)
+                for complete_key in complete_keys]
+
+    @plan
+    def load_rows(self, complete_keys: list[str], keys_by_complete_key: dict,
+                  batch_loader: Callable[[list], dict], ttl: int | None = None,
+                  token: str | None = None) -> dict:
+        """
+        Compute rows with batch_loader, set them with their recompute time and release their
+        recompute locks in one pipeline
+
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param keys_by_complete_key: the key of every complete key
+        :param batch_loader: called as batch_loader(keys), and awaited with AsyncSub, returns a
+            dict of key and val pairs
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :param token: the token the recompute locks were taken with, None if not locked
+        :return: complete_key_vals(dict), the rows set
+        """
+        started_at = time.monotonic()
+        try:
+            key_vals = yield lambda: batch_loader([keys_by_complete_key[complete_key]
+                                                   for complete_key in complete_keys])
+            complete_key_vals = self.query_builder.get_loaded_key_vals(
+                complete_keys, keys_by_complete_key, key_vals)
+        except Exception:
+            if token is not None:
+                yield lambda: self.execute(lambda pipe: self.query_builder.queue_unlock(
+                    pipe, complete_keys, token), False)
+            raise
+        delta = (time.monotonic() - started_at) * 1000
+        ttl = self.query_builder.get_ttl(ttl)
+
+        def queue_load(pipe) -> None:
+            self.query_builder.queue_write(pipe, complete_key_vals, ttl)
+            self.query_builder.queue_delta(pipe, list(complete_key_vals), delta, ttl)
+            if token is not None:
+                self.query_builder.queue_unlock(pipe, complete_keys, token)
+
+        yield lambda: self.execute(queue_load)
+        if self.query_builder.is_expiring(ttl):
+            yield lambda: self.expire(max(len(complete_key_vals),
+                                          self.query_builder.EXPIRE_BATCH))
+
+        self.query_builder.invalidate_near_cache(list(complete_key_vals))
+        return complete_key_vals
+
+    @plan
+    def update(self, key: str | int, partial_val: dict, is_key_complete: bool = False) -> bool:
+        """
+        Update some columns of an existing cache, only the given columns are validated
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param partial_val: the columns to update, e.g. {"status": False}
+        :param is_key_complete: is key already in complete form or not
+        :return: is_success(bool), False if the cache does not exist
+        """
+        complete_key = key if is_key_complete else self.get_complete_key(key)
+
+        if not self.query_builder.validate_partial(partial_val):
+            return False
+        if not partial_val:
+            return bool((yield lambda: self.query_builder.redis.exists(complete_key)))
+
+        if self.query_builder.schema.is_hash:
+            results = yield lambda: self.execute(lambda pipe: self.query_builder.queue_update(
+                pipe, complete_key, partial_val))
+            is_updated = bool(results[0])
+        else:
+            is_updated = yield lambda: self.merge(complete_key, partial_val)
+
+        self.query_builder.invalidate_near_cache([complete_key])
+        return is_updated
+
+    @plan
+    def ttl(self, key: str | int, is_key_complete: bool = False) -> int:
+        """
+        Get the seconds left before a cache expires
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :return: ttl(int), -1 if the cache does not expire, -2 if the cache does not exist
+        """
+        complete_key = key if is_key_complete else self.get_complete_key(key)
+        return (yield lambda: self.query_builder.redis.ttl(complete_key))
+
+    @plan
+    def touch(self, keys: list[str] | list[int], is_key_complete: bool = False,
+              ttl: int | None = None) -> int:
+        """
+        Restart the expiry of multiple cache, for sliding expiration, in a single round trip
+
+        :param keys: the key of a cache, the value of first element in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :return: number of keys whose expiry has changed(int)
+        """
+        complete_keys = self.query_builder.get_complete_keys(keys, is_key_complete)
+        if not complete_keys:
+            return 0
+
+        ttl = self.query_builder.get_ttl(ttl)
+        return sum((yield lambda: self.execute(lambda pipe: self.query_builder.queue_touch(
+            pipe, complete_keys, ttl), False)))
+
+    @plan
+    def find(self, limit: int | None = None, fields: list[str] | None = None,
+             **conditions) -> list[dict]:
+        """
+        Find cache by the values of indexed columns, e.g. find(status=True, name="Alex"),
+        the matching keys are resolved through the indexes and only their rows are read
+
+        :param limit: maximum number of cache, None for no limit
+        :param fields: only return these columns
+        :param conditions: column and value pairs, every column must have an index
+        :return: list of values, sorted by complete key
+        """
+        results = yield lambda: self.execute(lambda pipe: self.query_builder.queue_find(
+            pipe, conditions), False)
+        complete_keys = self.query_builder.get_found_keys(results, limit)
+        return (yield lambda: self.get_indexed(complete_keys, fields))
+
+    @plan
+    def range(self, col_name: str, low: int | float | None = None,
+              high: int | float | None = None, limit: int | None = None,
+              fields: list[str] | None = None, is_desc: bool = False) -> list[dict]:
+        """
+        Find cache by a range of an indexed INTEGER or REAL column, both ends are inclusive
+
+        :param col_name: an indexed INTEGER or REAL column
+        :param low: the lowest value, None for no lower bound
+        :param high: the highest value, None for no upper bound
+        :param limit: maximum number of cache, None for no limit
+        :param fields: only return these columns
+        :param is_desc: sort from the highest value instead of the lowest
+        :return: list of values, sorted by the column value
+        """
+        complete_keys = yield lambda: self.query_builder.queue_range(
+            self.query_builder.redis, col_name, low, high, limit, is_desc)
+        return (yield lambda: self.get_indexed(complete_keys, fields))
+
+    @plan
+    def get_indexed(self, complete_keys: list[bytes | str],
+                    fields: list[str] | None = None) -> list[dict]:
+        """
+        Get cache found through an index, the index entries of expired cache are pruned
+
+        :param complete_keys: complete keys read from an index
+        :param fields: only return these columns
+        :return: list of values
+        """
+        vals = yield lambda: self.get_many(complete_keys, is_key_complete=True, fields=fields)
+
+        expired_keys = self.query_builder.get_missing_keys(complete_keys, vals)
+        if expired_keys:
+            yield lambda: self.prune(expired_keys)
+
+        return [val for val in vals if val is not None]
+
+    @plan
+    def prune(self, complete_keys: list[bytes | str]) -> None:
+        """
+        Remove the index and registry entries of cache that might be expired, entries of
+        existing cache are kept
+
+        :param complete_keys: complete keys whose cache was not found
+        :return: None
+        """
+        def queue_prune(pipe) -> None:
+            self.query_builder.queue_index(pipe, complete_keys, 'prune')
+            self.query_builder.queue_register(pipe, complete_keys, 'prune')
+
+        yield lambda: self.execute(queue_prune, False)
+
+    @plan
+    def expire(self, limit: int | None = None) -> int:
+        """
+        Remove the cache past their expiry time from the key registry and the indexes, the
+        cache whose expiry was restarted are given their new expiry time
+
+        :param limit: maximum number of cache to check, EXPIRE_BATCH if not given
+        :return: number of cache checked(int), fewer than limit once every expired cache has
+            been removed
+        """
+        if not self.query_builder.schema.is_registered:
+            return 0
+
+        due_keys = yield lambda: self.query_builder.queue_due(self.query_builder.redis, limit)
+        if due_keys:
+            yield lambda: self.execute(lambda pipe: self.query_builder.queue_expire(
+                pipe, due_keys), False)
+        return len(due_keys)
+
+    @plan
+    def drop_indexes(self) -> int:
+        """
+        Remove every index and the key registry of the sub, used when the sub is deleted
+
+        :return: number of index keys removed(int)
+        """
+        index_keys = [self.query_builder.index_rows_key, self.query_builder.registry_key,
+                      self.query_builder.expiry_key]
+        # A sub without indexes has no index key to look for in the keyspace
+        if self.query_builder.schema.indexes:
+            scan = self.query_builder.redis.scan_iter(
+                match=f'{self.query_builder.index_prefix}*', count=1000)
+            while (index_key := (yield lambda: self.next_of(scan))) is not None:
+                index_keys.append(index_key)
+
+        removed = 0
+        for i in range(0, len(index_keys), 1000):
+            removed += yield functools.partial(self.query_builder.redis.unlink,
+                                               *index_keys[i:i + 1000])
+        return removed
+
+    @plan
+    def count(self) -> int:
+        """
+        Count the cache of the sub, with ZCARD on a registered sub, or by scanning the whole
+        keyspace otherwise. The expired cache of a registered sub are removed from its registry
+        first, a batch at a time
+
+        :return: count(int)
+        """
+        if self.query_builder.schema.is_registered:
+            limit = self.query_builder.EXPIRE_BATCH * 10
+            while (yield lambda: self.expire(limit)) == limit:
+                pass
+            return (yield lambda: self.query_builder.redis.zcard(
+                self.query_builder.registry_key))
+
+        count = 0
+        pages = self.iter_complete_keys()
+        while (complete_keys := (yield lambda: self.next_of(pages))) is not None:
+            count += len(complete_keys)
+        return count
+
+    @plan
+    def aggregate(self, func: str = 'count', col_name: str | None = None,
+                  group_by: str | None = None, batch_size: int = 1000, **conditions):
+        """
+        Aggregate a column on the server, e.g. aggregate("max", "score") or
+        aggregate(group_by="team", status=True), only the partial result of every chunk of rows
+        is sent back. Compressed values can not be decoded on the server, they are read and
+        aggregated here
+
+        :param func: count, sum, min, max or avg
+        :param col_name: the aggregated column, None to count the rows
+        :param group_by: group the rows by this column, None for a single group
+        :param batch_size: number of keys per SCAN page
+        :param conditions: column and value pairs the rows must match
+        :return: result, a number or None if there is no value to aggregate, or a dict of group
+            value and result pairs with group_by
+        """
+        aggregation = Aggregation(self.query_builder.schema, func, col_name, group_by, conditions)
+        pages = self.iter_complete_keys(batch_size)
+        while (complete_keys := (yield lambda: self.next_of(pages))) is not None:
+            yield lambda: self.aggregate_keys(complete_keys, aggregation)
+        return aggregation.build()
+
+    @plan
+    def aggregate_keys(self, complete_keys: list[bytes | str], aggregation: Aggregation) -> None:
+        """
+        Aggregate rows with one script call per cluster slot and per 1000 keys, the server
+        is blocked while a call runs. The script is sent whole only to the nodes that do not
+        have it yet
+
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param aggregation: collects the partial results
+        :return: None
+        """
+        def queue_chunks(pipe, queued_chunks: list[list[bytes | str]], is_loaded: bool) -> None:
+            for chunk in queued_chunks:
+                self.query_builder.queue_aggregate(pipe, chunk, aggregation, is_loaded)
+
+        chunks = self.query_builder.group_by_slot(complete_keys)
+        results = yield lambda: self.execute(lambda pipe: queue_chunks(pipe, chunks, True),
+                                             False, False)
+
+        retried_results = []
+        unloaded_chunks = self.query_builder.get_unloaded_chunks(chunks, results)
+        if unloaded_chunks:
+            retried_results = yield lambda: self.execute(
+                lambda pipe: queue_chunks(pipe, unloaded_chunks, False), False)
+
+        skipped_keys, missing_keys = self.query_builder.add_aggregate_results(
+            aggregation, results, retried_results)
+
+        if skipped_keys:
+            aggregation.add_rows((yield lambda: self.fetch_many(skipped_keys)))
+        # The key might be unset or expired between SCAN and the script
+        if missing_keys:
+            yield lambda: self.prune(missing_keys)
+
+    @plan
+    def page(self, after: str | int | None = None, limit: int = 100,
+             fields: list[str] | None = None) -> list[dict]:
+        """
+        Get a page of cache in key order from the key registry, pass the key of the last
+        cache as "after" to get the next page
+
+        :param after: the key before the page, None for the first page
+        :param limit: maximum number of cache
+        :param fields: only return these columns
+        :return: list of values, fewer than limit if expired cache were found
+        """
+        if not self.query_builder.schema.is_registered:
+            raise ValueError(f'Sub `{self.query_builder.sub_name}` has no key registry.')
+
+        after = None if after is None else self.get_complete_key(after)
+        complete_keys = yield lambda: self.query_builder.queue_page(self.query_builder.redis,
+                                                                    after, limit)
+        return (yield lambda: self.get_indexed(complete_keys, fields))
+
+    @plan
+    def import_from(self, path_or_stream: str | os.PathLike | IO, format_: str = 'ndjson',
+                    chunk_size: int = 1000, ttl: int | None = None,
+                    on_error: Callable[[int, list[str]], None] | None = None,
+                    on_progress: Callable[[dict], None] | None = None) -> dict:
+        """
+        Stream rows from an NDJSON or CSV input into the sub, validated and written with one
+        pipeline per chunk, so memory stays flat on big inputs. AsyncSub reads every chunk in
+        a thread
+
+        :param path_or_stream: a file path, read through mmap, or a text or binary stream
+        :param format_: ndjson, one json object per line, or csv with a header of column names
+        :param chunk_size: number of rows per pipeline
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :param on_error: called as on_error(record, invalid_cols) for every rejected row,
+            record is the position of the row in the input, starting at 1
+        :param on_progress: called as on_progress(report) after every chunk
+        :return: report(dict), e.g. {"rows": 1000, "rejected": 2, "seconds": 0.05,
+            "rows_per_second": 20000.0}
+        """
+        started_at = time.monotonic()
+        rows = 0
+        rejected = 0
+        chunks = self.query_builder.iter_import_chunks(path_or_stream, format_, chunk_size)
+        try:
+            # Reading and validating a chunk blocks
+            while (item := (yield lambda: self.run_blocking(next, chunks, None))) is not None:
+                chunk, rejects = item
+                rejected += len(rejects)
+                if on_error is not None:
+                    for record, invalid_cols in rejects:
+                        on_error(record, invalid_cols)
+
+                yield lambda: self.write_batch(chunk, ttl)
+                rows += len(chunk)
+                if on_progress is not None and len(chunk) >= chunk_size:
+                    on_progress(get_report(started_at, rows, rejected))
+        finally:
+            # A cancelled read still runs in its thread, the input is closed once it is collected
+            if not chunks.gi_running:
+                chunks.close()
+        return get_report(started_at, rows, rejected)
+
+    @plan
+    def export_to(self, path_or_stream: str | os.PathLike | IO, format_: str = 'ndjson',
+                  batch_size: int = 1000, fields: list[str] | None = None,
+                  on_progress: Callable[[dict], None] | None = None) -> dict:
+        """
+        Stream every row of the sub into an NDJSON or CSV output, read with one MGET per batch.
+        AsyncSub writes every batch in a thread
+
+        :param path_or_stream: a file path, or a text or binary stream
+        :param format_: ndjson, one json object per line, or csv with a header of column names
+        :param batch_size: number of keys per SCAN page and per MGET
+        :param fields: only export these columns, every column if not given
+        :param on_progress: called as on_progress(report) after every batch
+        :return: report(dict), e.g. {"rows": 1000, "seconds": 0.05, "rows_per_second": 20000.0}
+        """
+        started_at = time.monotonic()
+        rows = 0
+        col_names = fields if fields is not None else self.query_builder.schema.col_names
+        # Opening, writing and closing the output block
+        writer = yield lambda: self.run_blocking(RowWriter, path_or_stream, format_, col_names)
+        try:
+            batch = []
+            pages = self.iter_complete_keys(batch_size)
+            while (complete_keys := (yield lambda: self.next_of(pages))) is not None:
+                batch.extend((yield lambda: self.fetch_existing(complete_keys, fields)))
+                if len(batch) < batch_size:
+                    continue
+                written, batch = batch[:batch_size], batch[batch_size:]
+                yield lambda: self.run_blocking(writer.write_many, written)
+                rows += len(written)
+                if on_progress is not None:
+                    on_progress(get_report(started_at, rows))
+            if batch:
+                yield lambda: self.run_blocking(writer.write_many, batch)
+                rows += len(batch)
+        finally:
+            yield lambda: self.run_blocking(writer.close)
+        return get_report(started_at, rows)
+
+    @plan
+    def unset(self, key: str | int, is_key_complete: bool = False) -> bool:
+        """
+        Unset a cache with a single key
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :return: is_success(bool)
+        """
+        complete_key = key if is_key_complete else self.get_complete_key(key)
+        return bool((yield lambda: self.unset_many([complete_key], is_key_complete=True)))
+
+    @plan
+    def unset_many(self, keys: list[str] | list[int], is_key_complete: bool = False,
+                   is_unlink: bool = False, chunk_size: int = 1000) -> int:
+        """
+        Unset multiple cache with multiple keys, in a single MULTI/EXEC round trip so either
+        every key is removed or none is, except on a cluster sub without hash tag
+
+        :param keys: the key of a cache, the value of first element in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :param is_unlink: use the non-blocking UNLINK instead of DEL
+        :param chunk_size: maximum number of keys per DEL/UNLINK command in the transaction
+        :return: number of keys removed(int)
+        """
+        complete_keys = self.query_builder.get_complete_keys(keys, is_key_complete)
+        if not complete_keys:
+            return 0
+
+        # The first results are the number of keys removed per DEL/UNLINK command
+        delete_count = len(self.query_builder.group_by_slot(complete_keys, chunk_size))
+        results = yield lambda: self.execute(lambda pipe: self.query_builder.queue_unset(
+            pipe, complete_keys, is_unlink, chunk_size))
+        removed = sum(results[:delete_count])
+
+        self.query_builder.invalidate_near_cache(complete_keys)
+        return removed
+
+    @plan
+    def unset_all(self, batch_size: int = 1000, is_unlink: bool = False) -> int:
+        """
+        Unset all cache in the context, one transaction per batch
+
+        :param batch_size: number of keys per SCAN page and per unset batch
+        :param is_unlink: use the non-blocking UNLINK instead of DEL
+        :return: number of keys removed(int)
+        """
+        removed = 0
+        pages = self.iter_complete_keys(batch_size)
+        while (complete_keys := (yield lambda: self.next_of(pages))) is not None:
+            removed += yield lambda: self.unset_many(complete_keys, is_key_complete=True,
+                                                     is_unlink=is_unlink)
+
+        return removed
+
+    def run(self, plan_: Generator):
+        """
+        Make the redis calls of a plan, implemented by Sub and AsyncSub
+
+        :param plan_: generator yielding the redis calls
+        :return: the value the plan returns
+        """
+        raise NotImplementedError
+
+    def iterate(self, plan_: Generator):
+        """
+        Make the redis calls of an iterator plan and yield its items, implemented by Sub and
+        AsyncSub
+
+        :param plan_: generator yielding the redis calls and the items
+        :return: an iterator of the items
+        """
+        raise NotImplementedError
+
+    def execute(self, queue: Callable, is_transaction: bool = True,
+                raise_on_error: bool = True):
+        """
+        Queue commands into a pipeline and send it, implemented by Sub and AsyncSub
+
+        :param queue: called as queue(pipe)
+        :param is_transaction: wrap the commands in MULTI/EXEC
+        :param raise_on_error: raise the first command error instead of returning it
+        :return: the command results
+        """
+        raise NotImplementedError
+
+    def merge(self, complete_key: str, partial_val: dict):
+        """
+        Update some columns of an existing string row in a WATCH transaction, implemented by
+        Sub and AsyncSub
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param partial_val: the validated columns to update
+        :return: is_updated(bool), False if the row does not exist
+        """
+        raise NotImplementedError
+
+    def next_of(self, iterator):
+        """
+        Get the next item of an iterator, implemented by Sub and AsyncSub
+
+        :param iterator: an iterator, an async iterator with AsyncSub
+        :return: the next item, None once the iterator is exhausted
+        """
+        raise NotImplementedError
+
+    def run_blocking(self, func: Callable, *args):
+        """
+        Call a function that blocks on file I/O, implemented by Sub and AsyncSub
+
+        :param func: the blocking function
+        :param args: its arguments
+        :return: its result
+        """
+        raise NotImplementedError
+
+    def sleep(self, seconds: float):
+        """
+        Wait before the next attempt, implemented by Sub and AsyncSub
+
+        :param seconds: the time to wait
+        :return: None
+        """
+        raise NotImplementedError
+
+    def single_loader(self, loader: Callable) -> Callable:
+        """
+        Make the batch_loader of get_many_or_load out of the loader of get_or_load,
+        implemented by Sub and AsyncSub
+
+        :param loader: called as loader(key), returns the val of the cache
+        :return: batch_loader, called as batch_loader([key])
+        """
+        raise NotImplementedError
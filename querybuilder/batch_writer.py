@@ -0,0 +1,435 @@
+""" Write-behind batch writer classes """
+
+import asyncio
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+from typing import Callable
+
+
+class BatchWriter:
+    """
+    A write-behind buffer in front of a sub. Sets and unsets are validated right away, coalesced
+    per key so the last write wins, and written as one pipeline by a background thread when
+    max_items rows are buffered or the oldest buffered row is max_delay_ms old
+
+    methods:
+        start() -> None
+        validate_row(key,val,is_key_complete,is_val_complete) -> complete_row(tuple) | None
+        buffer_row(complete_key,complete_val) -> is_buffered(bool)
+        set(key,val,is_key_complete,is_val_complete) -> is_valid(bool)
+        unset(key,is_key_complete) -> None
+        is_due() -> is_due(bool)
+        take_batch() -> batch(dict)
+        requeue_batch(batch) -> None
+        add_flush_error(exc) -> None
+        flush() -> written(int)
+        run() -> None
+        close() -> None
+    """
+
+    def __init__(self, sub, max_items: int = 1000, max_delay_ms: float = 50,
+                 max_pending: int | None = None, ttl: int | None = None,
+                 on_error: Callable[[str | int, list[str]], None] | None = None,
+                 max_errors: int = 100):
+        """
+        BatchWriter initialization
+
+        :param sub: the Sub to write into
+        :param max_items: number of buffered rows that triggers a write
+        :param max_delay_ms: milliseconds a row may wait in the buffer
+        :param max_pending: number of buffered rows that blocks set and unset until the
+            buffer is written, 10 times max_items if not given
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :param on_error: called as on_error(key, invalid_cols) for every invalid row
+        :param max_errors: number of the latest invalid rows kept in errors, and of the latest
+            failed background writes kept in flush_errors, every one of them is counted in
+            error_count or flush_error_count, every invalid row is passed to on_error
+        """
+        self.sub = sub
+        self.max_items = max_items
+        self.max_delay = max_delay_ms / 1000
+        self.max_pending = max_pending if max_pending is not None else max_items * 10
+        self.ttl = ttl
+        self.on_error = on_error
+        # The latest invalid rows, a long-running writer keeps only max_errors of them
+        self.errors = deque(maxlen=max_errors)
+        self.error_count = 0
+        # The errors of the latest failed background writes, their rows are written again
+        self.flush_errors = deque(maxlen=max_errors)
+        self.flush_error_count = 0
+        self.flush_error = None
+
+        self.buffer = {}
+        self.first_at = None
+        self.is_closed = False
+        self.condition = None
+        # Batches are written one at a time, in the order they were taken
+        self.write_lock = None
+        self.thread = None
+        self.start()
+
+    def start(self) -> None:
+        """
+        Create the locks and start the background thread
+
+        :return: None
+        """
+        self.condition = Condition()
+        self.write_lock = Lock()
+        self.thread = Thread(target=self.run, daemon=True,
+                             name=f'batch_writer-{self.sub.query_builder.key_prefix}')
+        self.thread.start()
+
+    def __enter__(self) -> 'BatchWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def validate_row(self, key: str | int, val: dict, is_key_complete: bool = False,
+                     is_val_complete: bool = False) -> tuple[str, dict] | None:
+        """
+        Complete and validate a row, an invalid row is reported to errors, error_count and
+        on_error
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param val: the val of a cache, the value of the rest in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :param is_val_complete: is val already in complete form or not
+        :return: complete_row(tuple), complete key and complete value, None if invalid
+        """
+        query_builder = self.sub.query_builder
+        complete_key = key if is_key_complete else query_builder.get_complete_key(key)
+        complete_val = val if is_val_complete else query_builder.get_complete_val(key, val)
+
+        if not query_builder.validate(complete_val):
+            invalid_cols = query_builder.schema.get_invalid_cols(complete_val)
+            self.errors.append((key, invalid_cols))
+            self.error_count += 1
+            if self.on_error is not None:
+                self.on_error(key, invalid_cols)
+            return None
+        return complete_key, complete_val
+
+    def buffer_row(self, complete_key: str, complete_val: dict | None) -> bool:
+        """
+        Put a validated row into the buffer, blocks while the buffer is full
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param complete_val: complete cache value, None to unset the cache
+        :return: is_buffered(bool)
+        """
+        with self.condition:
+            while len(self.buffer) >= self.max_pending and not self.is_closed:
+                self.condition.wait()
+            if self.is_closed:
+                raise ValueError('The batch writer is closed.')
+
+            self.buffer.pop(complete_key, None)
+            self.buffer[complete_key] = complete_val
+            # The writer sleeps without timeout while the buffer is empty
+            if self.first_at is None:
+                self.first_at = time.monotonic()
+                self.condition.notify_all()
+            elif len(self.buffer) >= self.max_items:
+                self.condition.notify_all()
+        return True
+
+    def set(self, key: str | int, val: dict, is_key_complete: bool = False,
+            is_val_complete: bool = False) -> bool:
+        """
+        Buffer a set, an invalid row is reported and dropped
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param val: the val of a cache, the value of the rest in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :param is_val_complete: is val already in complete form or not
+        :return: is_valid(bool)
+        """
+        complete_row = self.validate_row(key, val, is_key_complete, is_val_complete)
+        if complete_row is None:
+            return False
+        return self.buffer_row(*complete_row)
+
+    def unset(self, key: str | int, is_key_complete: bool = False) -> None:
+        """
+        Buffer an unset
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :return: None
+        """
+        complete_key = key if is_key_complete else self.sub.get_complete_key(key)
+        self.buffer_row(complete_key, None)
+
+    def is_due(self) -> bool:
+        """
+        Check if the buffer should be written, called with the condition held
+
+        :return: is_due(bool)
+        """
+        if not self.buffer:
+            return False
+        if self.is_closed or len(self.buffer) >= self.max_items:
+            return True
+        return time.monotonic() - self.first_at >= self.max_delay
+
+    def take_batch(self) -> dict:
+        """
+        Empty the buffer and wake the blocked writers, called with the condition held
+
+        :return: batch(dict), complete key and complete value pairs
+        """
+        batch = self.buffer
+        self.buffer = {}
+        self.first_at = None
+        self.condition.notify_all()
+        return batch
+
+    def requeue_batch(self, batch: dict) -> None:
+        """
+        Put a batch that failed to be written back into the buffer, the rows buffered since
+        are newer and win, called with the condition held
+
+        :param batch: complete key and complete value pairs taken by "take_batch"
+        :return: None
+        """
+        batch.update(self.buffer)
+        self.buffer = batch
+        self.first_at = time.monotonic()
+
+    def add_flush_error(self, exc: Exception) -> None:
+        """
+        Keep the error of a failed background write, the next flush or close raises it
+
+        :param exc: the error raised by the write
+        :return: None
+        """
+        self.flush_errors.append(exc)
+        self.flush_error_count += 1
+        self.flush_error = exc
+
+    def flush(self) -> int:
+        """
+        Write the buffer now, raises the error of the latest failed background write since the
+        last flush, if any. The buffer is kept if the write fails
+
+        :return: number of rows written(int)
+        """
+        with self.write_lock:
+            with self.condition:
+                batch = self.take_batch()
+            try:
+                if batch:
+                    self.sub.write_batch(batch, self.ttl)
+            except Exception:
+                with self.condition:
+                    self.requeue_batch(batch)
+                raise
+
+        if self.flush_error is not None:
+            exc, self.flush_error = self.flush_error, None
+            raise exc
+        return len(batch)
+
+    def run(self) -> None:
+        """
+        Write the buffer whenever it is due, until closed
+
+        :return: None
+        """
+        while True:
+            with self.condition:
+                while not self.is_due():
+                    if self.is_closed:
+                        return
+                    timeout = None
+                    if self.first_at is not None:
+                        timeout = max(self.first_at + self.max_delay - time.monotonic(), 0)
+                    self.condition.wait(timeout)
+
+            with self.write_lock:
+                with self.condition:
+                    batch = self.take_batch()
+                try:
+                    if batch:
+                        self.sub.write_batch(batch, self.ttl)
+                    continue
+                # The error is raised by the next flush or close, the batch is written again
+                except Exception as exc:  # pylint: disable=W0718
+                    self.add_flush_error(exc)
+                    with self.condition:
+                        self.requeue_batch(batch)
+
+            # The next attempt waits max_delay_ms, the buffer is written by close once closed
+            with self.condition:
+                if self.condition.wait_for(lambda: self.is_closed, self.max_delay):
+                    return
+
+    def close(self) -> None:
+        """
+        Write the buffer and stop the background thread
+
+        :return: None
+        """
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.flush()
+
+
+class AsyncBatchWriter(BatchWriter):
+    """
+    BatchWriter for asyncio, the buffer is written by a background task started on first use
+    """
+
+    def start(self) -> None:
+        """
+        Create the asyncio locks, the background task is started on first use
+
+        :return: None
+        """
+        self.condition = asyncio.Condition()
+        self.write_lock = asyncio.Lock()
+        self.task = None
+
+    async def __aenter__(self) -> 'AsyncBatchWriter':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    # pylint: disable=W0236,W0221
+    async def buffer_row(self, complete_key: str, complete_val: dict | None) -> bool:
+        """
+        Put a validated row into the buffer, waits while the buffer is full
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param complete_val: complete cache value, None to unset the cache
+        :return: is_buffered(bool)
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(
+                self.run(), name=f'batch_writer-{self.sub.query_builder.key_prefix}')
+
+        async with self.condition:
+            while len(self.buffer) >= self.max_pending and not self.is_closed:
+                await self.condition.wait()
+            if self.is_closed:
+                raise ValueError('The batch writer is closed.')
+
+            self.buffer.pop(complete_key, None)
+            self.buffer[complete_key] = complete_val
+            # The writer sleeps without timeout while the buffer is empty
+            if self.first_at is None:
+                self.first_at = time.monotonic()
+                self.condition.notify_all()
+            elif len(self.buffer) >= self.max_items:
+                self.condition.notify_all()
+        return True
+
+    async def set(self, key: str | int, val: dict, is_key_complete: bool = False,
+                  is_val_complete: bool = False) -> bool:
+        """
+        Buffer a set, an invalid row is reported and dropped
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param val: the val of a cache, the value of the rest in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :param is_val_complete: is val already in complete form or not
+        :return: is_valid(bool)
+        """
+        complete_row = self.validate_row(key, val, is_key_complete, is_val_complete)
+        if complete_row is None:
+            return False
+        return await self.buffer_row(*complete_row)
+
+    async def unset(self, key: str | int, is_key_complete: bool = False) -> None:
+        """
+        Buffer an unset
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param is_key_complete: is key already in complete form or not
+        :return: None
+        """
+        complete_key = key if is_key_complete else self.sub.get_complete_key(key)
+        await self.buffer_row(complete_key, None)
+
+    async def flush(self) -> int:
+        """
+        Write the buffer now, raises the error of the latest failed background write since the
+        last flush, if any. The buffer is kept if the write fails
+
+        :return: number of rows written(int)
+        """
+        async with self.write_lock:
+            async with self.condition:
+                batch = self.take_batch()
+            try:
+                if batch:
+                    await self.sub.write_batch(batch, self.ttl)
+            except Exception:
+                async with self.condition:
+                    self.requeue_batch(batch)
+                raise
+
+        if self.flush_error is not None:
+            exc, self.flush_error = self.flush_error, None
+            raise exc
+        return len(batch)
+
+    async def run(self) -> None:
+        """
+        Write the buffer whenever it is due, until closed
+
+        :return: None
+        """
+        while True:
+            async with self.condition:
+                while not self.is_due():
+                    if self.is_closed:
+                        return
+                    timeout = None
+                    if self.first_at is not None:
+                        timeout = max(self.first_at + self.max_delay - time.monotonic(), 0)
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+
+            async with self.write_lock:
+                async with self.condition:
+                    batch = self.take_batch()
+                try:
+                    if batch:
+                        await self.sub.write_batch(batch, self.ttl)
+                    continue
+                except Exception as exc:  # pylint: disable=W0718
+                    self.add_flush_error(exc)
+                    async with self.condition:
+                        self.requeue_batch(batch)
+
+            async with self.condition:
+                try:
+                    await asyncio.wait_for(self.condition.wait_for(lambda: self.is_closed),
+                                           self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+                if self.is_closed:
+                    return
+
+    async def close(self) -> None:
+        """
+        Write the buffer and stop the background task
+
+        :return: None
+        """
+        async with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+        if self.task is not None:
+            await self.task
+        await self.flush()
+    # pylint: enable=W0236,W0221
@@ -0,0 +1,214 @@
+""" Streaming import and export of sub rows, in NDJSON or CSV """
+
+import csv
+import io
+import json
+import mmap
+import os
+import time
+from typing import IO, Iterator
+
+from querybuilder.schema import Schema
+
+FORMATS = ('ndjson', 'csv')
+# CSV cells read as True for a BOOLEAN column, every other non-empty cell is False
+TRUE_CELLS = ('true', '1', 'yes', 't', 'y')
+
+
+def check_format(format_: str) -> None:
+    """
+    Check that a bulk format is supported
+
+    :param format_: ndjson or csv
+    :return: None
+    """
+    if format_ not in FORMATS:
+        raise ValueError(f'Unknown format `{format_}`, available formats: {", ".join(FORMATS)}.')
+
+
+def iter_lines(path_or_stream: str | os.PathLike | IO) -> Iterator[bytes | str]:
+    """
+    Iterate the lines of a file or a stream, a file is read through mmap so only the pages
+    being parsed are kept in memory
+
+    :param path_or_stream: a file path, or a text or binary stream
+    :return: an iterator of lines
+    """
+    if not isinstance(path_or_stream, (str, os.PathLike)):
+        yield from path_or_stream
+        return
+
+    with open(path_or_stream, 'rb') as file:
+        # An empty file can not be mapped
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield from iter(mapped.readline, b'')
+
+
+def parse_cell(col_type: type | None, cell: str):
+    """
+    Convert a CSV cell into the data type of its column, an empty cell is None
+
+    :param col_type: python type of the column, None if unknown
+    :param cell: the CSV cell
+    :return: the column value, the cell itself if it can not be converted
+    """
+    if cell == '':
+        return None
+    try:
+        if col_type is bool:
+            return cell.strip().lower() in TRUE_CELLS
+        if col_type in (int, float):
+            return col_type(cell)
+    except ValueError:
+        return cell
+    return cell
+
+
+def read_rows(path_or_stream: str | os.PathLike | IO, format_: str,
+              schema: Schema) -> Iterator[dict | None]:
+    """
+    Stream the rows of an NDJSON or CSV input, a CSV input starts with a header of column names
+
+    :param path_or_stream: a file path, or a text or binary stream
+    :param format_: ndjson or csv
+    :param schema: the schema of the sub, CSV cells are converted into its column types
+    :return: an iterator of rows, None for every record that can not be parsed
+    """
+    check_format(format_)
+    lines = iter_lines(path_or_stream)
+    if format_ == 'ndjson':
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else None
+        return
+
+    lines = (line.decode('utf-8') if isinstance(line, bytes) else line for line in lines)
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    col_types = [schema.checks_by_col[col_name][2] if col_name in schema.checks_by_col
+                 else None for col_name in header]
+    for cells in reader:
+        if not cells:
+            continue
+        if len(cells) != len(header):
+            yield None
+            continue
+        yield {col_name: parse_cell(col_type, cell)
+               for col_name, col_type, cell in zip(header, col_types, cells)}
+
+
+def get_report(started_at: float, rows: int, rejected: int | None = None) -> dict:
+    """
+    Build the report of an import or an export
+
+    :param started_at: time.monotonic() at the start
+    :param rows: number of rows written
+    :param rejected: number of rows rejected, None for an export
+    :return: report(dict)
+    """
+    seconds = time.monotonic() - started_at
+    report = {'rows': rows}
+    if rejected is not None:
+        report['rejected'] = rejected
+    report['seconds'] = round(seconds, 3)
+    report['rows_per_second'] = round(rows / seconds, 1) if seconds > 0 else 0.0
+    return report
+
+
+class RowWriter:
+    """
+    Writes rows into an NDJSON or CSV output, a CSV output starts with a header of column names
+
+    methods:
+        write(row) -> None
+        write_many(rows) -> None
+        close() -> None
+    """
+
+    def __init__(self, path_or_stream: str | os.PathLike | IO, format_: str,
+                 col_names: tuple | list):
+        """
+        RowWriter initialization
+
+        :param path_or_stream: a file path, or a text stream
+        :param format_: ndjson or csv
+        :param col_names: the columns written, in order
+        """
+        check_format(format_)
+        self.format = format_
+        self.col_names = list(col_names)
+        self.is_owner = isinstance(path_or_stream, (str, os.PathLike))
+        self.is_wrapped = isinstance(path_or_stream, (io.RawIOBase, io.BufferedIOBase))
+        if self.is_owner:
+            # pylint: disable=R1732
+            self.stream = open(path_or_stream, 'w', encoding='UTF-8', newline='')
+        elif self.is_wrapped:
+            self.stream = io.TextIOWrapper(path_or_stream, encoding='UTF-8', newline='')
+        else:
+            self.stream = path_or_stream
+
+        self.csv_writer = None
+        if format_ == 'csv':
+            self.csv_writer = csv.writer(self.stream)
+            self.csv_writer.writerow(self.col_names)
+
+    def __enter__(self) -> 'RowWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def write(self, row: dict) -> None:
+        """
+        Write a row, columns outside col_names are not written
+
+        :param row: complete cache value
+        :return: None
+        """
+        if self.csv_writer is None:
+            self.stream.write(json.dumps({col_name: row.get(col_name)
+                                          for col_name in self.col_names}) + '\n')
+            return
+
+        cells = []
+        for col_name in self.col_names:
+            data = row.get(col_name)
+            if data is None:
+                data = ''
+            elif isinstance(data, bool):
+                data = 'true' if data else 'false'
+            cells.append(data)
+        self.csv_writer.writerow(cells)
+
+    def write_many(self, rows: list[dict]) -> None:
+        """
+        Write rows in order
+
+        :param rows: complete cache values
+        :return: None
+        """
+        for row in rows:
+            self.write(row)
+
+    def close(self) -> None:
+        """
+        Flush the output, and close it if it was opened from a path
+
+        :return: None
+        """
+        if self.is_owner:
+            self.stream.close()
+            return
+        self.stream.flush()
+        # The wrapped binary stream belongs to the caller
+        if self.is_wrapped:
+            self.stream.detach()
@@ -0,0 +1,227 @@
+""" Value codec classes """
+
+import json
+from typing import Any
+
+from querybuilder.compression import Compressor, compress, decompress
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec:
+    """
+    Encodes a complete value into what is stored in redis and decodes it back, using json.
+    In positional mode only the values are stored, in sub_attr order and without the key.
+    With a compressor, values and hash fields of at least min_size bytes are compressed.
+
+    methods:
+        dumps(obj) -> data(bytes | str)
+        loads(data) -> obj
+        encode(complete_val) -> val(bytes | str)
+        decode(val,key) -> complete_val(dict)
+        decode_values(val) -> vals(list)
+        encode_fields(complete_val) -> fields(dict)
+        decode_fields(fields) -> complete_val(dict)
+        decode_field(data) -> obj
+    """
+
+    name = 'json'
+
+    def __init__(self, col_names: tuple, is_positional: bool = False,
+                 compressor: Compressor | None = None, min_size: int = 1024):
+        """
+        Codec initialization
+
+        :param col_names: column names of the sub, the first one is the key
+        :param is_positional: store the values only, in col_names order
+        :param compressor: compresses the encoded values, None for no compression
+        :param min_size: minimum size in bytes of an encoded value to compress
+        """
+        self.col_names = col_names
+        self.key_name = col_names[0]
+        self.val_names = col_names[1:]
+        # Index of every column in a positional value
+        self.positions = {col_name: i for i, col_name in enumerate(self.val_names)}
+        self.is_positional = is_positional
+        self.compressor = compressor
+        self.min_size = min_size
+
+    @staticmethod
+    def dumps(obj: Any) -> bytes | str:
+        """
+        Serialize a python object
+
+        :param obj: a dict or a list
+        :return: data(bytes | str)
+        """
+        return json.dumps(obj)
+
+    @staticmethod
+    def loads(data: bytes | str) -> Any:
+        """
+        Deserialize a python object
+
+        :param data: serialized data
+        :return: a dict or a list
+        """
+        return json.loads(data)
+
+    def encode(self, complete_val: dict) -> bytes | str:
+        """
+        Encodes a complete value, columns outside the sub_attr are dropped in positional mode
+
+        :param complete_val: complete cache value
+        :return: val(bytes | str)
+        """
+        if self.is_positional:
+            data = self.dumps([complete_val[col_name] for col_name in self.val_names])
+        else:
+            data = self.dumps(complete_val)
+        return compress(self.compressor, data, self.min_size)
+
+    def decode(self, val: bytes | str, key: str | int | None = None) -> dict:
+        """
+        Decodes a value stored in redis
+
+        :param val: value stored in redis
+        :param key: the key of the value, required in positional mode
+        :return: complete_val(dict)
+        """
+        val = decompress(val)
+        if self.is_positional:
+            complete_val = {self.key_name: key}
+            complete_val.update(zip(self.val_names, self.loads(val)))
+            return complete_val
+        return self.loads(val)
+
+    def decode_values(self, val: bytes | str) -> list:
+        """
+        Decodes a value stored in positional mode into its values, without building its dict
+
+        :param val: value stored in redis
+        :return: vals(list), in sub_attr order and without the key
+        """
+        return self.loads(decompress(val))
+
+    def encode_fields(self, complete_val: dict) -> dict:
+        """
+        Encodes a complete value into redis hash fields, one field per column
+
+        :param complete_val: complete cache value
+        :return: fields(dict)
+        """
+        return {col_name: compress(self.compressor, self.dumps(data), self.min_size)
+                for col_name, data in complete_val.items()}
+
+    def decode_fields(self, fields: dict) -> dict:
+        """
+        Decodes redis hash fields, the field names may be bytes
+
+        :param fields: hash fields stored in redis
+        :return: complete_val(dict)
+        """
+        return {(col_name.decode('utf-8') if isinstance(col_name, bytes) else col_name):
+                self.decode_field(data) for col_name, data in fields.items()}
+
+    def decode_field(self, data: bytes | str) -> Any:
+        """
+        Decodes a redis hash field
+
+        :param data: hash field stored in redis
+        :return: the column value
+        """
+        return self.loads(decompress(data))
+
+
+class OrjsonCodec(Codec):
+    """
+    Codec using orjson, requires the orjson package
+    """
+
+    name = 'orjson'
+
+    @staticmethod
+    def dumps(obj: Any) -> bytes:
+        """
+        Serialize a python object with orjson
+
+        :param obj: a dict or a list
+        :return: data(bytes)
+        """
+        return orjson.dumps(obj)
+
+    @staticmethod
+    def loads(data: bytes | str) -> Any:
+        """
+        Deserialize a python object with orjson
+
+        :param data: serialized data
+        :return: a dict or a list
+        """
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """
+    Codec using msgpack, requires the msgpack package
+    """
+
+    name = 'msgpack'
+
+    @staticmethod
+    def dumps(obj: Any) -> bytes:
+        """
+        Serialize a python object with msgpack
+
+        :param obj: a dict or a list
+        :return: data(bytes)
+        """
+        return msgpack.packb(obj)
+
+    @staticmethod
+    def loads(data: bytes | str) -> Any:
+        """
+        Deserialize a python object with msgpack
+
+        :param data: serialized data
+        :return: a dict or a list
+        """
+        return msgpack.unpackb(data)
+
+
+CODECS = {
+    Codec.name: (Codec, json),
+    OrjsonCodec.name: (OrjsonCodec, orjson),
+    MsgpackCodec.name: (MsgpackCodec, msgpack),
+}
+
+
+def get_codec(codec_name: str, col_names: tuple, is_positional: bool = False,
+              compressor: Compressor | None = None, min_size: int = 1024) -> Codec:
+    """
+    Get a codec by its name. A codec whose package is not installed raises instead of falling
+    back to json, the rows written by the other processes could not be read
+
+    :param codec_name: json, orjson or msgpack
+    :param col_names: column names of the sub, the first one is the key
+    :param is_positional: store the values only, in col_names order
+    :param compressor: compresses the encoded values, None for no compression
+    :param min_size: minimum size in bytes of an encoded value to compress
+    :return: codec(Codec)
+    """
+    if codec_name not in CODECS:
+        raise ValueError(f'Unknown codec `{codec_name}`, available codecs: {", ".join(CODECS)}.')
+
+    codec_class, module = CODECS[codec_name]
+    if module is None:
+        raise ValueError(f'Codec `{codec_name}` is needed by the sub, but it is not installed.')
+
+    return codec_class(col_names, is_positional, compressor, min_size)
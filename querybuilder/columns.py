@@ -0,0 +1,155 @@
+""" Columnar results of sub reads """
+
+import itertools
+
+from querybuilder.schema import Schema
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+RESULT_FORMATS = ('rows', 'columns', 'lazy', 'raw')
+# Formats of a single row read
+ROW_FORMATS = ('rows', 'lazy', 'raw')
+# NumPy data type of every column type, columns of an unknown type are kept as objects
+DTYPES = {int: 'int64', float: 'float64', bool: 'bool', str: 'object', None: 'object'}
+# Written in place of the nulls of a typed column, they are masked
+FILLS = {'int64': 0, 'float64': float('nan'), 'bool': False, 'object': None}
+
+
+def check_result_format(format_: str, formats: tuple = RESULT_FORMATS) -> None:
+    """
+    Check that a result format is supported
+
+    :param format_: rows, columns, lazy or raw
+    :param formats: the supported formats
+    :return: None
+    """
+    if format_ not in formats:
+        err_msg = f'Unknown result format `{format_}`, available result formats: ' \
+                  f'{", ".join(formats)}.'
+        raise ValueError(err_msg)
+
+
+class ColumnBuilder:
+    """
+    Collects the rows of a read into one list per column, then builds them into NumPy masked
+    arrays typed from the sub schema, or keeps the lists if NumPy is not installed
+
+    methods:
+        add_rows(complete_vals) -> None
+        add_values(keys,vals_list) -> None
+        add_fields(vals_list) -> None
+        to_array(col,col_type) -> column(numpy.ma.MaskedArray)
+        build() -> result(dict)
+    """
+
+    def __init__(self, schema: Schema, fields: list[str] | None = None,
+                 is_numpy: bool | None = None):
+        """
+        ColumnBuilder initialization
+
+        :param schema: the schema of the sub
+        :param fields: only collect these columns, None for every column of the sub
+        :param is_numpy: build NumPy arrays, None to build them if NumPy is installed
+        """
+        self.fields = fields
+        self.col_names = tuple(fields) if fields is not None else schema.col_names
+        self.col_types = [schema.checks_by_col[col_name][2]
+                          if col_name in schema.checks_by_col else None
+                          for col_name in self.col_names]
+        if is_numpy and numpy is None:
+            raise ValueError('NumPy is needed for NumPy columns, but it is not installed.')
+        self.is_numpy = numpy is not None if is_numpy is None else is_numpy
+        # Index of every column in the values of a positional row, -1 for the key, None if the
+        # column is not in the sub
+        val_names = schema.col_names[1:]
+        self.positions = [-1 if col_name == schema.key_name
+                          else val_names.index(col_name) if col_name in val_names else None
+                          for col_name in self.col_names]
+        self.is_key_collected = -1 in self.positions
+        self.cols = [[] for _ in self.col_names]
+        self.missing = []
+
+    def add_rows(self, complete_vals: list[dict | None]) -> None:
+        """
+        Add decoded rows
+
+        :param complete_vals: complete cache values, None for every key that does not exist
+        :return: None
+        """
+        for col, col_name in zip(self.cols, self.col_names):
+            col.extend([None if complete_val is None else complete_val.get(col_name)
+                        for complete_val in complete_vals])
+        self.missing.extend([complete_val is None for complete_val in complete_vals])
+
+    def add_values(self, keys: list[str | int] | None, vals_list: list[list | None]) -> None:
+        """
+        Add rows decoded by a positional codec, they are transposed into the columns without
+        building their dicts
+
+        :param keys: the keys of the rows, None if the key column is not collected
+        :param vals_list: the values of every row, in sub_attr order and without the key,
+            None for every key that does not exist
+        :return: None
+        """
+        # Missing rows and rows shorter than sub_attr are padded with None
+        val_cols = list(itertools.zip_longest(*[() if vals is None else vals
+                                                for vals in vals_list]))
+        for col, position in zip(self.cols, self.positions):
+            if position is None or position >= len(val_cols):
+                col.extend([None] * len(vals_list))
+            elif position < 0:
+                col.extend([None if vals is None else key for key, vals in zip(keys, vals_list)])
+            else:
+                col.extend(val_cols[position])
+        self.missing.extend([vals is None for vals in vals_list])
+
+    def add_fields(self, vals_list: list[list | None]) -> None:
+        """
+        Add rows of decoded values in the order of the collected columns, they are transposed
+        into the columns
+
+        :param vals_list: the values of every row, None for every key that does not exist
+        :return: None
+        """
+        nulls = (None,) * len(self.cols)
+        val_cols = zip(*[nulls if vals is None else vals for vals in vals_list])
+        for col, val_col in zip(self.cols, val_cols):
+            col.extend(val_col)
+        self.missing.extend([vals is None for vals in vals_list])
+
+    @staticmethod
+    def to_array(col: list, col_type: type | None):
+        """
+        Convert a column into a NumPy masked array, the nulls are masked
+
+        :param col: the values of the column
+        :param col_type: python type of the column, None if unknown
+        :return: column(numpy.ma.MaskedArray)
+        """
+        dtype = DTYPES.get(col_type, 'object')
+        data = numpy.empty(len(col), dtype=object)
+        data[:] = col
+        nulls = numpy.equal(data, None)
+        if dtype != 'object':
+            if nulls.any():
+                data[nulls] = FILLS[dtype]
+            data = data.astype(dtype)
+        return numpy.ma.MaskedArray(data, mask=nulls)
+
+    def build(self) -> dict:
+        """
+        Build the collected columns
+
+        :return: result(dict), {"columns": {col_name: column}, "missing": mask}, the mask is
+            True for every key that does not exist
+        """
+        if not self.is_numpy:
+            return {'columns': dict(zip(self.col_names, self.cols)), 'missing': self.missing}
+
+        columns = {col_name: self.to_array(col, col_type)
+                   for col_name, col_type, col in zip(self.col_names, self.col_types, self.cols)}
+        return {'columns': columns,
+                'missing': numpy.fromiter(self.missing, bool, len(self.missing))}
@@ -0,0 +1,206 @@
+""" Value compression classes """
+
+import lzma
+import zlib
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Compressor:
+    """
+    Compresses encoded values using zlib. A compressed value starts with the header byte of its
+    compressor, a byte json and msgpack rows never start with, so compressed and uncompressed
+    values can be stored side by side.
+
+    methods:
+        compress(data) -> data(bytes)
+        decompress(data) -> data(bytes)
+    """
+
+    name = 'zlib'
+    header = 1
+
+    @staticmethod
+    def compress(data: bytes) -> bytes:
+        """
+        Compress encoded data, without the header byte
+
+        :param data: encoded data
+        :return: data(bytes)
+        """
+        return zlib.compress(data)
+
+    @staticmethod
+    def decompress(data: bytes) -> bytes:
+        """
+        Decompress data, without the header byte
+
+        :param data: compressed data
+        :return: data(bytes)
+        """
+        return zlib.decompress(data)
+
+
+class LzmaCompressor(Compressor):
+    """
+    Compressor using lzma, slower than zlib with a better ratio
+    """
+
+    name = 'lzma'
+    header = 2
+
+    @staticmethod
+    def compress(data: bytes) -> bytes:
+        """
+        Compress encoded data with lzma, without the header byte
+
+        :param data: encoded data
+        :return: data(bytes)
+        """
+        return lzma.compress(data)
+
+    @staticmethod
+    def decompress(data: bytes) -> bytes:
+        """
+        Decompress lzma data, without the header byte
+
+        :param data: compressed data
+        :return: data(bytes)
+        """
+        return lzma.decompress(data)
+
+
+class Lz4Compressor(Compressor):
+    """
+    Compressor using lz4, requires the lz4 package
+    """
+
+    name = 'lz4'
+    header = 3
+
+    @staticmethod
+    def compress(data: bytes) -> bytes:
+        """
+        Compress encoded data with lz4, without the header byte
+
+        :param data: encoded data
+        :return: data(bytes)
+        """
+        return lz4_frame.compress(data)
+
+    @staticmethod
+    def decompress(data: bytes) -> bytes:
+        """
+        Decompress lz4 data, without the header byte
+
+        :param data: compressed data
+        :return: data(bytes)
+        """
+        return lz4_frame.decompress(data)
+
+
+class ZstdCompressor(Compressor):
+    """
+    Compressor using zstd, requires the zstandard package
+    """
+
+    name = 'zstd'
+    header = 4
+
+    @staticmethod
+    def compress(data: bytes) -> bytes:
+        """
+        Compress encoded data with zstd, without the header byte
+
+        :param data: encoded data
+        :return: data(bytes)
+        """
+        return zstandard.ZstdCompressor().compress(data)
+
+    @staticmethod
+    def decompress(data: bytes) -> bytes:
+        """
+        Decompress zstd data, without the header byte
+
+        :param data: compressed data
+        :return: data(bytes)
+        """
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+COMPRESSORS = {
+    Compressor.name: (Compressor, zlib),
+    LzmaCompressor.name: (LzmaCompressor, lzma),
+    Lz4Compressor.name: (Lz4Compressor, lz4_frame),
+    ZstdCompressor.name: (ZstdCompressor, zstandard),
+}
+
+# Compressor of every header byte, values are read with the compressor they were written with
+HEADERS = {compressor_class.header: (compressor_class, module)
+           for compressor_class, module in COMPRESSORS.values()}
+
+
+def get_compressor(compressor_name: str) -> Compressor:
+    """
+    Get a compressor by its name. A compressor whose package is not installed raises instead of
+    falling back to zlib, the blueprint would name a compression the rows are not written with
+
+    :param compressor_name: zlib, lzma, lz4 or zstd
+    :return: compressor(Compressor)
+    """
+    if compressor_name not in COMPRESSORS:
+        err_msg = f'Unknown compression `{compressor_name}`, available compressions: ' \
+                  f'{", ".join(COMPRESSORS)}.'
+        raise ValueError(err_msg)
+
+    compressor_class, module = COMPRESSORS[compressor_name]
+    if module is None:
+        raise ValueError(f'Compression `{compressor_name}` is needed by the sub, '
+                         f'but it is not installed.')
+
+    return compressor_class()
+
+
+def compress(compressor: Compressor | None, data: bytes | str, min_size: int = 0) -> bytes | str:
+    """
+    Compress encoded data with a header byte, data under min_size bytes or that does not get
+    smaller is returned as it is
+
+    :param compressor: the compressor of the sub, None for no compression
+    :param data: encoded data
+    :param min_size: minimum size in bytes of the data to compress
+    :return: data(bytes | str)
+    """
+    if compressor is None:
+        return data
+    raw = data.encode('utf-8') if isinstance(data, str) else data
+    if len(raw) < min_size:
+        return data
+    compressed = bytes((compressor.header,)) + compressor.compress(raw)
+    return compressed if len(compressed) < len(raw) else data
+
+
+def decompress(data: bytes | str) -> bytes | str:
+    """
+    Decompress data written by "compress", uncompressed data is returned as it is
+
+    :param data: data stored in redis
+    :return: data(bytes | str)
+    """
+    # A single byte is a msgpack fixint hash field, never a compressed value
+    if not isinstance(data, bytes) or len(data) < 2 or data[0] not in HEADERS:
+        return data
+
+    compressor_class, module = HEADERS[data[0]]
+    if module is None:
+        raise ValueError(f'Compression `{compressor_class.name}` is needed to read the cache, '
+                         f'but it is not installed.')
+    return compressor_class.decompress(data[1:])
@@ -0,0 +1,277 @@
+""" Request coalescing loader classes """
+
+import asyncio
+from concurrent.futures import Future
+from threading import Condition
+from typing import Awaitable, Callable
+
+
+class GetLoader:
+    """
+    Coalesces the get calls of many threads on a sub. The first call of a window waits
+    window_ms for more calls, then reads every key of the window with one get_many. Calls for a
+    key already being read wait for that read instead of reading it again (singleflight)
+
+    methods:
+        join(complete_key) -> (future, is_leader)
+        create_future() -> future(Future)
+        take_batch() -> batch(list)
+        resolve(batch,complete_vals,exc) -> None
+        get_result(future) -> complete_val(dict) | None
+        load(complete_key,fetch_many) -> complete_val(dict) | None
+        forget(complete_keys) -> None
+        drop(complete_keys) -> None
+        stats() -> stats(dict)
+    """
+
+    def __init__(self, window_ms: float = 1.0, max_batch: int = 1000):
+        """
+        GetLoader initialization
+
+        :param window_ms: milliseconds the first call of a batch waits for more calls
+        :param max_batch: number of keys that ends the window early
+        """
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.condition = Condition()
+        # Keys waiting for the window to end, and the futures of every key not yet read
+        self.pending = []
+        self.futures = {}
+
+        self.calls = 0
+        self.batches = 0
+        self.coalesced = 0
+
+    def join(self, complete_key: str) -> tuple:
+        """
+        Get the future of a key, a new future is added to the current window
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :return: future and is_leader, the leader reads the window
+        """
+        self.calls += 1
+        future = self.futures.get(complete_key)
+        if future is not None:
+            self.coalesced += 1
+            return future, False
+
+        future = self.create_future()
+        self.futures[complete_key] = future
+        self.pending.append((complete_key, future))
+        return future, len(self.pending) == 1
+
+    @staticmethod
+    def create_future() -> Future:
+        """
+        Create the future a call waits on
+
+        :return: future(Future)
+        """
+        return Future()
+
+    def take_batch(self) -> list:
+        """
+        End the current window
+
+        :return: batch(list), complete key and future pairs
+        """
+        batch = self.pending
+        self.pending = []
+        self.batches += 1
+        return batch
+
+    def resolve(self, batch: list, complete_vals: list | None = None,
+                exc: BaseException | None = None) -> None:
+        """
+        Hand the values of a window to its waiting calls
+
+        :param batch: complete key and future pairs
+        :param complete_vals: the values read, in the order of batch
+        :param exc: the error of the read, raised by every waiting call
+        :return: None
+        """
+        for i, (complete_key, future) in enumerate(batch):
+            if self.futures.get(complete_key) is future:
+                del self.futures[complete_key]
+            if future.done():
+                continue
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(complete_vals[i])
+
+    @staticmethod
+    def get_result(future: Future | asyncio.Future) -> dict | None:
+        """
+        Get a copy of the value of a resolved future, the calls coalesced on a key do not share
+        one dict
+
+        :param future: a resolved future
+        :return: complete_val(dict) | None
+        """
+        complete_val = future.result()
+        return None if complete_val is None else dict(complete_val)
+
+    def load(self, complete_key: str, fetch_many: Callable[[list[str]], list]) -> dict | None:
+        """
+        Get a value through the current window
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param fetch_many: reads complete keys, e.g. Sub.get_many with is_key_complete
+        :return: complete_val(dict) | None
+        """
+        with self.condition:
+            future, is_leader = self.join(complete_key)
+            if not is_leader and len(self.pending) >= self.max_batch:
+                self.condition.notify_all()
+        if not is_leader:
+            return self.get_result(future)
+
+        batch = None
+        try:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.pending) >= self.max_batch, self.window)
+                batch = self.take_batch()
+            complete_vals = fetch_many([complete_key for complete_key, _ in batch])
+        except BaseException as exc:
+            # The window is ended even if the leader dies, and the waiting calls get the error
+            # instead of waiting forever
+            with self.condition:
+                self.resolve(batch if batch is not None else self.take_batch(), exc=exc)
+            raise
+        with self.condition:
+            self.resolve(batch, complete_vals)
+        return self.get_result(future)
+
+    def forget(self, complete_keys: list[bytes | str]) -> None:
+        """
+        Stop coalescing written keys into reads sent before the write, called on local writes
+
+        :param complete_keys: complete keys, None for every key
+        :return: None
+        """
+        with self.condition:
+            self.drop(complete_keys)
+
+    def drop(self, complete_keys: list[bytes | str]) -> None:
+        """
+        Remove the futures of keys already being read, called with the condition held
+
+        :param complete_keys: complete keys, None for every key
+        :return: None
+        """
+        # A key still waiting for its window is read after the write anyway
+        pending_keys = {complete_key for complete_key, _ in self.pending}
+        if complete_keys is None:
+            complete_keys = list(self.futures)
+        for complete_key in complete_keys:
+            if isinstance(complete_key, bytes):
+                complete_key = complete_key.decode('utf-8')
+            if complete_key not in pending_keys:
+                self.futures.pop(complete_key, None)
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the loader
+
+        :return: stats(dict)
+        """
+        return {'calls': self.calls, 'batches': self.batches, 'coalesced': self.coalesced}
+
+
+class AsyncGetLoader(GetLoader):
+    """
+    GetLoader for asyncio, coalesces the get calls of many coroutines. A cancelled leader hands
+    its window over to a new task, so the other calls of the window are still read
+
+    methods:
+        read_batch(batch,fetch_many) -> None
+    """
+
+    def __init__(self, window_ms: float = 1.0, max_batch: int = 1000):
+        """
+        AsyncGetLoader initialization
+
+        :param window_ms: milliseconds the first call of a batch waits for more calls
+        :param max_batch: number of keys that ends the window early
+        """
+        super().__init__(window_ms, max_batch)
+        self.is_full = None
+        # Reads handed over by cancelled leaders, kept until they are done
+        self.tasks = set()
+
+    @staticmethod
+    def create_future() -> asyncio.Future:
+        """
+        Create the future a call waits on
+
+        :return: future(asyncio.Future)
+        """
+        return asyncio.get_running_loop().create_future()
+
+    # pylint: disable=W0236,W0221
+    async def load(self, complete_key: str,
+                   fetch_many: Callable[[list[str]], Awaitable[list]]) -> dict | None:
+        """
+        Get a value through the current window
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param fetch_many: reads complete keys, e.g. AsyncSub.get_many with is_key_complete
+        :return: complete_val(dict) | None
+        """
+        future, is_leader = self.join(complete_key)
+        if not is_leader:
+            if len(self.pending) >= self.max_batch and self.is_full is not None:
+                self.is_full.set()
+            # A cancelled call must not cancel the future of the other calls on its key
+            await asyncio.shield(future)
+            return self.get_result(future)
+
+        batch = None
+        try:
+            self.is_full = asyncio.Event()
+            try:
+                await asyncio.wait_for(self.is_full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            self.is_full = None
+            batch = self.take_batch()
+            await self.read_batch(batch, fetch_many)
+        except asyncio.CancelledError:
+            # Only the leader is cancelled, a new task reads the window for the waiting calls
+            if batch is None:
+                self.is_full = None
+                batch = self.take_batch()
+            # Nobody awaits the future of the leader anymore
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            task = asyncio.get_running_loop().create_task(self.read_batch(batch, fetch_many))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            raise
+        return self.get_result(future)
+    # pylint: enable=W0236,W0221
+
+    async def read_batch(self, batch: list,
+                         fetch_many: Callable[[list[str]], Awaitable[list]]) -> None:
+        """
+        Read the keys of a window and hand the values to its waiting calls
+
+        :param batch: complete key and future pairs
+        :param fetch_many: reads complete keys, e.g. AsyncSub.get_many with is_key_complete
+        :return: None
+        """
+        try:
+            complete_vals = await fetch_many([complete_key for complete_key, _ in batch])
+        except Exception as exc:  # pylint: disable=W0718
+            self.resolve(batch, exc=exc)
+        else:
+            self.resolve(batch, complete_vals)
+
+    def forget(self, complete_keys: list[bytes | str]) -> None:
+        """
+        Stop coalescing written keys into reads sent before the write, called on local writes
+
+        :param complete_keys: complete keys, None for every key
+        :return: None
+        """
+        self.drop(complete_keys)
@@ -0,0 +1,165 @@
+""" Query builder and sub classes recording operation metrics """
+
+import functools
+from typing import Callable
+
+from querybuilder.async_sub import AsyncSub
+from querybuilder.columns import ColumnBuilder
+from querybuilder.metrics import CURRENT_OPERATION, measure_phase
+from querybuilder.querybuilder import QueryBuilder
+from querybuilder.sub import Sub
+
+# Sub methods measured as operations, the methods they call are measured as a part of them
+METERED_OPERATIONS = ('get', 'get_many', 'fetch', 'fetch_many', 'fetch_columns', 'get_all',
+                      'set', 'set_many', 'write_batch', 'get_or_load', 'get_many_or_load',
+                      'update', 'ttl', 'touch', 'find', 'range', 'count', 'aggregate', 'page',
+                      'import_from', 'export_to',
+                      'unset', 'unset_many', 'unset_all', 'drop_indexes')
+
+
+class MeteredQueryBuilder(QueryBuilder):
+    """
+    QueryBuilder adding the time spent validating, encoding and decoding rows to the current
+    operation, with the number of rows and of validation failures
+    """
+
+    def validate(self, input_: dict) -> bool:
+        is_valid = measure_phase('validate', super().validate, input_)
+        operation = CURRENT_OPERATION.get()
+        if not is_valid and operation is not None:
+            operation.counts['validation_failures'] += 1
+        return is_valid
+
+    def validate_many(self, inputs: dict) -> dict:
+        invalid_rows = measure_phase('validate', super().validate_many, inputs)
+        operation = CURRENT_OPERATION.get()
+        if operation is not None:
+            operation.counts['validation_failures'] += len(invalid_rows)
+        return invalid_rows
+
+    def validate_partial(self, input_: dict) -> bool:
+        is_valid = measure_phase('validate', super().validate_partial, input_)
+        operation = CURRENT_OPERATION.get()
+        if not is_valid and operation is not None:
+            operation.counts['validation_failures'] += 1
+        return is_valid
+
+    def encode_val(self, complete_val: dict) -> bytes | str:
+        return self.count_keys(1, measure_phase('serialize', super().encode_val, complete_val))
+
+    def encode_fields(self, val: dict) -> dict:
+        return self.count_keys(1, measure_phase('serialize', super().encode_fields, val))
+
+    def decode_val(self, val: bytes | str | None, complete_key: bytes | str | None = None)\
+            -> dict | None:
+        return self.count_keys(1, measure_phase('deserialize', super().decode_val, val,
+                                                complete_key))
+
+    def decode_vals(self, vals: list[bytes | str | None], complete_keys: list[bytes | str])\
+            -> list[dict | None]:
+        return self.count_keys(len(vals), measure_phase('deserialize', super().decode_vals,
+                                                        vals, complete_keys))
+
+    def decode_hash(self, val: dict | list | None, fields: list[str] | None = None)\
+            -> dict | None:
+        return self.count_keys(1, measure_phase('deserialize', super().decode_hash, val, fields))
+
+    def decode_columns(self, builder: ColumnBuilder, vals: list,
+                       complete_keys: list[bytes | str],
+                       is_missing_skipped: bool = False) -> list[bytes | str]:
+        return self.count_keys(len(vals), measure_phase('deserialize', super().decode_columns,
+                                                        builder, vals, complete_keys,
+                                                        is_missing_skipped))
+
+    def wrap_rows(self, vals: list, complete_keys: list[bytes | str],
+                  fields: list[str] | None = None, format_: str = 'lazy') -> list:
+        return self.count_keys(len(vals), measure_phase('deserialize', super().wrap_rows, vals,
+                                                        complete_keys, fields, format_))
+
+    def queue_delete(self, pipe, complete_keys: list[bytes | str], is_unlink: bool = False,
+                     chunk_size: int = 1000):
+        return self.count_keys(len(complete_keys),
+                               super().queue_delete(pipe, complete_keys, is_unlink, chunk_size))
+
+    @staticmethod
+    def count_keys(keys: int, result):
+        """
+        Add the rows touched by a call to the current operation
+
+        :param keys: number of rows
+        :param result: the result of the call
+        :return: the result of the call
+        """
+        operation = CURRENT_OPERATION.get()
+        if operation is not None:
+            operation.counts['keys'] += keys
+        return result
+
+
+def meter(method: Callable, operation_name: str) -> Callable:
+    """
+    Wrap a Sub method to measure it as an operation
+
+    :param method: the Sub method
+    :param operation_name: operation name, e.g. get_many
+    :return: the wrapped method
+    """
+    @functools.wraps(method)
+    def metered(self, *args, **kwargs):
+        metrics = self.query_builder.metrics
+        operation = metrics.start(self.query_builder.cache_name, self.query_builder.sub_name,
+                                  operation_name)
+        if operation is None:
+            return method(self, *args, **kwargs)
+        try:
+            result = method(self, *args, **kwargs)
+        except BaseException as exc:
+            metrics.finish(operation, exc)
+            raise
+        metrics.finish(operation)
+        return result
+
+    return metered
+
+
+def meter_async(method: Callable, operation_name: str) -> Callable:
+    """
+    Wrap an AsyncSub method to measure it as an operation
+
+    :param method: the AsyncSub method
+    :param operation_name: operation name, e.g. get_many
+    :return: the wrapped method
+    """
+    @functools.wraps(method)
+    async def metered(self, *args, **kwargs):
+        metrics = self.query_builder.metrics
+        operation = metrics.start(self.query_builder.cache_name, self.query_builder.sub_name,
+                                  operation_name)
+        if operation is None:
+            return await method(self, *args, **kwargs)
+        try:
+            result = await method(self, *args, **kwargs)
+        except BaseException as exc:
+            metrics.finish(operation, exc)
+            raise
+        metrics.finish(operation)
+        return result
+
+    return metered
+
+
+class MeteredSub(Sub):
+    """
+    Sub measuring its operations, returned by "Cache.sub()" once metrics are set up
+    """
+
+
+class AsyncMeteredSub(AsyncSub):
+    """
+    AsyncSub measuring its operations, returned by "AsyncCache.sub()" once metrics are set up
+    """
+
+
+for name in METERED_OPERATIONS:
+    setattr(MeteredSub, name, meter(getattr(Sub, name), name))
+    setattr(AsyncMeteredSub, name, meter_async(getattr(AsyncSub, name), name))
@@ -0,0 +1,449 @@
+""" Operation metrics classes """
+
+import bisect
+import contextlib
+import time
+import warnings
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, Iterator
+
+from redis.asyncio.connection import Connection as AsyncConnection
+from redis.connection import Connection
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+# Phases of an operation, total is the whole operation including the time outside the phases
+PHASES = ('total', 'validate', 'serialize', 'network', 'deserialize')
+COUNTERS = ('calls', 'errors', 'round_trips', 'keys', 'bytes_sent', 'bytes_received',
+            'validation_failures')
+COUNTER_HELPS = {
+    'calls': 'Operations run',
+    'errors': 'Operations that raised an error',
+    'round_trips': 'Commands or pipelines sent to redis',
+    'keys': 'Rows encoded, decoded or deleted',
+    'bytes_sent': 'Bytes of the commands sent to redis',
+    'bytes_received': 'Bytes of the strings in the replies of redis',
+    'validation_failures': 'Rows rejected by the validation',
+}
+
+# The operation being measured in the current thread or task, None if there is none
+CURRENT_OPERATION = ContextVar('current_operation', default=None)
+
+
+def get_size(data) -> int:
+    """
+    Get the size in bytes of a packed command or of the strings in a reply
+
+    :param data: bytes, str, int or nested lists and dicts of them
+    :return: size(int)
+    """
+    if isinstance(data, (bytes, bytearray, memoryview, str)):
+        return len(data)
+    if isinstance(data, (list, tuple)):
+        return sum(get_size(item) for item in data)
+    if isinstance(data, dict):
+        return sum(get_size(key) + get_size(item) for key, item in data.items())
+    return 0
+
+
+def measure_phase(phase: str, method: Callable, *args):
+    """
+    Call a method, adding its duration to a phase of the current operation if there is one
+
+    :param phase: validate, serialize, network or deserialize
+    :param method: the measured method
+    :param args: the arguments of the method
+    :return: the result of the method
+    """
+    operation = CURRENT_OPERATION.get()
+    if operation is None:
+        return method(*args)
+    started_at = time.perf_counter()
+    try:
+        return method(*args)
+    finally:
+        operation.phases[phase] += time.perf_counter() - started_at
+
+
+def escape_label(label: str) -> str:
+    """
+    Escape a Prometheus label value
+
+    :param label: label value
+    :return: label(str)
+    """
+    return label.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """
+    A latency histogram with fixed buckets, in seconds
+
+    methods:
+        observe(seconds) -> None
+        quantile(q) -> seconds(float)
+        snapshot() -> histogram(dict)
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        """
+        Histogram initialization
+
+        :param buckets: sorted upper bounds of the buckets in seconds
+        """
+        self.buckets = buckets
+        # The last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Add a duration to the histogram
+
+        :param seconds: duration in seconds
+        :return: None
+        """
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile, interpolated inside its bucket
+
+        :param q: quantile between 0 and 1, e.g. 0.99
+        :return: seconds(float), 0.0 if nothing has been observed
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                return low + (self.buckets[i] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        """
+        Get the histogram, the buckets are cumulative as in Prometheus
+
+        :return: histogram(dict)
+        """
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float('inf')), self.counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {'count': self.count, 'sum': self.sum, 'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99), 'buckets': buckets}
+
+
+class Operation:
+    """
+    The measures of one running operation, filled by the metered query builder and connections
+    """
+
+    __slots__ = ('cache_name', 'sub_name', 'name', 'started_at', 'phases', 'counts', 'token')
+
+    def __init__(self, cache_name: str, sub_name: str, name: str):
+        """
+        Operation initialization
+
+        :param cache_name: name of the cache
+        :param sub_name: sub name, empty for an operation of the whole cache
+        :param name: operation name, e.g. get_many
+        """
+        self.cache_name = cache_name
+        self.sub_name = sub_name
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.phases = {'validate': 0.0, 'serialize': 0.0, 'network': 0.0, 'deserialize': 0.0}
+        self.counts = {'round_trips': 0, 'keys': 0, 'bytes_sent': 0, 'bytes_received': 0,
+                       'validation_failures': 0}
+        self.token = None
+
+
+class Metrics:
+    """
+    Latency histograms per operation and phase, and counters per operation, of the subs of
+    one or more caches. Hooks are called with the measures of every finished operation
+
+    methods:
+        add_hook(hook) -> None
+        remove_hook(hook) -> None
+        start(cache_name,sub_name,operation_name) -> operation(Operation) | None
+        finish(operation,exc) -> None
+        measure(cache_name,sub_name,operation_name) -> operation(Iterator[Operation | None])
+        snapshot() -> metrics(dict)
+        to_prometheus(namespace) -> metrics(str)
+        get_histogram_lines(namespace,labels,histogram) -> lines(list[str])
+        reset() -> None
+    """
+
+    def __init__(self, buckets: tuple | list = BUCKETS, hooks: list[Callable] | None = None):
+        """
+        Metrics initialization
+
+        :param buckets: upper bounds of the latency histogram buckets in seconds
+        :param hooks: called as hook(event) after every operation, event is a dict of the
+            cache, sub, operation, seconds, phases, counts and error of the operation
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.hooks = list(hooks or [])
+        # Hooks whose failure has been warned about, a failing hook is warned about once
+        self.failed_hooks = set()
+        self.lock = Lock()
+        # {(cache_name, sub_name, operation_name): {phase: Histogram}}
+        self.histograms = {}
+        # {(cache_name, sub_name, operation_name): {counter: count}}
+        self.counters = {}
+
+    def add_hook(self, hook: Callable[[dict], None]) -> None:
+        """
+        Call a hook after every operation
+
+        :param hook: called as hook(event)
+        :return: None
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[dict], None]) -> None:
+        """
+        Stop calling a hook, if it is called
+
+        :param hook: a hook added before
+        :return: None
+        """
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+        self.failed_hooks.discard(hook)
+
+    @staticmethod
+    def start(cache_name: str, sub_name: str, operation_name: str) -> Operation | None:
+        """
+        Start measuring an operation in the current thread or task
+
+        :param cache_name: name of the cache
+        :param sub_name: sub name, empty for an operation of the whole cache
+        :param operation_name: operation name, e.g. get_many
+        :return: operation(Operation), None if an operation is already measured, the inner
+            operation is then measured as a part of the outer one
+        """
+        if CURRENT_OPERATION.get() is not None:
+            return None
+        operation = Operation(cache_name, sub_name, operation_name)
+        operation.token = CURRENT_OPERATION.set(operation)
+        return operation
+
+    def finish(self, operation: Operation, exc: BaseException | None = None) -> None:
+        """
+        Stop measuring an operation, record it and call the hooks
+
+        :param operation: the operation returned by "start"
+        :param exc: the error raised by the operation, if any
+        :return: None
+        """
+        seconds = time.perf_counter() - operation.started_at
+        CURRENT_OPERATION.reset(operation.token)
+
+        key = (operation.cache_name, operation.sub_name, operation.name)
+        with self.lock:
+            counters = self.counters.get(key)
+            if counters is None:
+                counters = self.counters[key] = dict.fromkeys(COUNTERS, 0)
+                self.histograms[key] = {phase: Histogram(self.buckets) for phase in PHASES}
+            counters['calls'] += 1
+            if exc is not None:
+                counters['errors'] += 1
+            for counter, count in operation.counts.items():
+                counters[counter] += count
+
+            histograms = self.histograms[key]
+            histograms['total'].observe(seconds)
+            # A phase the operation did not go through is not observed, e.g. validate on a get
+            for phase, phase_seconds in operation.phases.items():
+                if phase_seconds:
+                    histograms[phase].observe(phase_seconds)
+
+        if not self.hooks:
+            return
+        event = {'cache': operation.cache_name, 'sub': operation.sub_name,
+                 'operation': operation.name, 'seconds': seconds, 'phases': operation.phases,
+                 'counts': operation.counts, 'error': exc}
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception as hook_exc:  # pylint: disable=W0718
+                if hook in self.failed_hooks:
+                    continue
+                self.failed_hooks.add(hook)
+                warnings.warn(f'Metrics hook `{getattr(hook, "__name__", hook)}` failed: '
+                              f'{hook_exc!r}, its next failures are not reported.',
+                              RuntimeWarning, stacklevel=2)
+
+    @contextlib.contextmanager
+    def measure(self, cache_name: str, sub_name: str,
+                operation_name: str) -> Iterator[Operation | None]:
+        """
+        Measure the operation run inside the with block
+
+        :param cache_name: name of the cache
+        :param sub_name: sub name, empty for an operation of the whole cache
+        :param operation_name: operation name, e.g. get_many
+        :return: operation(Operation), None inside another measured operation
+        """
+        operation = self.start(cache_name, sub_name, operation_name)
+        if operation is None:
+            yield None
+            return
+        try:
+            yield operation
+        except BaseException as exc:
+            self.finish(operation, exc)
+            raise
+        self.finish(operation)
+
+    def snapshot(self) -> dict:
+        """
+        Get the counters and the histograms of every operation
+
+        :return: metrics(dict), e.g. {"my_cache": {"users": {"get": {"calls": 1, ...,
+            "phases": {"total": {"count": 1, "sum": 0.0002, "p50": ...}}}}}}
+        """
+        metrics = {}
+        with self.lock:
+            for (cache_name, sub_name, operation_name), counters in self.counters.items():
+                phases = {phase: histogram.snapshot() for phase, histogram
+                          in self.histograms[(cache_name, sub_name, operation_name)].items()
+                          if histogram.count}
+                subs = metrics.setdefault(cache_name, {})
+                subs.setdefault(sub_name, {})[operation_name] = {**counters, 'phases': phases}
+        return metrics
+
+    def to_prometheus(self, namespace: str = 'redisadapter') -> str:
+        """
+        Export the metrics in the Prometheus text format
+
+        :param namespace: prefix of the metric names
+        :return: metrics(str)
+        """
+        lines = [f'# HELP {namespace}_operation_seconds Latency of the operations by phase',
+                 f'# TYPE {namespace}_operation_seconds histogram']
+        with self.lock:
+            for (cache_name, sub_name, operation_name), histograms in self.histograms.items():
+                for phase, histogram in histograms.items():
+                    if histogram.count:
+                        labels = f'cache="{escape_label(cache_name)}",' \
+                                 f'sub="{escape_label(sub_name)}",' \
+                                 f'operation="{operation_name}",phase="{phase}"'
+                        lines.extend(self.get_histogram_lines(namespace, labels, histogram))
+
+            for counter in COUNTERS:
+                lines.append(f'# HELP {namespace}_{counter}_total {COUNTER_HELPS[counter]}')
+                lines.append(f'# TYPE {namespace}_{counter}_total counter')
+                for (cache_name, sub_name, operation_name), counters in self.counters.items():
+                    labels = f'cache="{escape_label(cache_name)}",' \
+                             f'sub="{escape_label(sub_name)}",operation="{operation_name}"'
+                    lines.append(f'{namespace}_{counter}_total{{{labels}}} {counters[counter]}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def get_histogram_lines(namespace: str, labels: str, histogram: Histogram) -> list[str]:
+        """
+        Get the Prometheus lines of a latency histogram
+
+        :param namespace: prefix of the metric names
+        :param labels: the labels of the histogram, e.g. 'cache="my_cache",sub="users"'
+        :param histogram: the histogram
+        :return: lines(list[str])
+        """
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+            cumulative += count
+            lines.append(f'{namespace}_operation_seconds_bucket{{{labels},le="{bound}"}} '
+                         f'{cumulative}')
+        lines.append(f'{namespace}_operation_seconds_sum{{{labels}}} {histogram.sum}')
+        lines.append(f'{namespace}_operation_seconds_count{{{labels}}} {histogram.count}')
+        return lines
+
+    def reset(self) -> None:
+        """
+        Remove every counter and histogram
+
+        :return: None
+        """
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+class MeteredConnection(Connection):
+    """
+    Redis connection adding its round trips, bytes and network time to the current operation,
+    it behaves like Connection while no operation is measured
+    """
+
+    def send_packed_command(self, command, check_health=True):
+        operation = CURRENT_OPERATION.get()
+        if operation is None:
+            return super().send_packed_command(command, check_health)
+        started_at = time.perf_counter()
+        try:
+            return super().send_packed_command(command, check_health)
+        finally:
+            operation.phases['network'] += time.perf_counter() - started_at
+            operation.counts['round_trips'] += 1
+            operation.counts['bytes_sent'] += get_size(command)
+
+    def read_response(self, *args, **kwargs):
+        operation = CURRENT_OPERATION.get()
+        if operation is None:
+            return super().read_response(*args, **kwargs)
+        started_at = time.perf_counter()
+        try:
+            response = super().read_response(*args, **kwargs)
+        finally:
+            operation.phases['network'] += time.perf_counter() - started_at
+        operation.counts['bytes_received'] += get_size(response)
+        return response
+
+
+class AsyncMeteredConnection(AsyncConnection):
+    """
+    redis.asyncio connection adding its round trips, bytes and network time to the current
+    operation, it behaves like Connection while no operation is measured
+    """
+
+    async def send_packed_command(self, command, check_health=True):
+        operation = CURRENT_OPERATION.get()
+        if operation is None:
+            return await super().send_packed_command(command, check_health)
+        started_at = time.perf_counter()
+        try:
+            return await super().send_packed_command(command, check_health)
+        finally:
+            operation.phases['network'] += time.perf_counter() - started_at
+            operation.counts['round_trips'] += 1
+            operation.counts['bytes_sent'] += get_size(command)
+
+    async def read_response(self, *args, **kwargs):
+        operation = CURRENT_OPERATION.get()
+        if operation is None:
+            return await super().read_response(*args, **kwargs)
+        started_at = time.perf_counter()
+        try:
+            response = await super().read_response(*args, **kwargs)
+        finally:
+            operation.phases['network'] += time.perf_counter() - started_at
+        operation.counts['bytes_received'] += get_size(response)
+        return response
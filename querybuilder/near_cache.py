@@ -0,0 +1,358 @@
+""" In-process near cache classes """
+
+import sys
+import time
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+
+from redis.connection import Connection
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import ResponseError, TimeoutError as RedisTimeoutError
+
+
+class NearCache:
+    """
+    A bounded LRU cache of decoded rows kept in the process memory, in front of a sub
+
+    methods:
+        is_coherent() -> is_coherent(bool)
+        get_size(complete_val) -> size(int)
+        normalize_key(complete_key) -> complete_key(str)
+        get(complete_key) -> complete_val(dict) | None
+        put(complete_key,complete_val,generation) -> None
+        get_many(complete_keys) -> complete_vals(list[dict | None])
+        put_many(complete_keys,complete_vals,generation) -> None
+        invalidate(complete_keys) -> None
+        clear() -> None
+        stats() -> stats(dict)
+    """
+
+    def __init__(self, max_entries: int | None = 10000, max_bytes: int | None = None,
+                 ttl: float | None = 60.0):
+        """
+        NearCache initialization
+
+        :param max_entries: maximum number of rows, None for no limit
+        :param max_bytes: maximum estimated size of the rows in bytes, None for no limit
+        :param ttl: seconds a row is served before it is read from redis again, None for no ttl
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.rows = OrderedDict()
+        self.bytes = 0
+        self.lock = Lock()
+        # Bumped by every invalidation, a row read before the bump might be stale
+        self.generation = 0
+        self.invalidator = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def is_coherent(self) -> bool:
+        """
+        Check if the rows can be served, not while the invalidator is disconnected from redis
+
+        :return: is_coherent(bool)
+        """
+        return self.invalidator is None or self.invalidator.is_subscribed.is_set()
+
+    @staticmethod
+    def get_size(complete_val: dict) -> int:
+        """
+        Estimate the memory size of a row
+
+        :param complete_val: complete cache value
+        :return: size in bytes(int)
+        """
+        return sys.getsizeof(complete_val) + sum(sys.getsizeof(data)
+                                                 for data in complete_val.values())
+
+    @staticmethod
+    def normalize_key(complete_key: bytes | str) -> str:
+        """
+        Convert a complete key from redis into str
+
+        :param complete_key: complete key
+        :return: complete_key(str)
+        """
+        if isinstance(complete_key, bytes):
+            return complete_key.decode('utf-8')
+        return complete_key
+
+    def get(self, complete_key: bytes | str) -> dict | None:
+        """
+        Get a copy of a row
+
+        :param complete_key: complete key
+        :return: complete_val(dict) | None if the row is not cached
+        """
+        complete_key = self.normalize_key(complete_key)
+        with self.lock:
+            row = self.rows.get(complete_key) if self.is_coherent() else None
+            if row is None:
+                self.misses += 1
+                return None
+
+            complete_val, size, expire_at = row
+            if expire_at is not None and expire_at <= time.monotonic():
+                del self.rows[complete_key]
+                self.bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.rows.move_to_end(complete_key)
+            self.hits += 1
+            return dict(complete_val)
+
+    def put(self, complete_key: bytes | str, complete_val: dict | None, generation: int) -> None:
+        """
+        Put a copy of a row read from redis, rows invalidated since the read are dropped
+
+        :param complete_key: complete key
+        :param complete_val: complete cache value, None is not cached
+        :param generation: the value of "generation" before the row was read from redis
+        :return: None
+        """
+        if complete_val is None:
+            return
+
+        complete_key = self.normalize_key(complete_key)
+        size = self.get_size(complete_val)
+        expire_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            if generation != self.generation or not self.is_coherent():
+                return
+
+            old_row = self.rows.pop(complete_key, None)
+            if old_row is not None:
+                self.bytes -= old_row[1]
+            self.rows[complete_key] = (dict(complete_val), size, expire_at)
+            self.bytes += size
+
+            while self.rows and (
+                    (self.max_entries is not None and len(self.rows) > self.max_entries) or
+                    (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                _, (_, evicted_size, _) = self.rows.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def get_many(self, complete_keys: list[bytes | str]) -> list[dict | None]:
+        """
+        Get a copy of multiple rows
+
+        :param complete_keys: complete keys
+        :return: complete_vals(list[dict | None]), None for every row that is not cached
+        """
+        return [self.get(complete_key) for complete_key in complete_keys]
+
+    def put_many(self, complete_keys: list[bytes | str], complete_vals: list[dict | None],
+                 generation: int) -> None:
+        """
+        Put a copy of multiple rows read from redis
+
+        :param complete_keys: complete keys
+        :param complete_vals: complete cache values, None is not cached
+        :param generation: the value of "generation" before the rows were read from redis
+        :return: None
+        """
+        for complete_key, complete_val in zip(complete_keys, complete_vals):
+            self.put(complete_key, complete_val, generation)
+
+    def invalidate(self, complete_keys: list[bytes | str]) -> None:
+        """
+        Remove rows, called on local writes and on invalidation messages from redis
+
+        :param complete_keys: complete keys
+        :return: None
+        """
+        with self.lock:
+            self.generation += 1
+            for complete_key in complete_keys:
+                row = self.rows.pop(self.normalize_key(complete_key), None)
+                if row is not None:
+                    self.bytes -= row[1]
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        """
+        Remove every row
+
+        :return: None
+        """
+        with self.lock:
+            self.generation += 1
+            self.invalidations += len(self.rows)
+            self.rows.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the near cache
+
+        :return: stats(dict)
+        """
+        with self.lock:
+            return {
+                'entries': len(self.rows),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+class NearCacheInvalidator(Thread):
+    """
+    A background thread keeping a near cache coherent with redis. It uses the CLIENT TRACKING
+    broadcast mode on the sub key prefix, and falls back to keyspace notifications when CLIENT
+    TRACKING is not supported. The fallback checks that "notify-keyspace-events" has the flags
+    it needs, otherwise the invalidator stops with an error and the near cache serves no row.
+    The near cache is cleared every time the subscription is (re)made.
+
+    methods:
+        subscribe(connection) -> mode(str)
+        check_keyspace_events(connection) -> None
+        handle(message) -> None
+        stop() -> None
+    """
+
+    INVALIDATE_CHANNEL = '__redis__:invalidate'
+    # Keyspace events of the writes, deletions, expirations and evictions of string and hash rows
+    KEYSPACE_FLAGS = 'Kg$hxe'
+
+    def __init__(self, near_cache: NearCache, connection_kwargs: dict, key_prefix: str,
+                 db: int = 0, retry_delay: float = 1.0):
+        """
+        NearCacheInvalidator initialization
+
+        :param near_cache: the near cache to keep coherent
+        :param connection_kwargs: redis connection args, e.g. {"host": "127.0.0.1"}
+        :param key_prefix: the sub key prefix "<cache_name>/<sub_name>/"
+        :param db: redis database number, used by keyspace notifications
+        :param retry_delay: seconds to wait before reconnecting
+        """
+        super().__init__(name=f'near_cache-{key_prefix}', daemon=True)
+        self.near_cache = near_cache
+        self.connection_kwargs = connection_kwargs
+        self.key_prefix = key_prefix
+        self.db = db
+        self.retry_delay = retry_delay
+        self.mode = None
+        # The error that stopped the invalidator, the near cache can not be kept coherent
+        self.error = None
+        self.is_subscribed = Event()
+        # Set once the first subscription is made or has failed with an error
+        self.is_ready = Event()
+        self.is_stopped = Event()
+
+    def subscribe(self, connection: Connection) -> str:
+        """
+        Subscribe to the invalidation messages of the sub keys
+
+        :param connection: a dedicated redis connection
+        :return: mode(str), tracking or keyspace
+        """
+        connection.send_command('CLIENT', 'ID')
+        client_id = connection.read_response()
+        try:
+            connection.send_command('CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id,
+                                    'BCAST', 'PREFIX', self.key_prefix)
+            connection.read_response()
+            connection.send_command('SUBSCRIBE', self.INVALIDATE_CHANNEL)
+            connection.read_response()
+            return 'tracking'
+        except ResponseError:
+            self.check_keyspace_events(connection)
+            connection.send_command('PSUBSCRIBE', f'__keyspace@{self.db}__:{self.key_prefix}*')
+            connection.read_response()
+            return 'keyspace'
+
+    def check_keyspace_events(self, connection: Connection) -> None:
+        """
+        Check that the server publishes the keyspace events of the sub keys, PSUBSCRIBE succeeds
+        without them and no invalidation would ever arrive
+
+        :param connection: a dedicated redis connection
+        :return: None
+        """
+        try:
+            connection.send_command('CONFIG', 'GET', 'notify-keyspace-events')
+            response = connection.read_response()
+        except ResponseError as exc:
+            err_msg = 'A tracked near cache needs CLIENT TRACKING or CONFIG GET to check ' \
+                      '"notify-keyspace-events".'
+            raise ValueError(err_msg) from exc
+
+        flags = response[1].decode('utf-8') if response else ''
+        if 'A' in flags:
+            flags += 'g$lshzxet'
+        missing_flags = [flag for flag in self.KEYSPACE_FLAGS if flag not in flags]
+        if missing_flags:
+            err_msg = f'A tracked near cache needs "notify-keyspace-events" to include ' \
+                      f'`{self.KEYSPACE_FLAGS}`, `{"".join(missing_flags)}` missing.'
+            raise ValueError(err_msg)
+
+    def handle(self, message: list) -> None:
+        """
+        Invalidate the near cache from a pub/sub message
+
+        :param message: pub/sub message read from redis
+        :return: None
+        """
+        kind = message[0]
+        if kind == b'message':
+            complete_keys = message[2]
+            # A nil key list is sent on FLUSHALL/FLUSHDB
+            if complete_keys is None:
+                self.near_cache.clear()
+            elif isinstance(complete_keys, list):
+                self.near_cache.invalidate(complete_keys)
+        elif kind == b'pmessage':
+            channel = self.near_cache.normalize_key(message[2])
+            self.near_cache.invalidate([channel.split(':', 1)[1]])
+
+    def run(self) -> None:
+        """
+        Read invalidation messages until stopped, reconnecting on connection errors
+
+        :return: None
+        """
+        while not self.is_stopped.is_set():
+            connection = Connection(**self.connection_kwargs, protocol=2)
+            try:
+                connection.connect()
+                self.mode = self.subscribe(connection)
+                self.near_cache.clear()
+                self.is_subscribed.set()
+                self.is_ready.set()
+
+                while not self.is_stopped.is_set():
+                    if connection.can_read(timeout=0.5):
+                        self.handle(connection.read_response())
+            except (RedisConnectionError, RedisTimeoutError, OSError):
+                self.is_subscribed.clear()
+                self.near_cache.clear()
+                self.is_stopped.wait(self.retry_delay)
+            except ValueError as exc:
+                self.error = exc
+                self.is_subscribed.clear()
+                self.near_cache.clear()
+                self.is_ready.set()
+                self.is_stopped.set()
+            finally:
+                connection.disconnect()
+
+    def stop(self) -> None:
+        """
+        Stop the thread
+
+        :return: None
+        """
+        self.is_stopped.set()
@@ -1,33 +1,1269 @@
 """ QueryBuilder: the data class """
 
+import json
+import math
+import os
+import random
+import time
 from dataclasses import dataclass
+from typing import IO, Callable, Iterator
+
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.crc import key_slot
+from redis.exceptions import NoScriptError
 
-from querybuilder.validation import Validation
+from querybuilder import scripts
+from querybuilder.aggregation import Aggregation
+from querybuilder.bulk import read_rows
+from querybuilder.columns import ROW_FORMATS, ColumnBuilder, check_result_format
+from querybuilder.loader import GetLoader
+from querybuilder.metrics import Metrics
+from querybuilder.near_cache import NearCache
+from querybuilder.rows import LazyRow
+from querybuilder.schema import Schema
 
 
 @dataclass
 class QueryBuilder:
     """
-    Query Builder main class, containing essential information to run the cache query
+    Query Builder main class, containing essential information to run the cache query.
+    It does no I/O, so it is shared by Sub and AsyncSub.
 
     methods:
+        get_redis(complete_key) -> redis(Redis | AsyncRedis)
+        pipeline(is_transaction) -> pipe
+        group_by_slot(complete_keys,chunk_size) -> groups(list[list[str]])
+        get_complete_key(key) -> complete_key(str)
+        get_complete_keys(keys,is_key_complete) -> complete_keys(list[str])
+        get_key(complete_key) -> key(str | int)
+        get_complete_val(key,val) -> complete_val(dict)
+        get_complete_key_vals(key_vals,is_key_complete,is_val_complete) -> complete_key_vals(dict)
+        get_import_row(row) -> (complete_key, complete_val, invalid_cols)
+        iter_import_chunks(path_or_stream,format_,chunk_size) -> chunks(Iterator[tuple])
+        encode_val(complete_val) -> val(bytes | str)
+        encode_fields(val) -> fields(dict)
+        decode_val(val,complete_key) -> complete_val(dict) | None
+        decode_vals(vals,complete_keys) -> complete_vals(list[dict | None])
+        decode_hash(val,fields) -> complete_val(dict) | None
+        decode_columns(builder,vals,complete_keys,is_missing_skipped) -> missing_keys(list)
+        check_row_format(format_,fields) -> None
+        wrap_rows(vals,complete_keys,fields,format_) -> rows(list)
+        project(complete_val,fields) -> val(dict) | None
+        project_many(complete_vals,fields) -> vals(list[dict | None])
+        get_missing_keys(complete_keys,vals) -> missing_keys(list)
+        fill_missing(complete_vals,missing_vals) -> complete_vals(list[dict | None])
+        decode_row(val,complete_key,fields,format_) -> value(dict) | None
+        decode_rows(vals,complete_keys,fields,format_) -> values(list[dict | None])
+        queue_get(pipe,complete_key,fields) -> pipe
+        queue_get_many(pipe,complete_keys,fields) -> pipe
+        queue_mget(pipe,complete_keys) -> pipe
+        get_ttl(ttl) -> ttl(int) | None
+        queue_set(pipe,complete_key,complete_val,ttl,is_keep_ttl) -> pipe
+        queue_set_many(pipe,complete_key_vals,ttl) -> pipe
+        queue_write(pipe,complete_key_vals,ttl) -> pipe
+        queue_write_batch(pipe,complete_key_vals,ttl) -> pipe
+        queue_delete(pipe,complete_keys,is_unlink,chunk_size) -> pipe
+        queue_unset(pipe,complete_keys,is_unlink,chunk_size) -> delete_count(int)
+        queue_touch(pipe,complete_keys,ttl) -> pipe
+        queue_update_hash(pipe,complete_key,partial_val) -> pipe
+        queue_update(pipe,complete_key,partial_val) -> pipe
+        queue_merge(pipe,complete_key,val,partial_val) -> is_queued(bool)
+        get_index_val(col_name,data) -> index_val(str | float) | None
+        get_index_key(col_name,data) -> index_key(str)
+        queue_index(pipe,complete_keys,mode,complete_vals,chunk_size) -> pipe
+        queue_find(pipe,conditions) -> pipe
+        get_found_keys(results,limit) -> complete_keys(list)
+        queue_range(pipe,col_name,low,high,limit,is_desc) -> pipe
+        get_registry_score(complete_key) -> score(float)
+        queue_register(pipe,complete_keys,mode,chunk_size,ttl) -> pipe
+        queue_due(pipe,limit) -> pipe
+        is_expiring(ttl) -> is_expiring(bool)
+        queue_expire(pipe,due_keys) -> pipe
+        queue_page(pipe,after,limit) -> pipe
+        queue_aggregate(pipe,complete_keys,aggregation,is_loaded) -> pipe
+        get_unloaded_chunks(chunks,results) -> unloaded_chunks(list)
+        add_aggregate_results(aggregation,results,retried_results) -> (skipped_keys, missing_keys)
+        queue_load_read(pipe,complete_keys) -> pipe
+        decode_load_read(results,complete_keys) -> reads(list[tuple])
+        split_load_read(results,complete_keys,beta) -> (complete_vals, missing, refresh)
+        split_lock_read(results,lock_keys,refresh,complete_vals) -> (load_keys, unlock_keys)
+        get_loaded_key_vals(complete_keys,keys_by_complete_key,key_vals) -> complete_key_vals(dict)
+        is_early_refresh(pttl,delta,beta) -> is_early_refresh(bool)
+        queue_lock(pipe,complete_keys,token,lock_ms) -> pipe
+        queue_unlock(pipe,complete_keys,token) -> pipe
+        queue_delta(pipe,complete_keys,delta,ttl) -> pipe
+        invalidate_near_cache(complete_keys) -> None
         validate(input_) -> is_valid(bool)
+        validate_many(inputs) -> invalid_rows(dict)
+        validate_partial(input_) -> is_valid(bool)
     """
 
-    def __init__(self, redis: Redis, cache_name: str, sub_name: str, sub_attr: dict):
+    # Seconds between the reads of a worker waiting for another worker to recompute a row
+    LOAD_RETRY = 0.02
+    # Minimum number of registered rows checked for expiry per write of expiring rows
+    EXPIRE_BATCH = 100
+    # Largest INTEGER key whose registry score, a double, is exact
+    MAX_REGISTRY_KEY = 2 ** 53
+
+    def __init__(self, redis: Redis | AsyncRedis, cache_name: str, sub_name: str, sub_attr: dict,
+                 schema: Schema | None = None, near_cache: NearCache | None = None,
+                 node_client: Callable[[str], Redis | AsyncRedis] | None = None,
+                 loader: GetLoader | None = None, metrics: Metrics | None = None):
         """
         Query Builder initialization
 
-        :param redis: Redis connection
+        :param redis: Redis connection, either sync or asyncio
         :param cache_name: cache name, a context name for dividing cache from another app
         :param sub_name: sub name, similar to table in SQL
         :param sub_attr: sub attributes, e.g. {"name": "TEXT"}
+        :param schema: compiled sub_attr, compiled here if not given
+        :param near_cache: in-process cache of decoded rows in front of redis
+        :param node_client: resolves the client of the cluster node or shard owning a key,
+            None if redis is neither a cluster nor sharded
+        :param loader: coalesces the concurrent get calls of the sub
+        :param metrics: records the operations of the sub, used by MeteredQueryBuilder
         """
         self.redis = redis
         self.cache_name = cache_name
         self.sub_name = sub_name
         self.sub_attr = sub_attr
+        self.schema = schema if schema is not None else Schema(sub_attr)
+        self.near_cache = near_cache
+        self.loader = loader
+        self.metrics = metrics
+        # A hash tag maps every key of the sub, its indexes and its registry to one cluster slot,
+        # the scripts build the index keys from index_prefix, so it must hold the hash tag
+        key_tag = f'{cache_name}/{sub_name}'
+        if self.schema.is_hash_tagged:
+            key_tag = f'{{{key_tag}}}'
+        self.key_prefix = f'{key_tag}/'
+        self.index_rows_key = f'__index__/{key_tag}'
+        self.index_prefix = f'{self.index_rows_key}/'
+        self.registry_key = f'__registry__/{key_tag}'
+        self.expiry_key = f'__expiry__/{key_tag}'
+
+        # The rows of a sub without hash tag are spread over the cluster slots or the shards, so
+        # they can not share a MULTI/EXEC or a multi-key command, a hash tagged sub runs on its
+        # node instead
+        self.node_client = node_client
+        self.is_cluster = node_client is not None and not self.schema.is_hash_tagged
+        if node_client is not None and self.schema.is_hash_tagged:
+            self.redis = node_client(self.key_prefix)
+
+    def get_redis(self, complete_key: str) -> Redis | AsyncRedis:
+        """
+        Get the client to WATCH a key, the client of the node owning it in cluster mode
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :return: redis(Redis | AsyncRedis)
+        """
+        if self.is_cluster:
+            return self.node_client(complete_key)
+        return self.redis
+
+    def pipeline(self, is_transaction: bool = True):
+        """
+        Open a pipeline, a MULTI/EXEC transaction unless the rows are spread over a cluster,
+        where the commands are sent to every node in parallel instead
+
+        :param is_transaction: wrap the commands in MULTI/EXEC
+        :return: sync or asyncio redis pipeline
+        """
+        return self.redis.pipeline(transaction=is_transaction and not self.is_cluster)
+
+    def group_by_slot(self, complete_keys: list[bytes | str], chunk_size: int = 1000)\
+            -> list[list[bytes | str]]:
+        """
+        Split complete keys into chunks for multi-key commands, the keys of a chunk share
+        one cluster slot in cluster mode
+
+        :param complete_keys: complete keys
+        :param chunk_size: maximum number of keys per chunk
+        :return: groups(list[list[bytes | str]])
+        """
+        groups = [complete_keys]
+        if self.is_cluster:
+            slots = {}
+            for complete_key in complete_keys:
+                encoded_key = complete_key.encode('utf-8') if isinstance(complete_key, str)\
+                    else complete_key
+                slots.setdefault(key_slot(encoded_key), []).append(complete_key)
+            groups = list(slots.values())
+
+        return [group[i:i + chunk_size] for group in groups
+                for i in range(0, len(group), chunk_size)]
+
+    def get_complete_key(self, key: str | int) -> str:
+        """
+        Generates a complete key "<cache_name>/<sub_name>/<key>"
+
+        :param key: the key of a sub, the value of first element in the sub_attr
+        :return: complete_key in "<cache_name>/<sub_name>/<key>" format
+        """
+        return f'{self.key_prefix}{str(key)}'
+
+    def get_complete_keys(self, keys: list[str] | list[int], is_key_complete: bool = False)\
+            -> list[str]:
+        """
+        Generates complete keys from a key list
+
+        :param keys: a key list
+        :param is_key_complete: is key already in complete form or not
+        :return: complete_keys(list[str])
+        """
+        if is_key_complete:
+            return keys
+        return [self.get_complete_key(key) for key in keys]
+
+    def get_key(self, complete_key: bytes | str) -> str | int:
+        """
+        Extracts the key from a complete key, in the data type of the key column
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :return: key(str | int)
+        """
+        if isinstance(complete_key, bytes):
+            complete_key = complete_key.decode('utf-8')
+        return self.schema.key_coercer(complete_key[len(self.key_prefix):])
+
+    def get_complete_val(self, key: str | int, val: dict) -> dict:
+        """
+        Generates a complete cache value, including the key itself
+
+        :param key: the key of a cache, the value of first element in the sub_attr
+        :param val: the val of a cache, the value of the rest in the sub_attr
+        :return:  complete_val(dict)
+        """
+        return {self.schema.key_name: self.schema.key_coercer(key), **val}
+
+    def get_import_row(self, row: dict | None) -> tuple:
+        """
+        Generates the complete key and the complete value of an imported row and validates it
+
+        :param row: an imported row, including its key column, None if it could not be parsed
+        :return: complete_key, complete_val and invalid_cols, complete_key and complete_val are
+            None if the row is invalid
+        """
+        key_name = self.schema.key_name
+        if row is None:
+            return None, None, []
+        if row.get(key_name) is None:
+            return None, None, [key_name]
+        try:
+            key = self.schema.coerce_key(row[key_name])
+        except (TypeError, ValueError):
+            return None, None, [key_name]
+
+        complete_val = {**row, key_name: key}
+        if not self.validate(complete_val):
+            return None, None, self.schema.get_invalid_cols(complete_val)
+        return self.get_complete_key(key), complete_val, []
+
+    def iter_import_chunks(self, path_or_stream: str | os.PathLike | IO, format_: str = 'ndjson',
+                           chunk_size: int = 1000) -> Iterator[tuple[dict, list[tuple]]]:
+        """
+        Reads the rows of an NDJSON or CSV input in chunks of validated rows, the reads are
+        blocking and run in a thread with AsyncSub
+
+        :param path_or_stream: a file path, read through mmap, or a text or binary stream
+        :param format_: ndjson, one json object per line, or csv with a header of column names
+        :param chunk_size: number of valid rows per chunk, only the last chunk is smaller
+        :return: an iterator of complete_key_vals(dict) and rejects(list), the record and the
+            invalid_cols of every rejected row, the record is the position of the row in the
+            input, starting at 1
+        """
+        chunk = {}
+        rejects = []
+        for record, row in enumerate(read_rows(path_or_stream, format_, self.schema), 1):
+            complete_key, complete_val, invalid_cols = self.get_import_row(row)
+            if complete_key is None:
+                rejects.append((record, invalid_cols))
+                continue
+
+            chunk[complete_key] = complete_val
+            if len(chunk) >= chunk_size:
+                yield chunk, rejects
+                chunk = {}
+                rejects = []
+
+        if chunk or rejects:
+            yield chunk, rejects
+
+    def get_complete_key_vals(self, key_vals: dict[str, dict] | dict[int, dict],
+                              is_key_complete: bool = False, is_val_complete: bool = False)\
+            -> dict[str, dict]:
+        """
+        Generates complete keys and complete values from key and value pairs
+
+        :param key_vals: a dict contains key and value pairs
+        :param is_key_complete: is key already in complete form or not
+        :param is_val_complete: is val already in complete form or not
+        :return: complete_key_vals(dict)
+        """
+        complete_key_vals = {}
+        for key, val in key_vals.items():
+            complete_key = key if is_key_complete else self.get_complete_key(key)
+            complete_val = val if is_val_complete else self.get_complete_val(key, val)
+            complete_key_vals[complete_key] = complete_val
+
+        return complete_key_vals
+
+    def encode_val(self, complete_val: dict) -> bytes | str:
+        """
+        Encodes a complete value into what is stored in redis, using the sub codec
+
+        :param complete_val: complete cache value
+        :return: val(bytes | str)
+        """
+        return self.schema.codec.encode(complete_val)
+
+    def encode_fields(self, val: dict) -> dict:
+        """
+        Encodes the columns of a value into the fields of a redis hash, using the sub codec
+
+        :param val: complete or partial cache value
+        :return: fields(dict)
+        """
+        return self.schema.codec.encode_fields(val)
+
+    def decode_val(self, val: bytes | str | None, complete_key: bytes | str | None = None)\
+            -> dict | None:
+        """
+        Decodes a value stored in redis, using the sub codec
+
+        :param val: value stored in redis, None if the key does not exist
+        :param complete_key: the complete key of the value, required by positional codecs
+        :return: complete_val(dict) | None
+        """
+        if val is None:
+            return None
+        if self.schema.codec.is_positional:
+            return self.schema.codec.decode(val, self.get_key(complete_key))
+        return self.schema.codec.decode(val)
+
+    def decode_vals(self, vals: list[bytes | str | None], complete_keys: list[bytes | str])\
+            -> list[dict | None]:
+        """
+        Decodes values stored in redis, using the sub codec
+
+        :param vals: values stored in redis, None for every key that does not exist
+        :param complete_keys: the complete keys of the values
+        :return: complete_vals(list[dict | None])
+        """
+        codec = self.schema.codec
+        if codec.is_positional:
+            return [None if val is None else codec.decode(val, self.get_key(complete_key))
+                    for val, complete_key in zip(vals, complete_keys)]
+        return [None if val is None else codec.decode(val) for val in vals]
+
+    def decode_hash(self, val: dict | list | None, fields: list[str] | None = None)\
+            -> dict | None:
+        """
+        Decodes a row stored as a redis hash
+
+        :param val: HGETALL result, or HMGET result if fields are given
+        :param fields: the projected fields, None for every field
+        :return: complete_val(dict) | None
+        """
+        if fields is None:
+            if not val:
+                return None
+            return self.schema.codec.decode_fields(val)
+
+        # Every field is written on set, so all of them missing means the row is missing
+        if all(data is None for data in val):
+            return None
+        return {col_name: None if data is None else self.schema.codec.decode_field(data)
+                for col_name, data in zip(fields, val)}
+
+    def decode_columns(self, builder: ColumnBuilder, vals: list,
+                       complete_keys: list[bytes | str],
+                       is_missing_skipped: bool = False) -> list[bytes | str]:
+        """
+        Decodes rows read from redis into a column builder, the rows of a positional codec
+        and the projected rows of a hash are added without building their dict
+
+        :param builder: collects the columns, its fields are the projected fields
+        :param vals: MGET results on string storage, HGETALL or HMGET results on hash storage
+        :param complete_keys: the complete keys of the values
+        :param is_missing_skipped: leave the keys that do not exist out of the columns
+        :return: missing_keys(list), the complete keys of the rows that do not exist
+        """
+        codec = self.schema.codec
+        is_hash = self.schema.is_hash
+        is_positional = not is_hash and codec.is_positional
+        is_projected = is_hash and builder.fields is not None
+        if is_positional:
+            rows = [None if val is None else codec.decode_values(val) for val in vals]
+        elif not is_hash:
+            rows = [None if val is None else codec.decode(val) for val in vals]
+        elif is_projected:
+            # Every field is written on set, so all of them missing means the row is missing
+            rows = [None if all(data is None for data in val)
+                    else [None if data is None else codec.decode_field(data) for data in val]
+                    for val in vals]
+        else:
+            rows = [codec.decode_fields(val) if val else None for val in vals]
+
+        missing_keys = [complete_key for complete_key, row in zip(complete_keys, rows)
+                        if row is None]
+        if missing_keys and is_missing_skipped:
+            complete_keys = [complete_key for complete_key, row in zip(complete_keys, rows)
+                             if row is not None]
+            rows = [row for row in rows if row is not None]
+
+        if is_positional:
+            keys = None
+            if builder.is_key_collected:
+                keys = [self.get_key(complete_key) for complete_key in complete_keys]
+            builder.add_values(keys, rows)
+        elif is_projected:
+            builder.add_fields(rows)
+        else:
+            builder.add_rows(rows)
+        return missing_keys
+
+    def check_row_format(self, format_: str, fields: list[str] | None = None) -> None:
+        """
+        Check that rows can be read in a format, before they are read
+
+        :param format_: rows, lazy or raw
+        :param fields: the projected fields, None for every field
+        :return: None
+        """
+        check_result_format(format_, ROW_FORMATS)
+        if format_ == 'raw' and fields is not None and not self.schema.is_hash:
+            raise ValueError('Can not read raw values with fields, only hash rows are stored '
+                             'per field.')
+
+    def wrap_rows(self, vals: list, complete_keys: list[bytes | str],
+                  fields: list[str] | None = None, format_: str = 'lazy') -> list:
+        """
+        Wraps rows read from redis without decoding them, lazy rows are decoded on first access
+        and raw rows are returned as they are stored, compressed or not
+
+        :param vals: MGET results on string storage, HGETALL or HMGET results on hash storage
+        :param complete_keys: the complete keys of the values
+        :param fields: the projected fields, None for every field
+        :param format_: lazy or raw
+        :return: rows(list), LazyRow objects, or the stored values and the {field: data} dicts
+            of hash rows, None for every key that does not exist
+        """
+        if self.schema.is_hash and fields is not None:
+            # Every field is written on set, so all of them missing means the row is missing
+            vals = [None if all(data is None for data in val) else dict(zip(fields, val))
+                    for val in vals]
+            fields = None
+        elif self.schema.is_hash:
+            vals = [val or None for val in vals]
+            if format_ == 'lazy':
+                vals = [None if val is None else
+                        {(col_name.decode('utf-8') if isinstance(col_name, bytes) else col_name):
+                         data for col_name, data in val.items()} for val in vals]
+
+        if format_ == 'raw':
+            return vals
+        return [None if val is None else LazyRow(val, complete_key, self, fields)
+                for val, complete_key in zip(vals, complete_keys)]
+
+    @staticmethod
+    def project(complete_val: dict | None, fields: list[str] | None = None) -> dict | None:
+        """
+        Keeps only the given fields of a complete value
+
+        :param complete_val: complete cache value, None if the key does not exist
+        :param fields: the projected fields, None for every field
+        :return: val(dict) | None
+        """
+        if complete_val is None or fields is None:
+            return complete_val
+        return {col_name: complete_val.get(col_name) for col_name in fields}
+
+    @staticmethod
+    def project_many(complete_vals: list[dict | None], fields: list[str] | None = None)\
+            -> list[dict | None]:
+        """
+        Keeps only the given fields of complete values
+
+        :param complete_vals: complete cache values, None for the keys that do not exist
+        :param fields: the projected fields, None for every field
+        :return: vals(list[dict | None])
+        """
+        if fields is None:
+            return complete_vals
+        return [QueryBuilder.project(complete_val, fields) for complete_val in complete_vals]
+
+    @staticmethod
+    def get_missing_keys(complete_keys: list[bytes | str], vals: list) -> list[bytes | str]:
+        """
+        Finds the keys that were not found, e.g. unset or expired between SCAN and MGET
+
+        :param complete_keys: complete keys of a read
+        :param vals: the values read, None for the keys that do not exist
+        :return: missing_keys(list)
+        """
+        return [complete_key for complete_key, val in zip(complete_keys, vals) if val is None]
+
+    @staticmethod
+    def fill_missing(complete_vals: list[dict | None], missing_vals: list[dict | None])\
+            -> list[dict | None]:
+        """
+        Fills the values missing from a near cache read with the values read from redis
+
+        :param complete_vals: complete values of the near cache, None if not cached
+        :param missing_vals: the values read from redis for the None values, in order
+        :return: complete_vals(list[dict | None])
+        """
+        missing_vals = iter(missing_vals)
+        return [next(missing_vals) if complete_val is None else complete_val
+                for complete_val in complete_vals]
+
+    def decode_row(self, val, complete_key: str, fields: list[str] | None = None,
+                   format_: str = 'rows') -> dict | None:
+        """
+        Decodes the result of "queue_get" into the value returned to the user
+
+        :param val: the result of "queue_get"
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param fields: the projected fields, None for every field
+        :param format_: rows, lazy or raw
+        :return: value(dict) | None
+        """
+        if format_ != 'rows':
+            return self.wrap_rows([val], [complete_key], fields, format_)[0]
+        if self.schema.is_hash:
+            return self.decode_hash(val, fields)
+        return self.project(self.decode_val(val, complete_key), fields)
+
+    def decode_rows(self, vals: list, complete_keys: list[bytes | str],
+                    fields: list[str] | None = None, format_: str = 'rows') -> list[dict | None]:
+        """
+        Decodes the results of "queue_get_many" or "queue_mget" into the values returned to
+        the user
+
+        :param vals: the results of "queue_get_many" on hash storage or "queue_mget" otherwise
+        :param complete_keys: complete keys of the read
+        :param fields: the projected fields, None for every field
+        :param format_: rows, lazy or raw
+        :return: value list
+        """
+        if format_ != 'rows':
+            return self.wrap_rows(vals, complete_keys, fields, format_)
+        if self.schema.is_hash:
+            return [self.decode_hash(val, fields) for val in vals]
+        return self.project_many(self.decode_vals(vals, complete_keys), fields)
+
+    def queue_get(self, pipe, complete_key: str, fields: list[str] | None = None):
+        """
+        Queues the read of a row into a pipeline, decode the result with "decode_hash"
+        on hash storage or "decode_val" on string storage
+
+        :param pipe: sync or asyncio redis pipeline, or a connection to run it right away
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param fields: the projected fields of a hash row, None for every field
+        :return: pipe, or the command result if a connection is given
+        """
+        if not self.schema.is_hash:
+            return pipe.get(complete_key)
+        if fields is None:
+            return pipe.hgetall(complete_key)
+        return pipe.hmget(complete_key, fields)
+
+    def queue_get_many(self, pipe, complete_keys: list[bytes | str],
+                       fields: list[str] | None = None):
+        """
+        Queues the read of multiple hash rows into a pipeline, decode the results with
+        "decode_rows"
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param fields: the projected fields, None for every field
+        :return: pipe
+        """
+        for complete_key in complete_keys:
+            self.queue_get(pipe, complete_key, fields)
+        return pipe
+
+    def queue_mget(self, pipe, complete_keys: list[str]):
+        """
+        Queues the read of multiple string rows, with one MGET per slot in cluster mode,
+        decode the result with "decode_vals"
+
+        :param pipe: sync or asyncio redis connection
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :return: the command result
+        """
+        if self.is_cluster:
+            return pipe.mget_nonatomic(complete_keys)
+        return pipe.mget(complete_keys)
+
+    def get_ttl(self, ttl: int | None = None) -> int | None:
+        """
+        Resolves the ttl of a write, the sub default ttl is used if not given
+
+        :param ttl: seconds before the cache expires, 0 for no expiry, None for the sub default
+        :return: ttl(int) | None for no expiry
+        """
+        if ttl is None:
+            ttl = self.schema.ttl
+        return ttl or None
+
+    def queue_set(self, pipe, complete_key: str, complete_val: dict, ttl: int | None = None,
+                  is_keep_ttl: bool = False):
+        """
+        Queues the write of a validated row into a pipeline, a hash row is replaced whole
+
+        :param pipe: sync or asyncio redis pipeline, or a connection to run it right away
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param complete_val: complete cache value
+        :param ttl: resolved ttl in seconds, None for no expiry
+        :param is_keep_ttl: keep the current expiry of the row, ttl is ignored
+        :return: pipe, or the command result if a connection is given
+        """
+        if not self.schema.is_hash:
+            if is_keep_ttl:
+                return pipe.set(complete_key, self.encode_val(complete_val), keepttl=True)
+            return pipe.set(complete_key, self.encode_val(complete_val), ex=ttl)
+
+        pipe.delete(complete_key)
+        pipe.hset(complete_key, mapping=self.encode_fields(complete_val))
+        if ttl is None or is_keep_ttl:
+            return pipe
+        return pipe.expire(complete_key, ttl)
+
+    def queue_set_many(self, pipe, complete_key_vals: dict[str, dict], ttl: int | None = None):
+        """
+        Queues the write of validated rows into a pipeline, a single MSET on string storage
+        without ttl, one SET EX per row otherwise
+
+        :param pipe: sync or asyncio redis pipeline, or a connection to run it right away
+        :param complete_key_vals: a dict contains complete key and complete value pairs
+        :param ttl: resolved ttl in seconds, None for no expiry
+        :return: pipe, or the command result if a connection is given
+        """
+        if not self.schema.is_hash and ttl is None:
+            # MSET is blocked in cluster pipelines, it is queued as a raw command per slot
+            for complete_keys in self.group_by_slot(list(complete_key_vals)):
+                args = []
+                for complete_key in complete_keys:
+                    args.extend((complete_key, self.encode_val(complete_key_vals[complete_key])))
+                pipe.execute_command('MSET', *args)
+            return pipe
+
+        for complete_key, complete_val in complete_key_vals.items():
+            self.queue_set(pipe, complete_key, complete_val, ttl)
+        return pipe
+
+    def queue_write(self, pipe, complete_key_vals: dict[str, dict], ttl: int | None = None):
+        """
+        Queues the write of validated rows with their index and registry entries into a
+        pipeline
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_key_vals: a dict contains complete key and complete value pairs
+        :param ttl: resolved ttl in seconds, None for no expiry
+        :return: pipe
+        """
+        if not complete_key_vals:
+            return pipe
+        self.queue_set_many(pipe, complete_key_vals, ttl)
+        self.queue_index(pipe, list(complete_key_vals), 'set', list(complete_key_vals.values()))
+        return self.queue_register(pipe, list(complete_key_vals), 'set', ttl=ttl)
+
+    def queue_write_batch(self, pipe, complete_key_vals: dict[str, dict | None],
+                          ttl: int | None = None):
+        """
+        Queues the write of validated rows and the removal of rows into a pipeline
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_key_vals: a dict contains complete key and complete value pairs,
+            None values are unset
+        :param ttl: resolved ttl in seconds, None for no expiry
+        :return: pipe
+        """
+        set_key_vals = {complete_key: complete_val
+                        for complete_key, complete_val in complete_key_vals.items()
+                        if complete_val is not None}
+        unset_keys = [complete_key for complete_key, complete_val in complete_key_vals.items()
+                      if complete_val is None]
+
+        self.queue_write(pipe, set_key_vals, ttl)
+        if unset_keys:
+            self.queue_unset(pipe, unset_keys)
+        return pipe
+
+    def queue_delete(self, pipe, complete_keys: list[bytes | str], is_unlink: bool = False,
+                     chunk_size: int = 1000):
+        """
+        Queues the removal of rows into a pipeline, one DEL/UNLINK per chunk of keys
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: complete keys of the removed rows
+        :param is_unlink: use the non-blocking UNLINK instead of DEL
+        :param chunk_size: maximum number of keys per DEL/UNLINK command
+        :return: pipe, the queued results are the number of keys removed per command
+        """
+        command = 'UNLINK' if is_unlink else 'DEL'
+        for chunk in self.group_by_slot(complete_keys, chunk_size):
+            pipe.execute_command(command, *chunk)
+        return pipe
+
+    def queue_unset(self, pipe, complete_keys: list[bytes | str], is_unlink: bool = False,
+                    chunk_size: int = 1000) -> int:
+        """
+        Queues the removal of rows with their index and registry entries into a pipeline
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: complete keys of the removed rows
+        :param is_unlink: use the non-blocking UNLINK instead of DEL
+        :param chunk_size: maximum number of keys per command
+        :return: delete_count(int), the number of the first queued results, which are the
+            number of keys removed per DEL/UNLINK command
+        """
+        delete_count = len(self.group_by_slot(complete_keys, chunk_size))
+        self.queue_delete(pipe, complete_keys, is_unlink, chunk_size)
+        self.queue_index(pipe, complete_keys, 'del')
+        self.queue_register(pipe, complete_keys, 'del', chunk_size)
+        return delete_count
+
+    @staticmethod
+    def queue_touch(pipe, complete_keys: list[bytes | str], ttl: int | None = None):
+        """
+        Queues the restart of the expiry of rows into a pipeline
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param ttl: resolved ttl in seconds, None for no expiry
+        :return: pipe, the queued result is 1 for every key whose expiry has changed
+        """
+        for complete_key in complete_keys:
+            if ttl is None:
+                pipe.persist(complete_key)
+            else:
+                pipe.expire(complete_key, ttl)
+        return pipe
+
+    def queue_update_hash(self, pipe, complete_key: str, partial_val: dict):
+        """
+        Queues a partial update of an existing hash row into a pipeline, the row is left
+        untouched if it does not exist
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param partial_val: validated partial value, e.g. {"name": "Johnson"}
+        :return: pipe, the queued result is 1 if the row has been updated, 0 otherwise
+        """
+        args = []
+        for col_name, data in self.encode_fields(partial_val).items():
+            args.extend((col_name, data))
+        # ClusterPipeline.eval() raises and evalsha() is blocked in cluster pipelines, the
+        # script is queued as a raw EVAL command, which every pipeline accepts
+        return pipe.execute_command('EVAL', scripts.HASH_UPDATE, 1, complete_key, *args)
+
+    def queue_update(self, pipe, complete_key: str, partial_val: dict):
+        """
+        Queues a partial update of an existing hash row and of its index entries into a
+        pipeline
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param partial_val: validated partial value, e.g. {"name": "Johnson"}
+        :return: pipe, the first queued result is 1 if the row has been updated, 0 otherwise
+        """
+        self.queue_update_hash(pipe, complete_key, partial_val)
+        return self.queue_index(pipe, [complete_key], 'merge', [partial_val])
+
+    def queue_merge(self, pipe, complete_key: str, val: bytes | str | None,
+                    partial_val: dict) -> bool:
+        """
+        Queues a partial update of a string row read in a WATCH transaction, the row keeps its
+        expiry. The pipeline is put in MULTI mode unless the row does not exist
+
+        :param pipe: sync or asyncio redis pipeline, watching the row
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param val: the current value of the row, as it is stored, None if it does not exist
+        :param partial_val: validated partial value, e.g. {"name": "Johnson"}
+        :return: is_queued(bool), False if the row does not exist
+        """
+        if val is None:
+            return False
+
+        pipe.multi()
+        complete_val = {**self.decode_val(val, complete_key), **partial_val}
+        self.queue_set(pipe, complete_key, complete_val, is_keep_ttl=True)
+        self.queue_index(pipe, [complete_key], 'merge', [partial_val])
+        return True
+
+    def get_index_val(self, col_name: str, data) -> str | float | None:
+        """
+        Converts a column value into the value kept in its index
+
+        :param col_name: an indexed column name
+        :param data: the column value
+        :return: index value, str for equality indexes, float for range indexes, None for null
+        """
+        if data is None:
+            return None
+        if self.schema.indexes[col_name] == 'zset':
+            return float(data)
+        return json.dumps(data)
+
+    def get_index_key(self, col_name: str, data=None) -> str:
+        """
+        Generates the redis key of an index
+
+        :param col_name: an indexed column name
+        :param data: the column value, for equality indexes
+        :return: index_key(str)
+        """
+        if self.schema.indexes[col_name] == 'zset':
+            return f'{self.index_prefix}{col_name}'
+        return f'{self.index_prefix}{col_name}/{self.get_index_val(col_name, data)}'
+
+    def queue_index(self, pipe, complete_keys: list[bytes | str], mode: str,
+                    complete_vals: list[dict] | None = None, chunk_size: int = 1000):
+        """
+        Queues the update of the sub indexes into a pipeline, does nothing if the sub
+        has no index
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: complete keys of the written rows
+        :param mode: set for new rows, merge for partial updates, del for removed rows,
+            prune for rows that might be expired
+        :param complete_vals: the written (partial) values, not needed on del and prune
+        :param chunk_size: maximum number of rows per script call
+        :return: pipe
+        """
+        indexes = self.schema.indexes
+        if not indexes:
+            return pipe
+
+        args = []
+        for i in range(len(complete_keys)):
+            index_vals = {}
+            if mode in ('set', 'merge'):
+                for col_name, data in complete_vals[i].items():
+                    if col_name in indexes:
+                        index_vals[col_name] = self.get_index_val(col_name, data)
+            args.extend((mode, json.dumps(index_vals)))
+
+        kinds = json.dumps(indexes)
+        for i in range(0, len(complete_keys), chunk_size):
+            chunk = complete_keys[i:i + chunk_size]
+            pipe.execute_command('EVAL', scripts.INDEX_UPDATE, len(chunk) + 1,
+                                 self.index_rows_key, *chunk, self.index_prefix, kinds,
+                                 *args[i * 2:(i + len(chunk)) * 2])
+        return pipe
+
+    def queue_find(self, pipe, conditions: dict):
+        """
+        Queues the read of the keys matching column values into a pipeline, resolve the
+        results with "get_found_keys"
+
+        :param pipe: sync or asyncio redis pipeline
+        :param conditions: column and value pairs, every column must have an index
+        :return: pipe
+        """
+        if not conditions:
+            raise ValueError('Please provide at least one condition to find.')
+
+        set_keys = []
+        for col_name, data in conditions.items():
+            kind = self.schema.indexes.get(col_name)
+            if kind is None:
+                raise ValueError(f'Column `{col_name}` has no index.')
+            if data is None:
+                raise ValueError(f'Can not find a null `{col_name}`, nulls are not indexed.')
+
+            if kind == 'set':
+                set_keys.append(self.get_index_key(col_name, data))
+            else:
+                score = self.get_index_val(col_name, data)
+                pipe.zrangebyscore(self.get_index_key(col_name), score, score)
+        if set_keys:
+            pipe.sinter(set_keys)
+        return pipe
+
+    @staticmethod
+    def get_found_keys(results: list, limit: int | None = None) -> list[bytes | str]:
+        """
+        Resolves the results of "queue_find" into the keys matching every condition
+
+        :param results: pipeline results
+        :param limit: maximum number of keys, None for no limit
+        :return: complete_keys(list), sorted by complete key
+        """
+        return sorted(set(results[0]).intersection(*results[1:]))[:limit]
+
+    def queue_range(self, pipe, col_name: str, low: int | float | None = None,
+                    high: int | float | None = None, limit: int | None = None,
+                    is_desc: bool = False):
+        """
+        Queues the read of the keys in a range of an indexed INTEGER or REAL column, both
+        ends are inclusive
+
+        :param pipe: sync or asyncio redis pipeline, or a connection to run it right away
+        :param col_name: an indexed INTEGER or REAL column
+        :param low: the lowest value, None for no lower bound
+        :param high: the highest value, None for no upper bound
+        :param limit: maximum number of keys, None for no limit
+        :param is_desc: sort from the highest value instead of the lowest
+        :return: pipe, or the command result if a connection is given
+        """
+        if self.schema.indexes.get(col_name) != 'zset':
+            raise ValueError(f'Column `{col_name}` has no INTEGER or REAL index.')
+
+        index_key = self.get_index_key(col_name)
+        low = '-inf' if low is None else float(low)
+        high = '+inf' if high is None else float(high)
+        page = {} if limit is None else {'start': 0, 'num': limit}
+        if is_desc:
+            return pipe.zrevrangebyscore(index_key, high, low, **page)
+        return pipe.zrangebyscore(index_key, low, high, **page)
+
+    def get_registry_score(self, complete_key: bytes | str) -> float:
+        """
+        Generates the score of a complete key in the key registry, INTEGER keys are sorted
+        by their value and TEXT keys by their bytes with a score of 0. A score is a double,
+        so INTEGER keys beyond 2**53 are rejected, they would collide
+
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :return: score(float)
+        """
+        if self.schema.key_coercer is not int:
+            return 0.0
+        key = self.get_key(complete_key)
+        if abs(key) > self.MAX_REGISTRY_KEY:
+            raise ValueError(f'Key `{key}` is beyond 2**53, it can not be kept in the key '
+                             f'registry, create the sub with "is_registered=False".')
+        return float(key)
+
+    def queue_register(self, pipe, complete_keys: list[bytes | str], mode: str,
+                       chunk_size: int = 1000, ttl: int | None = None):
+        """
+        Queues the update of the sub key registry into a pipeline, does nothing if the sub
+        has no registry. Rows set with a ttl are also kept with their expiry time, see
+        "queue_expire" for their removal once expired
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: complete keys of the written rows
+        :param mode: set for new rows, del for removed rows, prune for rows that might be expired
+        :param chunk_size: maximum number of keys per command
+        :param ttl: resolved ttl in seconds of the set rows, None for no expiry
+        :return: pipe
+        """
+        if not self.schema.is_registered:
+            return pipe
+
+        expire_at = None if ttl is None else round((time.time() + ttl) * 1000)
+        for i in range(0, len(complete_keys), chunk_size):
+            chunk = complete_keys[i:i + chunk_size]
+            if mode == 'set':
+                pipe.zadd(self.registry_key, {complete_key: self.get_registry_score(complete_key)
+                                              for complete_key in chunk})
+                if expire_at is not None:
+                    pipe.zadd(self.expiry_key, dict.fromkeys(chunk, expire_at))
+            elif mode == 'del':
+                pipe.zrem(self.registry_key, *chunk)
+                pipe.zrem(self.expiry_key, *chunk)
+            else:
+                pipe.execute_command('EVAL', scripts.REGISTRY_PRUNE, len(chunk) + 2,
+                                     self.registry_key, self.expiry_key, *chunk)
+        return pipe
+
+    def queue_due(self, pipe, limit: int | None = None):
+        """
+        Queues the read of the registered rows past their expiry time into a pipeline, remove
+        them with "queue_expire"
+
+        :param pipe: sync or asyncio redis pipeline, or a connection to run it right away
+        :param limit: maximum number of rows, EXPIRE_BATCH if not given
+        :return: pipe, or the command result if a connection is given
+        """
+        return pipe.zrangebyscore(self.expiry_key, '-inf', round(time.time() * 1000),
+                                  start=0, num=limit or self.EXPIRE_BATCH)
+
+    def is_expiring(self, ttl: int | None) -> bool:
+        """
+        Checks if writing rows with a ttl leaves expired rows in the key registry, every write
+        of expiring rows then removes at least as many expired rows
+
+        :param ttl: resolved ttl in seconds, None for no expiry
+        :return: is_expiring(bool)
+        """
+        return self.schema.is_registered and ttl is not None
+
+    def queue_expire(self, pipe, due_keys: list[bytes | str]):
+        """
+        Queues the removal of rows past their expiry time from the key registry and the indexes
+        into a pipeline, the rows still alive are given their new expiry time
+
+        :param pipe: sync or asyncio redis pipeline
+        :param due_keys: complete keys read by "queue_due"
+        :return: pipe
+        """
+        return pipe.execute_command('EVAL', scripts.REGISTRY_EXPIRE, len(due_keys) + 3,
+                                    self.registry_key, self.expiry_key, self.index_rows_key,
+                                    *due_keys, self.index_prefix,
+                                    json.dumps(self.schema.indexes), round(time.time() * 1000))
+
+    def queue_page(self, pipe, after: bytes | str | None = None, limit: int = 100):
+        """
+        Queues the read of a page of complete keys from the key registry, in key order
+
+        :param pipe: sync or asyncio redis pipeline, or a connection to run it right away
+        :param after: the complete key before the page, None for the first page
+        :param limit: maximum number of complete keys
+        :return: pipe, or the command result if a connection is given
+        """
+        if isinstance(after, bytes):
+            after = after.decode('utf-8')
+
+        if self.schema.key_coercer is int:
+            low = '-inf' if after is None else f'({self.get_registry_score(after)!r}'
+            return pipe.zrangebyscore(self.registry_key, low, '+inf', start=0, num=limit)
+
+        low = '-' if after is None else f'({after}'
+        return pipe.zrangebylex(self.registry_key, low, '+', start=0, num=limit)
+
+    def queue_aggregate(self, pipe, complete_keys: list[bytes | str], aggregation: Aggregation,
+                        is_loaded: bool = True):
+        """
+        Queues the aggregation of rows on the server, merge the result with
+        "Aggregation.add_results"
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: complete keys of the rows, all in one cluster slot
+        :param aggregation: the aggregation to run
+        :param is_loaded: run the script by its SHA1 with EVALSHA, or send it whole with EVAL
+            if the server does not have it yet
+        :return: pipe
+        """
+        script = scripts.AGGREGATE_SHA if is_loaded else scripts.AGGREGATE
+        return pipe.execute_command('EVALSHA' if is_loaded else 'EVAL', script,
+                                    len(complete_keys), *complete_keys, aggregation.spec)
+
+    @staticmethod
+    def get_unloaded_chunks(chunks: list[list], results: list) -> list[list]:
+        """
+        Finds the chunks of "queue_aggregate" that failed because the server does not have
+        the script yet
+
+        :param chunks: the key chunks of the aggregation
+        :param results: pipeline results, read with raise_on_error=False
+        :return: unloaded_chunks(list)
+        """
+        return [chunk for chunk, result in zip(chunks, results)
+                if isinstance(result, NoScriptError)]
+
+    @staticmethod
+    def add_aggregate_results(aggregation: Aggregation, results: list,
+                              retried_results: list | None = None) -> tuple[list, list]:
+        """
+        Merges the results of "queue_aggregate" into an aggregation
+
+        :param aggregation: collects the partial results
+        :param results: pipeline results, read with raise_on_error=False
+        :param retried_results: the results of the chunks sent again with EVAL, in order
+        :return: skipped_keys and missing_keys, the keys of rows that could not be decoded on
+            the server and of rows that do not exist
+        """
+        retried_results = iter(retried_results or [])
+        skipped_keys, missing_keys = [], []
+        for result in results:
+            if isinstance(result, NoScriptError):
+                result = next(retried_results)
+            if isinstance(result, Exception):
+                raise result
+            chunk_skipped_keys, chunk_missing_keys = aggregation.add_results(result)
+            skipped_keys.extend(chunk_skipped_keys)
+            missing_keys.extend(chunk_missing_keys)
+        return skipped_keys, missing_keys
+
+    def queue_load_read(self, pipe, complete_keys: list[str]):
+        """
+        Queues the read of rows with their remaining time to live and their last recompute time,
+        decode the result with "decode_load_read"
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :return: pipe
+        """
+        for complete_key in complete_keys:
+            self.queue_get(pipe, complete_key)
+            pipe.pttl(complete_key)
+            pipe.get(f'__delta__/{complete_key}')
+        return pipe
+
+    def decode_load_read(self, results: list, complete_keys: list[str]) -> list[tuple]:
+        """
+        Decodes the result of "queue_load_read"
+
+        :param results: pipeline results
+        :param complete_keys: the complete keys of the read
+        :return: reads(list[tuple]), complete value, pttl in milliseconds and recompute time
+            in milliseconds for every key
+        """
+        reads = []
+        for i, complete_key in enumerate(complete_keys):
+            val, pttl, delta = results[i * 3:i * 3 + 3]
+            if self.schema.is_hash:
+                complete_val = self.decode_hash(val)
+            else:
+                complete_val = self.decode_val(val, complete_key)
+            reads.append((complete_val, pttl, float(delta) if delta is not None else 0.0))
+        return reads
+
+    def split_load_read(self, results: list, complete_keys: list[str],
+                        beta: float = 1.0) -> tuple[dict, list, list]:
+        """
+        Decodes the result of "queue_load_read" and picks the rows to recompute
+
+        :param results: pipeline results
+        :param complete_keys: the complete keys of the read
+        :param beta: above 1 refreshes earlier, 0 never refreshes early
+        :return: complete_vals, missing and refresh, the rows found, the keys not found and
+            the keys of the rows to refresh early
+        """
+        complete_vals = {}
+        missing = []
+        refresh = []
+        reads = self.decode_load_read(results, complete_keys)
+        for complete_key, (complete_val, pttl, delta) in zip(complete_keys, reads):
+            if complete_val is None:
+                missing.append(complete_key)
+                continue
+            complete_vals[complete_key] = complete_val
+            if self.is_early_refresh(pttl, delta, beta):
+                refresh.append(complete_key)
+        return complete_vals, missing, refresh
+
+    def split_lock_read(self, results: list, lock_keys: list[str], refresh: list[str],
+                        complete_vals: dict) -> tuple[list, list]:
+        """
+        Decodes the result of "queue_lock" followed by "queue_load_read", the rows another
+        worker has just set are added to complete_vals
+
+        :param results: pipeline results
+        :param lock_keys: the complete keys of the locks
+        :param refresh: the keys of the rows refreshed early, they are loaded even if found
+        :param complete_vals: the rows found so far
+        :return: load_keys and unlock_keys, the keys of the rows to load and of the locks
+            taken on rows that do not need to be loaded
+        """
+        reads = self.decode_load_read(results[len(lock_keys):], lock_keys)
+        load_keys = []
+        unlock_keys = []
+        for complete_key, is_locked, (complete_val, _, _) in zip(lock_keys, results, reads):
+            if complete_val is not None and complete_key not in refresh:
+                complete_vals[complete_key] = complete_val
+                if is_locked:
+                    unlock_keys.append(complete_key)
+            elif is_locked:
+                load_keys.append(complete_key)
+        return load_keys, unlock_keys
+
+    def get_loaded_key_vals(self, complete_keys: list[str], keys_by_complete_key: dict,
+                            key_vals: dict) -> dict[str, dict]:
+        """
+        Generates and validates the complete values of rows computed by a batch loader
+
+        :param complete_keys: the complete keys of the loaded rows
+        :param keys_by_complete_key: the key of every complete key
+        :param key_vals: the result of the batch loader, a dict of key and val pairs
+        :return: complete_key_vals(dict), the keys left out or with a None val are not set
+        """
+        complete_key_vals = {}
+        for complete_key in complete_keys:
+            key = keys_by_complete_key[complete_key]
+            if key_vals.get(key) is not None:
+                complete_key_vals[complete_key] = self.get_complete_val(key, key_vals[key])
+        invalid_rows = self.validate_many(complete_key_vals)
+        if invalid_rows:
+            raise ValueError(f'The loaded cache is invalid: {invalid_rows}')
+        return complete_key_vals
+
+    @staticmethod
+    def is_early_refresh(pttl: int, delta: float, beta: float = 1.0) -> bool:
+        """
+        Decides to recompute a row before it expires, more likely as the expiry gets closer and
+        for rows that are slow to recompute (probabilistic early expiration, XFetch)
+
+        :param pttl: remaining time to live in milliseconds, negative for no expiry
+        :param delta: the last recompute time in milliseconds
+        :param beta: above 1 refreshes earlier, 0 never refreshes early
+        :return: is_early_refresh(bool)
+        """
+        if pttl < 0 or delta <= 0 or beta <= 0:
+            return False
+        return -delta * beta * math.log(1 - random.random()) >= pttl
+
+    @staticmethod
+    def queue_lock(pipe, complete_keys: list[str], token: str, lock_ms: int):
+        """
+        Queues the recompute lock of rows into a pipeline, with SET NX PX
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param token: a random token, only its holder releases the lock
+        :param lock_ms: milliseconds before an unreleased lock expires
+        :return: pipe, the queued result is True for every lock taken
+        """
+        for complete_key in complete_keys:
+            pipe.set(f'__lock__/{complete_key}', token, nx=True, px=lock_ms)
+        return pipe
+
+    @staticmethod
+    def queue_unlock(pipe, complete_keys: list[str], token: str):
+        """
+        Queues the release of recompute locks into a pipeline, a lock is released only if the
+        token still holds it
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param token: the token the locks were taken with
+        :return: pipe
+        """
+        for complete_key in complete_keys:
+            pipe.execute_command('EVAL', scripts.LOCK_RELEASE, 1, f'__lock__/{complete_key}',
+                                 token)
+        return pipe
+
+    @staticmethod
+    def queue_delta(pipe, complete_keys: list[str], delta: float, ttl: int | None = None):
+        """
+        Queues the recompute time of rows into a pipeline, it expires with the rows and is not
+        kept for rows without expiry, which are never refreshed early
+
+        :param pipe: sync or asyncio redis pipeline
+        :param complete_keys: a list of keys in "<cache_name>/<sub_name>/<key>" format
+        :param delta: recompute time in milliseconds
+        :param ttl: resolved ttl in seconds, None for no expiry
+        :return: pipe
+        """
+        if ttl is None:
+            return pipe
+        for complete_key in complete_keys:
+            pipe.set(f'__delta__/{complete_key}', round(delta, 3), ex=ttl)
+        return pipe
+
+    def invalidate_near_cache(self, complete_keys: list[bytes | str] | None = None) -> None:
+        """
+        Remove written rows from the near cache, if the sub has one, and stop the loader from
+        handing out reads sent before the write
+
+        :param complete_keys: complete keys, None for every row
+        :return: None
+        """
+        if self.loader is not None:
+            self.loader.forget(complete_keys)
+        if self.near_cache is None:
+            return
+        if complete_keys is None:
+            self.near_cache.clear()
+        else:
+            self.near_cache.invalidate(complete_keys)
 
     def validate(self, input_: dict) -> bool:
         """
@@ -36,29 +1272,22 @@ class QueryBuilder:
         :param input_: user input, e.g. {"name": "Johnson", ...}
         :return: is_valid(bool)
         """
-        # pylint: disable=R0911
-
-        for col_name in self.sub_attr:
-            if col_name not in input_:
-                return False
-
-            data = input_[col_name]
-            data_type = self.sub_attr[col_name].lower()
-            if 'not null' in data_type:
-                if not Validation.is_not_null(data):
-                    return False
-
-            if 'text' in data_type:
-                if not Validation.is_text(data):
-                    return False
-            elif 'integer' in data_type:
-                if not Validation.is_integer(data):
-                    return False
-            elif 'real' in data_type:
-                if not Validation.is_real(data):
-                    return False
-            elif 'boolean' in data_type:
-                if not Validation.is_boolean(data):
-                    return False
+        return self.schema.validate(input_)
 
-        return True
+    def validate_many(self, inputs: dict) -> dict:
+        """
+        Validation for multiple user inputs, reports every invalid row and column
+
+        :param inputs: a dict contains key and user input pairs
+        :return: invalid_rows(dict), e.g. {800100: ["name"]}, empty if all inputs are valid
+        """
+        return self.schema.validate_many(inputs)
+
+    def validate_partial(self, input_: dict) -> bool:
+        """
+        Validation for a partial user input, only the given columns are checked
+
+        :param input_: partial user input, e.g. {"name": "Johnson"}
+        :return: is_valid(bool)
+        """
+        return self.schema.validate_partial(input_)
@@ -0,0 +1,530 @@
+""" Read routing to the replicas of a standalone redis """
+
+import contextvars
+import itertools
+import time
+from typing import AsyncIterator, Callable, Iterator
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+ROUTINGS = ('round_robin', 'least_latency')
+# Commands sent to a replica, every other command is sent to the primary
+READ_COMMANDS = frozenset((
+    'get', 'mget', 'mget_nonatomic', 'exists', 'ttl', 'pttl', 'type', 'strlen',
+    'hget', 'hmget', 'hgetall', 'hexists', 'hlen', 'hkeys', 'hvals',
+    'zcard', 'zcount', 'zscore', 'zrange', 'zrangebyscore', 'zrevrangebyscore', 'zrangebylex',
+    'zrevrangebylex', 'zrank', 'zrevrank',
+    'scard', 'smembers', 'sismember', 'sinter', 'sunion', 'sdiff', 'scan', 'sscan', 'zscan',
+    'hscan', 'dbsize',
+))
+# Errors of a replica that is down or too slow, its reads are retried on the primary
+REPLICA_ERRORS = (RedisConnectionError, RedisTimeoutError)
+
+
+class ReplicatedRedis:
+    """
+    A client sending the reads to the replicas of a primary and every other command to the
+    primary. It offers the part of the Redis interface used by Sub: read commands, pipelines of
+    read commands and SCAN are sent to a replica picked by round robin or by least latency,
+    a replica that fails is skipped for REPLICA_RETRY seconds and the read is retried on the
+    primary. With read_your_writes, the reads of a thread or task that wrote less than
+    read_your_writes seconds ago are sent to the primary, replicas lag behind it
+
+    methods:
+        is_pinned() -> is_pinned(bool)
+        pin() -> None
+        choose() -> index(int) | None
+        observe(index,latency) -> None
+        fail(index) -> None
+        read(call) -> result
+        pipeline(transaction,shard_hint) -> pipe(ReplicatedPipeline)
+        execute_command(*args,**kwargs) -> result
+        scan_iter(match,count) -> keys(Iterator)
+        ping() -> is_connected(bool)
+        close() -> None
+    """
+
+    # Seconds a replica that failed is skipped before it is tried again
+    REPLICA_RETRY = 5.0
+    # Weight of the latest read in the moving average of the latency of a replica
+    LATENCY_WEIGHT = 0.2
+    # One read in LATENCY_PROBE is sent round robin with least_latency
+    LATENCY_PROBE = 50
+
+    def __init__(self, primary: Redis, replicas: list[Redis], routing: str = 'round_robin',
+                 read_your_writes: float | None = None):
+        """
+        ReplicatedRedis initialization
+
+        :param primary: connection to the primary
+        :param replicas: connections to the replicas of the primary
+        :param routing: round_robin or least_latency, how the replica of a read is picked
+        :param read_your_writes: seconds the reads of a thread or task are sent to the primary
+            after it writes, None to always read from the replicas
+        """
+        if routing not in ROUTINGS:
+            err_msg = f'Unknown read routing `{routing}`, available read routings: ' \
+                      f'{", ".join(ROUTINGS)}.'
+            raise ValueError(err_msg)
+
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.routing = routing
+        self.read_your_writes = read_your_writes
+        # Moving average latency of every replica in seconds, and the time it is skipped until
+        self.latencies = [0.0] * len(self.replicas)
+        self.down_until = [0.0] * len(self.replicas)
+        self.counter = itertools.count()
+        # Time of the last write of the current thread or task
+        self.written_at = contextvars.ContextVar(f'written_at_{id(self)}', default=None)
+
+    def __getattr__(self, name: str):
+        """
+        Route a read command to a replica and any other command to the primary
+
+        :param name: redis command method name
+        :return: the command method
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name in READ_COMMANDS:
+            def read_command(*args, **kwargs):
+                return self.read(lambda redis: getattr(redis, name)(*args, **kwargs))
+            return read_command
+
+        attr = getattr(self.primary, name)
+        if not callable(attr):
+            return attr
+
+        def command(*args, **kwargs):
+            self.pin()
+            return attr(*args, **kwargs)
+        return command
+
+    def is_pinned(self) -> bool:
+        """
+        Check if the current thread or task wrote recently enough to read from the primary
+
+        :return: is_pinned(bool)
+        """
+        if self.read_your_writes is None:
+            return False
+        written_at = self.written_at.get()
+        return written_at is not None and time.monotonic() - written_at < self.read_your_writes
+
+    def pin(self) -> None:
+        """
+        Record a write of the current thread or task
+
+        :return: None
+        """
+        if self.read_your_writes is not None:
+            self.written_at.set(time.monotonic())
+
+    def choose(self) -> int | None:
+        """
+        Pick the replica of a read
+
+        :return: index(int) of the replica, None to read from the primary
+        """
+        if not self.replicas or self.is_pinned():
+            return None
+        now = time.monotonic()
+        indexes = [i for i, down_until in enumerate(self.down_until) if down_until <= now]
+        if not indexes:
+            return None
+        read_index = next(self.counter)
+        if self.routing == 'round_robin':
+            return indexes[read_index % len(indexes)]
+        if read_index % self.LATENCY_PROBE == 0:
+            # The slower replicas are read from now and then to keep their latency up to date
+            return indexes[read_index // self.LATENCY_PROBE % len(indexes)]
+        return min(indexes, key=self.latencies.__getitem__)
+
+    def observe(self, index: int, latency: float) -> None:
+        """
+        Add the latency of a read to the moving average of its replica
+
+        :param index: index of the replica
+        :param latency: seconds the read took
+        :return: None
+        """
+        if self.latencies[index] == 0.0:
+            self.latencies[index] = latency
+        else:
+            self.latencies[index] += self.LATENCY_WEIGHT * (latency - self.latencies[index])
+
+    def fail(self, index: int) -> None:
+        """
+        Skip a replica that failed for REPLICA_RETRY seconds
+
+        :param index: index of the replica
+        :return: None
+        """
+        self.down_until[index] = time.monotonic() + self.REPLICA_RETRY
+        # It is tried again with the latency of the fastest replica
+        self.latencies[index] = min(self.latencies)
+
+    def read(self, call: Callable):
+        """
+        Run a read on a replica, or on the primary if there is no replica to read from or the
+        replica fails
+
+        :param call: function taking a connection
+        :return: the result of the call
+        """
+        index = self.choose()
+        if index is None:
+            return call(self.primary)
+
+        started_at = time.perf_counter()
+        try:
+            result = call(self.replicas[index])
+        except REPLICA_ERRORS:
+            self.fail(index)
+            return call(self.primary)
+        self.observe(index, time.perf_counter() - started_at)
+        return result
+
+    def pipeline(self, transaction: bool | None = None,
+                 shard_hint=None) -> 'ReplicatedPipeline':
+        """
+        Open a pipeline, sent to a replica if it only reads and to the primary otherwise
+
+        :param transaction: wrap the commands in MULTI/EXEC, always sent to the primary
+        :param shard_hint: passed to the pipeline of the primary or the replica
+        :return: pipe(ReplicatedPipeline)
+        """
+        return ReplicatedPipeline(self, transaction is not False, shard_hint)
+
+    def execute_command(self, *args, **kwargs):
+        """
+        Run a raw command, routed by its name
+
+        :param args: raw command args, e.g. ("GET", key)
+        :return: the command result
+        """
+        if args[0].lower() in READ_COMMANDS:
+            return self.read(lambda redis: redis.execute_command(*args, **kwargs))
+        self.pin()
+        return self.primary.execute_command(*args, **kwargs)
+
+    def scan_iter(self, match: str | None = None, count: int | None = None) -> Iterator:
+        """
+        SCAN a replica, the primary is scanned instead if the replica fails before the first
+        key, a replica failing later raises as the keys already seen can not be told apart
+
+        :param match: key pattern
+        :param count: SCAN COUNT hint
+        :return: an iterator of keys
+        """
+        index = self.choose()
+        if index is None:
+            yield from self.primary.scan_iter(match=match, count=count)
+            return
+
+        is_started = False
+        try:
+            for key in self.replicas[index].scan_iter(match=match, count=count):
+                is_started = True
+                yield key
+            return
+        except REPLICA_ERRORS:
+            self.fail(index)
+            if is_started:
+                raise
+        yield from self.primary.scan_iter(match=match, count=count)
+
+    def ping(self) -> bool:
+        """
+        Check the connection to the primary
+
+        :return: is_connected(bool)
+        """
+        return self.primary.ping()
+
+    def close(self) -> None:
+        """
+        Close the connections to the primary and the replicas
+
+        :return: None
+        """
+        for redis in (self.primary, *self.replicas):
+            redis.close()
+
+
+class ReplicatedPipeline:
+    """
+    A pipeline recording its commands, they are sent on execute to a replica if they all read
+    and to the primary otherwise. A replica pipeline that fails is sent again to the primary
+
+    methods:
+        reset() -> None
+        execute_command(*args,**kwargs) -> pipe(ReplicatedPipeline)
+        is_read() -> is_read(bool)
+        run(redis,raise_on_error) -> results(list)
+        execute(raise_on_error) -> results(list)
+    """
+
+    def __init__(self, replicated_redis: ReplicatedRedis, transaction: bool = True,
+                 shard_hint=None):
+        """
+        ReplicatedPipeline initialization
+
+        :param replicated_redis: the replicated connection
+        :param transaction: wrap the commands in MULTI/EXEC
+        :param shard_hint: passed to the pipeline of the primary or the replica
+        """
+        self.replicated_redis = replicated_redis
+        self.transaction = transaction
+        self.shard_hint = shard_hint
+        # Name, args and kwargs of every queued command
+        self.calls = []
+
+    def __enter__(self) -> 'ReplicatedPipeline':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.reset()
+
+    def __len__(self) -> int:
+        return len(self.calls)
+
+    def __getattr__(self, name: str) -> Callable:
+        """
+        Queue a command
+
+        :param name: redis command method name
+        :return: the command method
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return command
+
+    def reset(self) -> None:
+        """
+        Drop the queued commands
+
+        :return: None
+        """
+        self.calls = []
+
+    def execute_command(self, *args, **kwargs) -> 'ReplicatedPipeline':
+        """
+        Queue a raw command
+
+        :param args: raw command args, e.g. ("MSET", key, val)
+        :return: pipe(ReplicatedPipeline)
+        """
+        self.calls.append(('execute_command', args, kwargs))
+        return self
+
+    def is_read(self) -> bool:
+        """
+        Check if the queued commands can be sent to a replica
+
+        :return: is_read(bool)
+        """
+        return not self.transaction and all(
+            (args[0].lower() if name == 'execute_command' else name) in READ_COMMANDS
+            for name, args, _ in self.calls)
+
+    def run(self, redis: Redis, raise_on_error: bool = True) -> list:
+        """
+        Send the queued commands in a pipeline of a connection
+
+        :param redis: connection to the primary or a replica
+        :param raise_on_error: raise the first error instead of returning it
+        :return: results(list)
+        """
+        with redis.pipeline(transaction=self.transaction, shard_hint=self.shard_hint) as pipe:
+            for name, args, kwargs in self.calls:
+                getattr(pipe, name)(*args, **kwargs)
+            return pipe.execute(raise_on_error=raise_on_error)
+
+    def execute(self, raise_on_error: bool = True) -> list:
+        """
+        Send the queued commands to a replica if they all read, to the primary otherwise
+
+        :param raise_on_error: raise the first error instead of returning it
+        :return: results(list), in the queued order
+        """
+        try:
+            if self.is_read():
+                return self.replicated_redis.read(lambda redis: self.run(redis, raise_on_error))
+            self.replicated_redis.pin()
+            return self.run(self.replicated_redis.primary, raise_on_error)
+        finally:
+            self.reset()
+
+
+class AsyncReplicatedRedis(ReplicatedRedis):
+    """
+    ReplicatedRedis for asyncio, read_your_writes pins the task that wrote
+    """
+
+    def __getattr__(self, name: str):
+        """
+        Route a read command to a replica and any other command to the primary
+
+        :param name: redis command method name
+        :return: the command method
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name in READ_COMMANDS:
+            async def read_command(*args, **kwargs):
+                return await self.read(lambda redis: getattr(redis, name)(*args, **kwargs))
+            return read_command
+        return super().__getattr__(name)
+
+    # pylint: disable=W0236,W0221
+    async def read(self, call: Callable):
+        """
+        Run a read on a replica, or on the primary if there is no replica to read from or the
+        replica fails
+
+        :param call: function taking a redis.asyncio connection and returning an awaitable
+        :return: the result of the call
+        """
+        index = self.choose()
+        if index is None:
+            return await call(self.primary)
+
+        started_at = time.perf_counter()
+        try:
+            result = await call(self.replicas[index])
+        except REPLICA_ERRORS:
+            self.fail(index)
+            return await call(self.primary)
+        self.observe(index, time.perf_counter() - started_at)
+        return result
+
+    def pipeline(self, transaction: bool | None = None,
+                 shard_hint=None) -> 'AsyncReplicatedPipeline':
+        """
+        Open a pipeline, sent to a replica if it only reads and to the primary otherwise
+
+        :param transaction: wrap the commands in MULTI/EXEC, always sent to the primary
+        :param shard_hint: passed to the pipeline of the primary or the replica
+        :return: pipe(AsyncReplicatedPipeline)
+        """
+        return AsyncReplicatedPipeline(self, transaction is not False, shard_hint)
+
+    async def execute_command(self, *args, **kwargs):
+        """
+        Run a raw command, routed by its name
+
+        :param args: raw command args, e.g. ("GET", key)
+        :return: the command result
+        """
+        if args[0].lower() in READ_COMMANDS:
+            return await self.read(lambda redis: redis.execute_command(*args, **kwargs))
+        self.pin()
+        return await self.primary.execute_command(*args, **kwargs)
+
+    async def scan_iter(self, match: str | None = None,
+                        count: int | None = None) -> AsyncIterator:
+        """
+        SCAN a replica, the primary is scanned instead if the replica fails before the first
+        key, see ReplicatedRedis
+
+        :param match: key pattern
+        :param count: SCAN COUNT hint
+        :return: an async iterator of keys
+        """
+        index = self.choose()
+        redis = self.primary if index is None else self.replicas[index]
+        is_started = False
+        try:
+            async for key in redis.scan_iter(match=match, count=count):
+                is_started = True
+                yield key
+            return
+        except REPLICA_ERRORS:
+            if index is None:
+                raise
+            self.fail(index)
+            if is_started:
+                raise
+        async for key in self.primary.scan_iter(match=match, count=count):
+            yield key
+
+    async def ping(self) -> bool:
+        """
+        Check the connection to the primary
+
+        :return: is_connected(bool)
+        """
+        return await self.primary.ping()
+
+    def close(self) -> None:
+        """
+        The redis.asyncio connections are closed on the event loop, await "aclose()" instead
+
+        :return: None
+        """
+        raise ValueError('AsyncReplicatedRedis is closed with "await aclose()"')
+
+    async def aclose(self) -> None:
+        """
+        Close the connections to the primary and the replicas
+
+        :return: None
+        """
+        for redis in (self.primary, *self.replicas):
+            await redis.aclose()
+    # pylint: enable=W0236,W0221
+
+
+class AsyncReplicatedPipeline(ReplicatedPipeline):
+    """
+    ReplicatedPipeline for asyncio
+    """
+
+    async def __aenter__(self) -> 'AsyncReplicatedPipeline':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        self.reset()
+
+    # pylint: disable=W0236,W0221
+    async def run(self, redis: AsyncRedis, raise_on_error: bool = True) -> list:
+        """
+        Send the queued commands in a pipeline of a redis.asyncio connection
+
+        :param redis: connection to the primary or a replica
+        :param raise_on_error: raise the first error instead of returning it
+        :return: results(list)
+        """
+        async with redis.pipeline(transaction=self.transaction,
+                                  shard_hint=self.shard_hint) as pipe:
+            for name, args, kwargs in self.calls:
+                getattr(pipe, name)(*args, **kwargs)
+            return await pipe.execute(raise_on_error=raise_on_error)
+
+    async def execute(self, raise_on_error: bool = True) -> list:
+        """
+        Send the queued commands to a replica if they all read, to the primary otherwise
+
+        :param raise_on_error: raise the first error instead of returning it
+        :return: results(list), in the queued order
+        """
+        try:
+            if self.is_read():
+                return await self.replicated_redis.read(
+                    lambda redis: self.run(redis, raise_on_error))
+            self.replicated_redis.pin()
+            return await self.run(self.replicated_redis.primary, raise_on_error)
+        finally:
+            self.reset()
+    # pylint: enable=W0236,W0221
@@ -0,0 +1,94 @@
+""" Lazy rows of sub reads """
+
+from collections.abc import Iterator, Mapping
+
+
+class LazyRow(Mapping):
+    """
+    A read-only row keeping the value read from redis and decoding it on first access. The
+    values of a positional codec are decoded without building a dict and the key is only
+    parsed when it is read, the fields of a hash row are decoded one by one as they are read.
+    A row compares equal to the dict a rows read returns
+
+    methods:
+        to_dict() -> complete_val(dict)
+    """
+
+    __slots__ = ('val', 'complete_key', 'query_builder', 'fields', 'decoded')
+
+    def __init__(self, val: bytes | str | dict, complete_key: bytes | str, query_builder,
+                 fields: list[str] | None = None):
+        """
+        LazyRow initialization
+
+        :param val: value stored in redis, or the raw fields of a hash row by column name
+        :param complete_key: the complete key of the row
+        :param query_builder: the QueryBuilder of the sub, holding its schema
+        :param fields: the projected fields of a value, None for every column
+        """
+        self.val = val
+        self.complete_key = complete_key
+        self.query_builder = query_builder
+        self.fields = fields
+        # The decoded dict of a value, the decoded values of a positional value, or the decoded
+        # fields of a hash row
+        self.decoded = None
+
+    def __getitem__(self, col_name: str):
+        if self.fields is not None and col_name not in self.fields:
+            raise KeyError(col_name)
+
+        schema = self.query_builder.schema
+        codec = schema.codec
+        if schema.is_hash:
+            if self.decoded is None:
+                self.decoded = {}
+            if col_name not in self.decoded:
+                data = self.val[col_name]
+                self.decoded[col_name] = None if data is None else codec.decode_field(data)
+            return self.decoded[col_name]
+
+        if not codec.is_positional:
+            if self.decoded is None:
+                self.decoded = codec.decode(self.val)
+            return self.decoded[col_name] if self.fields is None else self.decoded.get(col_name)
+
+        if col_name == codec.key_name:
+            return self.query_builder.get_key(self.complete_key)
+        if self.decoded is None:
+            self.decoded = codec.decode_values(self.val)
+        position = codec.positions.get(col_name)
+        if position is None or position >= len(self.decoded):
+            if self.fields is not None:
+                return None
+            raise KeyError(col_name)
+        return self.decoded[position]
+
+    def __iter__(self) -> Iterator[str]:
+        if self.fields is not None:
+            return iter(self.fields)
+
+        schema = self.query_builder.schema
+        codec = schema.codec
+        if schema.is_hash:
+            return iter(self.val)
+        if self.decoded is None:
+            self.decoded = codec.decode_values(self.val) if codec.is_positional \
+                else codec.decode(self.val)
+        if codec.is_positional:
+            return iter(codec.col_names[:len(self.decoded) + 1])
+        return iter(self.decoded)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f'LazyRow({self.to_dict()!r})'
+
+    def to_dict(self) -> dict:
+        """
+        Decode the whole row
+
+        :return: complete_val(dict), only the projected fields if fields were given
+        """
+        return {col_name: self[col_name] for col_name in self}
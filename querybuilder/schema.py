@@ -0,0 +1,161 @@
+""" Compiled sub schema class """
+
+from typing import Any
+
+from querybuilder.codec import get_codec
+from querybuilder.compression import get_compressor
+
+
+class Schema:
+    """
+    A compiled sub_attr and sub options, parsed once and reused for every row of the sub
+
+    methods:
+        coerce_key(key) -> key(str | int)
+        validate(input_) -> is_valid(bool)
+        validate_partial(input_) -> is_valid(bool)
+        get_invalid_cols(input_) -> invalid_cols(list[str])
+        validate_many(inputs) -> invalid_rows(dict)
+    """
+
+    # Checked in this order, the same order QueryBuilder.validate used to check them
+    TYPES = (('text', str), ('integer', int), ('real', float), ('boolean', bool))
+    STORAGES = ('string', 'hash')
+    # TEXT and BOOLEAN columns are indexed by equality, INTEGER and REAL columns by range
+    INDEX_KINDS = {str: 'set', bool: 'set', int: 'zset', float: 'zset'}
+
+    def __init__(self, sub_attr: dict, sub_options: dict | None = None):
+        """
+        Schema initialization, parses the sub_attr into per-column checks
+
+        :param sub_attr: sub attributes, e.g. {"name": "TEXT"}
+        :param sub_options: sub options, e.g. {"storage": "hash", "indexes": ["status"]}
+        """
+        self.sub_attr = sub_attr
+        self.sub_options = sub_options if sub_options is not None else {}
+        self.col_names = tuple(sub_attr)
+        self.key_name = self.col_names[0]
+        self.key_coercer = int if 'integer' in sub_attr[self.key_name].lower() else str
+
+        checks = []
+        for col_name, data_type in sub_attr.items():
+            data_type = data_type.lower()
+            is_not_null = 'not null' in data_type
+            col_type = None
+            for type_name, python_type in self.TYPES:
+                if type_name in data_type:
+                    col_type = python_type
+                    break
+            checks.append((col_name, is_not_null, col_type))
+        self.checks = tuple(checks)
+        self.checks_by_col = {check[0]: check for check in checks}
+
+        compression = self.sub_options.get('compression')
+        self.codec = get_codec(self.sub_options.get('codec', 'json'), self.col_names,
+                               self.sub_options.get('is_positional', False),
+                               get_compressor(compression) if compression else None,
+                               self.sub_options.get('compression_min_size', 1024))
+        self.storage = self.sub_options.get('storage', 'string')
+        if self.storage not in self.STORAGES:
+            err_msg = f'Unknown storage `{self.storage}`, available storages: string, hash.'
+            raise ValueError(err_msg)
+        self.is_hash = self.storage == 'hash'
+        self.ttl = self.sub_options.get('ttl')
+        self.is_registered = self.sub_options.get('is_registered', False)
+        self.is_hash_tagged = self.sub_options.get('is_hash_tagged', False)
+
+        self.indexes = {}
+        for col_name in self.sub_options.get('indexes', []):
+            if col_name not in self.checks_by_col:
+                raise ValueError(f'Can not index `{col_name}`, it is not a column of the sub.')
+            col_type = self.checks_by_col[col_name][2]
+            if col_type not in self.INDEX_KINDS:
+                raise ValueError(f'Can not index `{col_name}`, its data type is unknown.')
+            self.indexes[col_name] = self.INDEX_KINDS[col_type]
+
+    def coerce_key(self, key: Any) -> str | int:
+        """
+        Convert a key into the data type of the key column
+
+        :param key: the key of a sub, the value of first element in the sub_attr
+        :return: key(str | int)
+        """
+        return self.key_coercer(key)
+
+    def validate(self, input_: dict) -> bool:
+        """
+        Validation for a single user input, stops at the first invalid column
+
+        :param input_: user input, e.g. {"name": "Johnson", ...}
+        :return: is_valid(bool)
+        """
+        for col_name, is_not_null, col_type in self.checks:
+            if col_name not in input_:
+                return False
+
+            data = input_[col_name]
+            if is_not_null and data is None:
+                return False
+            if col_type is not None and not isinstance(data, col_type):
+                return False
+
+        return True
+
+    def validate_partial(self, input_: dict) -> bool:
+        """
+        Validation for a partial user input, only the given columns are checked and the key
+        column can not be given
+
+        :param input_: partial user input, e.g. {"name": "Johnson"}
+        :return: is_valid(bool)
+        """
+        if self.key_name in input_:
+            return False
+
+        for col_name, data in input_.items():
+            if col_name not in self.checks_by_col:
+                continue
+
+            _, is_not_null, col_type = self.checks_by_col[col_name]
+            if is_not_null and data is None:
+                return False
+            if col_type is not None and not isinstance(data, col_type):
+                return False
+
+        return True
+
+    def get_invalid_cols(self, input_: dict) -> list[str]:
+        """
+        Validation for a single user input, collecting every invalid column
+
+        :param input_: user input, e.g. {"name": "Johnson", ...}
+        :return: invalid_cols(list[str])
+        """
+        invalid_cols = []
+        for col_name, is_not_null, col_type in self.checks:
+            if col_name not in input_:
+                invalid_cols.append(col_name)
+                continue
+
+            data = input_[col_name]
+            if is_not_null and data is None:
+                invalid_cols.append(col_name)
+            elif col_type is not None and not isinstance(data, col_type):
+                invalid_cols.append(col_name)
+
+        return invalid_cols
+
+    def validate_many(self, inputs: dict) -> dict:
+        """
+        Validation for multiple user inputs in one pass
+
+        :param inputs: a dict contains key and user input pairs
+        :return: invalid_rows(dict), e.g. {800100: ["name"]}, empty if all inputs are valid
+        """
+        invalid_rows = {}
+        for key, input_ in inputs.items():
+            if self.validate(input_):
+                continue
+            invalid_rows[key] = self.get_invalid_cols(input_)
+
+        return invalid_rows
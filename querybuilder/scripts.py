@@ -0,0 +1,308 @@
+""" Lua scripts run on the redis server """
+
+import hashlib
+
+# Sets hash fields only if the hash exists
+# KEYS[1]: complete key, ARGV: field, value, field, value, ...
+HASH_UPDATE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+# Keeps the secondary indexes of a sub in sync with its rows. The indexed values of every row
+# are kept in a hash, so the old index entries can be removed without reading the row.
+# The index keys are built from the index key prefix, which holds the hash tag of the sub, so
+# they are in the cluster slot of the declared keys.
+# KEYS[1]: indexed values hash, KEYS[2...]: complete keys,
+# ARGV[1]: index key prefix, ARGV[2]: {column: "set" | "zset"},
+# ARGV[3...]: mode, {column: value}, ... of every complete key
+# mode: "set" for a new row, "merge" for a partial update, "del" for a removed row,
+# "prune" for a row that might be expired, its entries are removed only if it does not exist
+INDEX_UPDATE = """
+local rows_key = KEYS[1]
+local prefix = ARGV[1]
+local kinds = cjson.decode(ARGV[2])
+
+local function remove(key, col, val)
+    if kinds[col] == 'zset' then
+        redis.call('ZREM', prefix .. col, key)
+    else
+        redis.call('SREM', prefix .. col .. '/' .. val, key)
+    end
+end
+
+local function add(key, col, val)
+    if kinds[col] == 'zset' then
+        redis.call('ZADD', prefix .. col, val, key)
+    else
+        redis.call('SADD', prefix .. col .. '/' .. val, key)
+    end
+end
+
+for k = 2, #KEYS do
+    local key, mode = KEYS[k], ARGV[k * 2 - 1]
+    if mode == 'prune' and redis.call('EXISTS', key) == 0 then
+        mode = 'del'
+    end
+    local old_raw = redis.call('HGET', rows_key, key)
+    -- A merge only applies to a row that has been set
+    if mode ~= 'prune' and (mode ~= 'merge' or old_raw) then
+        local old = old_raw and cjson.decode(old_raw) or {}
+        local vals = cjson.decode(ARGV[k * 2])
+        local row = {}
+        for col, val in pairs(old) do
+            if mode == 'merge' and vals[col] == nil then
+                row[col] = val
+            else
+                remove(key, col, val)
+            end
+        end
+        for col, val in pairs(vals) do
+            if val ~= cjson.null then
+                add(key, col, val)
+                row[col] = val
+            end
+        end
+        if mode == 'del' then
+            redis.call('HDEL', rows_key, key)
+        else
+            redis.call('HSET', rows_key, key, cjson.encode(row))
+        end
+    end
+end
+return 1
+"""
+
+# Removes the keys of expired rows from the key registry of a sub
+# KEYS[1]: key registry, KEYS[2]: registry expiry, KEYS[3...]: complete keys that might be
+# expired
+REGISTRY_PRUNE = """
+local removed = 0
+for k = 3, #KEYS do
+    local key = KEYS[k]
+    if redis.call('EXISTS', key) == 0 then
+        removed = removed + redis.call('ZREM', KEYS[1], key)
+        redis.call('ZREM', KEYS[2], key)
+    end
+end
+return removed
+"""
+
+# Removes the rows past their expiry time from the key registry and the indexes of a sub, a row
+# still alive, whose expiry was restarted, is given its new expiry time. The index keys are built
+# from the index key prefix, which holds the hash tag of the sub
+# KEYS[1]: key registry, KEYS[2]: registry expiry, KEYS[3]: index rows,
+# KEYS[4...]: complete keys past their expiry time in the registry expiry
+# ARGV[1]: index key prefix, ARGV[2]: json of column and index kind pairs,
+# ARGV[3]: current time in milliseconds
+REGISTRY_EXPIRE = """
+local prefix = ARGV[1]
+local kinds = cjson.decode(ARGV[2])
+local now = tonumber(ARGV[3])
+for k = 4, #KEYS do
+    local key = KEYS[k]
+    local pttl = redis.call('PTTL', key)
+    if pttl == -2 then
+        redis.call('ZREM', KEYS[1], key)
+        redis.call('ZREM', KEYS[2], key)
+        local old_raw = redis.call('HGET', KEYS[3], key)
+        if old_raw then
+            for col, val in pairs(cjson.decode(old_raw)) do
+                if kinds[col] == 'zset' then
+                    redis.call('ZREM', prefix .. col, key)
+                else
+                    redis.call('SREM', prefix .. col .. '/' .. val, key)
+                end
+            end
+            redis.call('HDEL', KEYS[3], key)
+        end
+    elseif pttl == -1 then
+        redis.call('ZREM', KEYS[2], key)
+    else
+        redis.call('ZADD', KEYS[2], now + pttl, key)
+    end
+end
+return #KEYS - 3
+"""
+
+# Releases a lock only if it is still held by the caller, an expired lock may have been taken
+# by another worker
+# KEYS[1]: lock key, ARGV[1]: the token the lock was taken with
+LOCK_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Replaces a blueprint kept in a redis hash, only if it has not been changed since it was read
+# KEYS[1]: blueprint hash, ARGV[1]: the version read, ARGV[2...]: field, value, field, value, ...
+# Returns the new version, -1 if the blueprint has been changed by another process
+BLUEPRINT_SAVE = """
+local version = tonumber(redis.call('HGET', KEYS[1], '__version__') or '0')
+if version ~= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], '__version__', version + 1, unpack(ARGV, 2))
+return version + 1
+"""
+
+# Aggregates a chunk of rows on the server, only the partial results of every group are sent
+# back. Values are decoded with cjson or cmsgpack, compressed values can not be decoded here.
+# KEYS: complete keys of the rows, all on one node
+# ARGV[1]: {"decoder": "json" | "msgpack", "is_hash": bool, "headers": compression headers,
+# "refs": columns to read (positions of positional values, names otherwise), "col": index of
+# the aggregated column in refs or 0, "group": index of the group column in refs or 0,
+# "where": [[index in refs, value], ...]}
+# Groups are keyed by the tag of their value: "n" null, "t" / "f" boolean, "d<%.17g>" number,
+# "s<text>" text
+# Returns {{tag, rows, count, sum, min, max, ...}, skipped keys, missing keys}, numbers as strings
+AGGREGATE = """
+local spec = cjson.decode(ARGV[1])
+local decode = spec.decoder == 'msgpack' and cmsgpack.unpack or cjson.decode
+local refs, is_hash = spec.refs, spec.is_hash
+local headers = {}
+for _, header in ipairs(spec.headers) do
+    headers[header] = true
+end
+
+-- A column is looked up by its ref in a stored value, by its index in the fields of a hash
+local function get_lookup(index)
+    if index == 0 then
+        return nil
+    end
+    return is_hash and index or refs[index]
+end
+local col, group_col = get_lookup(spec.col), get_lookup(spec.group)
+local where = {}
+for i, condition in ipairs(spec.where) do
+    where[i] = {get_lookup(condition[1]), condition[2]}
+end
+
+local function is_compressed(raw)
+    return #raw > 1 and headers[string.byte(raw, 1)] == true
+end
+
+local function is_null(val)
+    return val == nil or val == cjson.null
+end
+
+local function get_tag(val)
+    if is_null(val) then
+        return 'n'
+    elseif type(val) == 'boolean' then
+        return val and 't' or 'f'
+    elseif type(val) == 'number' then
+        return 'd' .. string.format('%.17g', val)
+    end
+    return 's' .. tostring(val)
+end
+
+-- The decoded fields of a hash row, or an empty row if no column is read, false if it is
+-- missing, nil if it can not be decoded
+local function read_fields(key)
+    if #refs == 0 then
+        return redis.call('EXISTS', key) == 1 and {}
+    end
+
+    local fields = redis.call('HMGET', key, unpack(refs))
+    local row, is_found = {}, false
+    for i = 1, #refs do
+        local raw = fields[i]
+        if raw then
+            if is_compressed(raw) then
+                return nil
+            end
+            is_found = true
+            row[i] = decode(raw)
+        end
+    end
+    -- Every field is written on set, so all of them missing means the row is missing
+    return is_found and row
+end
+
+local groups, tags, tags_by_val = {}, {}, {}
+local skipped, missing = {}, {}
+for _, key in ipairs(KEYS) do
+    local row
+    if is_hash or #refs == 0 then
+        row = read_fields(key)
+    else
+        row = redis.call('GET', key)
+        if row and not is_compressed(row) then
+            row = decode(row)
+        elseif row then
+            row = nil
+        end
+    end
+    if row == nil then
+        skipped[#skipped + 1] = key
+    elseif row == false then
+        missing[#missing + 1] = key
+    else
+        local is_matched = true
+        for _, condition in ipairs(where) do
+            local val, expected = row[condition[1]], condition[2]
+            if is_null(expected) and not is_null(val) or not is_null(expected) and
+                    val ~= expected then
+                is_matched = false
+                break
+            end
+        end
+        if is_matched then
+            local tag = ''
+            if group_col then
+                local val = row[group_col]
+                if is_null(val) then
+                    tag = 'n'
+                else
+                    tag = tags_by_val[val]
+                    if not tag then
+                        tag = get_tag(val)
+                        tags_by_val[val] = tag
+                    end
+                end
+            end
+            local group = groups[tag]
+            if not group then
+                group = {rows = 0, count = 0, sum = 0}
+                groups[tag] = group
+                tags[#tags + 1] = tag
+            end
+            group.rows = group.rows + 1
+            if col then
+                local val = row[col]
+                if not is_null(val) then
+                    group.count = group.count + 1
+                end
+                if type(val) == 'number' then
+                    group.sum = group.sum + val
+                    if group.min == nil or val < group.min then
+                        group.min = val
+                    end
+                    if group.max == nil or val > group.max then
+                        group.max = val
+                    end
+                end
+            end
+        end
+    end
+end
+
+local results = {}
+for _, tag in ipairs(tags) do
+    local group = groups[tag]
+    results[#results + 1] = tag
+    results[#results + 1] = tostring(group.rows)
+    results[#results + 1] = tostring(group.count)
+    results[#results + 1] = string.format('%.17g', group.sum)
+    results[#results + 1] = group.min and string.format('%.17g', group.min) or ''
+    results[#results + 1] = group.max and string.format('%.17g', group.max) or ''
+end
+return {results, skipped, missing}
+"""
+AGGREGATE_SHA = hashlib.sha1(AGGREGATE.encode('utf-8')).hexdigest()
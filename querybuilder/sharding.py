@@ -0,0 +1,647 @@
+""" Client-side sharding classes """
+
+import asyncio
+import contextvars
+import hashlib
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.crc import key_slot
+from redis.exceptions import ResponseError
+
+
+class HashRing:
+    """
+    A consistent hash ring with virtual nodes. Keys are routed by their cluster slot, so keys
+    sharing a hash tag, e.g. "{my_cache/users}/1", always live on the same node
+
+    methods:
+        get_hash(data) -> hash(int)
+        get_slot(key) -> slot(int)
+        build() -> None
+        add_node(node_name) -> None
+        remove_node(node_name) -> None
+        get_node(key) -> node_name(str)
+    """
+
+    SLOTS = 16384
+    SLOT_HASHES: list[int] | None = None
+
+    def __init__(self, node_names: list[str], replicas: int = 160):
+        """
+        HashRing initialization
+
+        :param node_names: names of the nodes, e.g. ["127.0.0.1:6379"]
+        :param replicas: number of virtual nodes per node
+        """
+        self.replicas = replicas
+        self.node_names = list(node_names)
+        self.slot_nodes = []
+        self.build()
+
+    @staticmethod
+    def get_hash(data: str) -> int:
+        """
+        Hash a string into a point of the ring
+
+        :param data: a node or slot label
+        :return: hash(int)
+        """
+        return int.from_bytes(hashlib.md5(data.encode('utf-8')).digest()[:4], 'big')
+
+    @staticmethod
+    def get_slot(key: bytes | str) -> int:
+        """
+        Get the cluster slot of a key, honouring hash tags
+
+        :param key: a redis key
+        :return: slot(int)
+        """
+        return key_slot(key.encode('utf-8') if isinstance(key, str) else key)
+
+    def build(self) -> None:
+        """
+        Place the virtual nodes on the ring and resolve the node of every slot
+
+        :return: None
+        """
+        points = sorted((self.get_hash(f'{node_name}#{i}'), node_name)
+                        for node_name in self.node_names for i in range(self.replicas))
+        hashes = [point[0] for point in points]
+        # Every slot has a fixed point on the ring, owned by the next virtual node
+        slot_hashes = HashRing.SLOT_HASHES
+        if slot_hashes is None:
+            slot_hashes = [self.get_hash(f'slot-{slot}') for slot in range(self.SLOTS)]
+            HashRing.SLOT_HASHES = slot_hashes
+        self.slot_nodes = [points[bisect(hashes, slot_hash) % len(points)][1]
+                           for slot_hash in slot_hashes]
+
+    def add_node(self, node_name: str) -> None:
+        """
+        Add a node, it takes over about 1/N of the slots from the other nodes
+
+        :param node_name: name of the node, e.g. "127.0.0.1:6380"
+        :return: None
+        """
+        if node_name in self.node_names:
+            raise KeyError(f'Node `{node_name}` is already in the ring.')
+        self.node_names.append(node_name)
+        self.build()
+
+    def remove_node(self, node_name: str) -> None:
+        """
+        Remove a node, its slots are spread over the other nodes
+
+        :param node_name: name of the node, e.g. "127.0.0.1:6380"
+        :return: None
+        """
+        self.node_names.remove(node_name)
+        self.build()
+
+    def get_node(self, key: bytes | str) -> str:
+        """
+        Get the node owning a key
+
+        :param key: a redis key
+        :return: node_name(str)
+        """
+        return self.slot_nodes[self.get_slot(key)]
+
+
+class ShardedRedis:
+    """
+    A client spreading the keys over standalone redis instances by consistent hashing. It offers
+    the part of the RedisCluster interface used by Sub: commands on a single key are sent to the
+    node owning it, and pipelines, MGET, DEL and UNLINK are split per node and sent in parallel
+    from a thread pool
+
+    methods:
+        get_client(key) -> redis(Redis)
+        group_by_node(keys) -> groups(dict)
+        run_many(calls) -> results(list)
+        pipeline(transaction,shard_hint) -> pipe(ShardedPipeline)
+        mget_nonatomic(keys) -> vals(list)
+        delete(*keys) -> removed(int)
+        unlink(*keys) -> removed(int)
+        scan_iter(match,count) -> keys(Iterator)
+        add_node(node_name,client,patterns,batch_size) -> moved(int)
+        move_keys(source,target,keys) -> moved(int)
+        get_copied_keys(keys,results) -> (moved_keys, copied_keys)
+        close() -> None
+    """
+
+    def __init__(self, clients: dict[str, Redis], replicas: int = 160,
+                 max_workers: int | None = None):
+        """
+        ShardedRedis initialization
+
+        :param clients: node name and connection pairs, e.g. {"127.0.0.1:6379": Redis(...)}
+        :param replicas: number of virtual nodes per node
+        :param max_workers: size of the thread pool, None for the ThreadPoolExecutor default
+        """
+        self.clients = dict(clients)
+        self.ring = HashRing(list(clients), replicas)
+        self.max_workers = max_workers
+        self.executor = None
+
+    def __getattr__(self, name: str) -> Callable:
+        """
+        Route a command on a single key, e.g. get, exists or ttl, to the node owning the key
+
+        :param name: redis command method name
+        :return: the command method
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def command(key, *args, **kwargs):
+            return getattr(self.get_client(key), name)(key, *args, **kwargs)
+        return command
+
+    def get_client(self, key: bytes | str) -> Redis | AsyncRedis:
+        """
+        Get the connection to the node owning a key
+
+        :param key: a redis key
+        :return: redis(Redis)
+        """
+        return self.clients[self.ring.get_node(key)]
+
+    def group_by_node(self, keys: list[bytes | str]) -> dict[str, list]:
+        """
+        Split keys by the node owning them
+
+        :param keys: redis keys
+        :return: groups(dict), node name and key list pairs
+        """
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.ring.get_node(key), []).append(key)
+        return groups
+
+    def run_many(self, calls: list[Callable]) -> list:
+        """
+        Run one call per node in parallel
+
+        :param calls: functions without args
+        :return: results(list), in the order of calls
+        """
+        if len(calls) <= 1:
+            return [call() for call in calls]
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='shard')
+        # The calls see the context of the caller, e.g. the operation being measured
+        context = contextvars.copy_context()
+        return list(self.executor.map(lambda call: context.copy().run(call), calls))
+
+    def pipeline(self, transaction: bool | None = None, shard_hint=None) -> 'ShardedPipeline':
+        """
+        Open a pipeline split per node, transactions can not span nodes
+
+        :param transaction: must not be set, kept for the redis interface
+        :param shard_hint: passed to the pipeline of every node
+        :return: pipe(ShardedPipeline)
+        """
+        if transaction:
+            raise ValueError('Transactions are not supported by a sharded cache.')
+        return ShardedPipeline(self, shard_hint)
+
+    def mget_nonatomic(self, keys: list[bytes | str]) -> list:
+        """
+        MGET split per node
+
+        :param keys: redis keys
+        :return: vals(list), in the order of keys
+        """
+        groups = self.group_by_node(keys)
+        results = self.run_many([lambda name=name, group=group: self.clients[name].mget(group)
+                                 for name, group in groups.items()])
+        vals = {}
+        for group, group_vals in zip(groups.values(), results):
+            vals.update(zip(group, group_vals))
+        return [vals[key] for key in keys]
+
+    def delete(self, *keys: bytes | str) -> int:
+        """
+        DEL split per node
+
+        :param keys: redis keys
+        :return: number of keys removed(int)
+        """
+        return sum(self.run_many([lambda name=name, group=group: self.clients[name].delete(*group)
+                                  for name, group in self.group_by_node(keys).items()]))
+
+    def unlink(self, *keys: bytes | str) -> int:
+        """
+        UNLINK split per node
+
+        :param keys: redis keys
+        :return: number of keys removed(int)
+        """
+        return sum(self.run_many([lambda name=name, group=group: self.clients[name].unlink(*group)
+                                  for name, group in self.group_by_node(keys).items()]))
+
+    def scan_iter(self, match: str | None = None, count: int | None = None) -> Iterator:
+        """
+        SCAN every node one after another
+
+        :param match: key pattern
+        :param count: SCAN COUNT hint
+        :return: an iterator of keys
+        """
+        for client in list(self.clients.values()):
+            yield from client.scan_iter(match=match, count=count)
+
+    def add_node(self, node_name: str, client: Redis, patterns: list[str],
+                 batch_size: int = 1000) -> int:
+        """
+        Add a node and move the keys it takes over from the other nodes. Keys are routed to the
+        new node first, so they are missing until moved, and a key written on the new node in
+        the meantime is kept instead of the moved one. A key the new node fails to restore, e.g.
+        when it is out of memory, is kept on its old node and not counted as moved
+
+        :param node_name: name of the node, e.g. "127.0.0.1:6380"
+        :param client: connection to the node
+        :param patterns: patterns of the keys to move, e.g. ["my_cache/*"]
+        :param batch_size: number of keys per SCAN page and per move batch
+        :return: number of keys moved(int)
+        """
+        old_clients = list(self.clients.items())
+        self.ring.add_node(node_name)
+        self.clients[node_name] = client
+
+        moved = 0
+        for old_name, old_client in old_clients:
+            for pattern in patterns:
+                keys = []
+                for key in old_client.scan_iter(match=pattern, count=batch_size):
+                    if self.ring.get_node(key) != old_name:
+                        keys.append(key)
+                    if len(keys) >= batch_size:
+                        moved += self.move_keys(old_client, client, keys)
+                        keys = []
+                if keys:
+                    moved += self.move_keys(old_client, client, keys)
+        return moved
+
+    @staticmethod
+    def move_keys(source: Redis, target: Redis, keys: list[bytes]) -> int:
+        """
+        Move keys between nodes with DUMP and RESTORE, keeping their ttl. Only the keys that
+        are on the target afterwards are removed from the source
+
+        :param source: connection to the node the keys are moved from
+        :param target: connection to the node the keys are moved to
+        :param keys: redis keys
+        :return: number of keys moved(int)
+        """
+        with source.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.dump(key)
+                pipe.pttl(key)
+            dumps = pipe.execute()
+
+        restored_keys = []
+        with target.pipeline(transaction=False) as pipe:
+            for i, key in enumerate(keys):
+                data, pttl = dumps[i * 2], dumps[i * 2 + 1]
+                # The key is expired or removed since the SCAN
+                if data is None or pttl == -2:
+                    continue
+                pipe.restore(key, max(pttl, 0), data)
+                restored_keys.append(key)
+            results = pipe.execute(raise_on_error=False)
+
+        moved_keys, copied_keys = ShardedRedis.get_copied_keys(restored_keys, results)
+        if copied_keys:
+            source.unlink(*copied_keys)
+        return len(moved_keys)
+
+    @staticmethod
+    def get_copied_keys(keys: list[bytes], results: list) -> tuple[list, list]:
+        """
+        Sort the keys of a RESTORE pipeline by their result. A key already written on the
+        target fails with BUSYKEY and is kept there, a key failing with any other error, e.g. OOM,
+        was not copied and must stay on the source
+
+        :param keys: the restored keys
+        :param results: the RESTORE results, in the order of keys
+        :return: (moved_keys, copied_keys), the keys restored on the target, and the keys that
+            are safe to remove from the source
+        """
+        moved_keys, copied_keys = [], []
+        for key, result in zip(keys, results):
+            if not isinstance(result, ResponseError):
+                moved_keys.append(key)
+                copied_keys.append(key)
+            elif str(result).startswith('BUSYKEY'):
+                copied_keys.append(key)
+        return moved_keys, copied_keys
+
+    def close(self) -> None:
+        """
+        Shut the thread pool down and close the connections to the nodes
+
+        :return: None
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for client in self.clients.values():
+            client.close()
+
+
+class ShardedPipeline:
+    """
+    A pipeline split per node, every node pipeline is sent in parallel on execute
+
+    methods:
+        reset() -> None
+        get_pipe(key) -> pipe
+        execute_command(*args,**kwargs) -> pipe(ShardedPipeline)
+        merge(results) -> results(list)
+        execute(raise_on_error) -> results(list)
+    """
+
+    def __init__(self, sharded_redis: ShardedRedis, shard_hint=None):
+        """
+        ShardedPipeline initialization
+
+        :param sharded_redis: the sharded connection
+        :param shard_hint: passed to the pipeline of every node
+        """
+        self.sharded_redis = sharded_redis
+        self.shard_hint = shard_hint
+        self.pipes = {}
+        self.order = []
+
+    def __enter__(self) -> 'ShardedPipeline':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.reset()
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __getattr__(self, name: str) -> Callable:
+        """
+        Queue a command on a single key into the pipeline of the node owning the key
+
+        :param name: redis command method name
+        :return: the command method
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def command(key, *args, **kwargs):
+            getattr(self.get_pipe(key), name)(key, *args, **kwargs)
+            return self
+        return command
+
+    def reset(self) -> None:
+        """
+        Drop the queued commands
+
+        :return: None
+        """
+        self.pipes = {}
+        self.order = []
+
+    def get_pipe(self, key: bytes | str):
+        """
+        Get the pipeline of the node owning a key, the next queued result belongs to it
+
+        :param key: a redis key
+        :return: redis pipeline
+        """
+        node_name = self.sharded_redis.ring.get_node(key)
+        pipe = self.pipes.get(node_name)
+        if pipe is None:
+            pipe = self.sharded_redis.clients[node_name].pipeline(transaction=False,
+                                                                  shard_hint=self.shard_hint)
+            self.pipes[node_name] = pipe
+        self.order.append(node_name)
+        return pipe
+
+    def execute_command(self, *args, **kwargs) -> 'ShardedPipeline':
+        """
+        Queue a raw command, routed by its first key, all keys must live on one node
+
+        :param args: raw command args, e.g. ("MSET", key, val)
+        :return: pipe(ShardedPipeline)
+        """
+        key = args[3] if args[0].upper() in ('EVAL', 'EVALSHA') else args[1]
+        self.get_pipe(key).execute_command(*args, **kwargs)
+        return self
+
+    def merge(self, results: list) -> list:
+        """
+        Put the results of the node pipelines back in the queued order
+
+        :param results: results of every node pipeline, in the order of "pipes"
+        :return: results(list)
+        """
+        node_results = {node_name: iter(result) for node_name, result in zip(self.pipes, results)}
+        merged = [next(node_results[node_name]) for node_name in self.order]
+        self.reset()
+        return merged
+
+    def execute(self, raise_on_error: bool = True) -> list:
+        """
+        Send every node pipeline in parallel
+
+        :param raise_on_error: raise the first error instead of returning it
+        :return: results(list), in the queued order
+        """
+        results = self.sharded_redis.run_many(
+            [lambda pipe=pipe: pipe.execute(raise_on_error=raise_on_error)
+             for pipe in self.pipes.values()])
+        return self.merge(results)
+
+
+class AsyncShardedRedis(ShardedRedis):
+    """
+    ShardedRedis for asyncio, the node calls are run concurrently with asyncio.gather
+    """
+
+    # pylint: disable=W0236,W0221
+    async def run_many(self, calls: list[Callable]) -> list:
+        """
+        Run one call per node concurrently
+
+        :param calls: functions without args returning awaitables
+        :return: results(list), in the order of calls
+        """
+        return list(await asyncio.gather(*(call() for call in calls)))
+
+    def pipeline(self, transaction: bool | None = None,
+                 shard_hint=None) -> 'AsyncShardedPipeline':
+        """
+        Open a pipeline split per node, transactions can not span nodes
+
+        :param transaction: must not be set, kept for the redis interface
+        :param shard_hint: passed to the pipeline of every node
+        :return: pipe(AsyncShardedPipeline)
+        """
+        if transaction:
+            raise ValueError('Transactions are not supported by a sharded cache.')
+        return AsyncShardedPipeline(self, shard_hint)
+
+    async def mget_nonatomic(self, keys: list[bytes | str]) -> list:
+        """
+        MGET split per node
+
+        :param keys: redis keys
+        :return: vals(list), in the order of keys
+        """
+        groups = self.group_by_node(keys)
+        results = await self.run_many([lambda name=name, group=group:
+                                       self.clients[name].mget(group)
+                                       for name, group in groups.items()])
+        vals = {}
+        for group, group_vals in zip(groups.values(), results):
+            vals.update(zip(group, group_vals))
+        return [vals[key] for key in keys]
+
+    async def delete(self, *keys: bytes | str) -> int:
+        """
+        DEL split per node
+
+        :param keys: redis keys
+        :return: number of keys removed(int)
+        """
+        return sum(await self.run_many([lambda name=name, group=group:
+                                        self.clients[name].delete(*group)
+                                        for name, group in self.group_by_node(keys).items()]))
+
+    async def unlink(self, *keys: bytes | str) -> int:
+        """
+        UNLINK split per node
+
+        :param keys: redis keys
+        :return: number of keys removed(int)
+        """
+        return sum(await self.run_many([lambda name=name, group=group:
+                                        self.clients[name].unlink(*group)
+                                        for name, group in self.group_by_node(keys).items()]))
+
+    async def scan_iter(self, match: str | None = None,
+                        count: int | None = None) -> AsyncIterator:
+        """
+        SCAN every node one after another
+
+        :param match: key pattern
+        :param count: SCAN COUNT hint
+        :return: an async iterator of keys
+        """
+        for client in list(self.clients.values()):
+            async for key in client.scan_iter(match=match, count=count):
+                yield key
+
+    async def add_node(self, node_name: str, client: AsyncRedis, patterns: list[str],
+                       batch_size: int = 1000) -> int:
+        """
+        Add a node and move the keys it takes over from the other nodes, see ShardedRedis
+
+        :param node_name: name of the node, e.g. "127.0.0.1:6380"
+        :param client: redis.asyncio connection to the node
+        :param patterns: patterns of the keys to move, e.g. ["my_cache/*"]
+        :param batch_size: number of keys per SCAN page and per move batch
+        :return: number of keys moved(int)
+        """
+        old_clients = list(self.clients.items())
+        self.ring.add_node(node_name)
+        self.clients[node_name] = client
+
+        moved = 0
+        for old_name, old_client in old_clients:
+            for pattern in patterns:
+                keys = []
+                async for key in old_client.scan_iter(match=pattern, count=batch_size):
+                    if self.ring.get_node(key) != old_name:
+                        keys.append(key)
+                    if len(keys) >= batch_size:
+                        moved += await self.move_keys(old_client, client, keys)
+                        keys = []
+                if keys:
+                    moved += await self.move_keys(old_client, client, keys)
+        return moved
+
+    @staticmethod
+    async def move_keys(source: AsyncRedis, target: AsyncRedis, keys: list[bytes]) -> int:
+        """
+        Move keys between nodes with DUMP and RESTORE, keeping their ttl
+
+        :param source: redis.asyncio connection to the node the keys are moved from
+        :param target: redis.asyncio connection to the node the keys are moved to
+        :param keys: redis keys
+        :return: number of keys moved(int)
+        """
+        async with source.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.dump(key)
+                pipe.pttl(key)
+            dumps = await pipe.execute()
+
+        restored_keys = []
+        async with target.pipeline(transaction=False) as pipe:
+            for i, key in enumerate(keys):
+                data, pttl = dumps[i * 2], dumps[i * 2 + 1]
+                if data is None or pttl == -2:
+                    continue
+                pipe.restore(key, max(pttl, 0), data)
+                restored_keys.append(key)
+            results = await pipe.execute(raise_on_error=False)
+
+        moved_keys, copied_keys = ShardedRedis.get_copied_keys(restored_keys, results)
+        if copied_keys:
+            await source.unlink(*copied_keys)
+        return len(moved_keys)
+
+    def close(self) -> None:
+        """
+        The redis.asyncio connections are closed on the event loop, await "aclose()" instead
+
+        :return: None
+        """
+        raise ValueError('AsyncShardedRedis is closed with "await aclose()"')
+
+    async def aclose(self) -> None:
+        """
+        Close the redis.asyncio connections to the nodes
+
+        :return: None
+        """
+        for client in self.clients.values():
+            await client.aclose()
+    # pylint: enable=W0236,W0221
+
+
+class AsyncShardedPipeline(ShardedPipeline):
+    """
+    ShardedPipeline for asyncio, every node pipeline is sent concurrently on execute
+    """
+
+    async def __aenter__(self) -> 'AsyncShardedPipeline':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        self.reset()
+
+    # pylint: disable=W0236,W0221
+    async def execute(self, raise_on_error: bool = True) -> list:
+        """
+        Send every node pipeline concurrently
+
+        :param raise_on_error: raise the first error instead of returning it
+        :return: results(list), in the queued order
+        """
+        results = await self.sharded_redis.run_many(
+            [lambda pipe=pipe: pipe.execute(raise_on_error=raise_on_error)
+             for pipe in self.pipes.values()])
+        return self.merge(results)
+    # pylint: enable=W0236,W0221
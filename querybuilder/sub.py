@@ -1,203 +1,133 @@
 """ Cache sub initial class """
 
-import json
+import time
+from contextlib import closing
+from typing import Any, Callable, Generator, Iterator
 
-from querybuilder.querybuilder import QueryBuilder
+from querybuilder.base_sub import BaseSub
 
 
-class Sub:
+class Sub(BaseSub):
     """
-    Cache sub initial class, where all the cache query begin
+    Cache sub initial class, where all the cache query begin. The queries are the plans of
+    BaseSub, Sub makes their redis calls
 
     methods:
-        get_complete_key(key) -> complete_key(str)
-        get(key,is_key_complete) -> value(dict) | None
-        get_many(keys,is_key_complete) -> values(list[dict | None])
-        get_all() -> values(list[dict])
-        get_complete_val(key,val) -> complete_val(dict)
-        set(key,val,is_key_complete,is_val_complete) -> is_success(bool)
-        set_many(key_vals,is_key_complete,is_val_complete) -> is_success(bool)
-        unset(key,is_key_complete) -> is_success(bool)
-        unset_many(keys,is_key_complete) -> is_success(bool)
-        unset_all() -> is_success(bool)
+        run(plan_) -> result
+        iterate(plan_) -> items(Iterator)
+        execute(queue,is_transaction,raise_on_error) -> results(list)
+        merge(complete_key,partial_val) -> is_updated(bool)
+        next_of(iterator) -> item
+        run_blocking(func,*args) -> result
+        sleep(seconds) -> None
+        single_loader(loader) -> batch_loader(Callable)
     """
 
-    def __init__(self, query_builder: QueryBuilder):
+    def run(self, plan_: Generator) -> Any:
         """
-        Query Builder initialization
+        Make the redis calls of a plan, an error of a call is raised into the plan
 
-        :param query_builder: QueryBuilder object contains redis connection and sub info
+        :param plan_: generator yielding the redis calls
+        :return: the value the plan returns
         """
-        self.query_builder = query_builder
+        result, error = None, None
+        while True:
+            try:
+                call = plan_.send(result) if error is None else plan_.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = call(), None
+            except BaseException as exc:  # pylint: disable=W0718
+                result, error = None, exc
 
-    def get_complete_key(self, key: str | int) -> str:
+    def iterate(self, plan_: Generator) -> Iterator:
         """
-        Generates a complete key "<cache_name>/<sub_name>/<key>"
+        Make the redis calls of an iterator plan and yield its items, an error of a call is
+        raised into the plan
 
-        :param key: the key of a sub, the value of first element in the sub_attr
-        :return: complete_key in "<cache_name>/<sub_name>/<key>" format
+        :param plan_: generator yielding the redis calls and the items
+        :return: an iterator of the items
         """
-        return f'{self.query_builder.cache_name}/{self.query_builder.sub_name}/{str(key)}'
+        result, error = None, None
+        with closing(plan_):
+            while True:
+                try:
+                    step = plan_.send(result) if error is None else plan_.throw(error)
+                except StopIteration as stop:
+                    return stop.value
+                if not callable(step):
+                    result, error = None, None
+                    yield step
+                    continue
+                try:
+                    result, error = step(), None
+                except BaseException as exc:  # pylint: disable=W0718
+                    result, error = None, exc
 
-    # noinspection PyTypeChecker
-    def get(self, key: str | int, is_key_complete: bool = False) -> dict | None:
+    def execute(self, queue: Callable, is_transaction: bool = True,
+                raise_on_error: bool = True) -> list:
         """
-        Get cache from a key
+        Queue commands into a pipeline and send it
 
-        :param key: the key of a cache, the value of first element in the sub_attr
-        :param is_key_complete: is key already in complete form or not
-        :return: value(dict)
+        :param queue: called as queue(pipe)
+        :param is_transaction: wrap the commands in MULTI/EXEC
+        :param raise_on_error: raise the first command error instead of returning it
+        :return: the command results
         """
-        complete_key = key if is_key_complete else self.get_complete_key(key)
-        val = self.query_builder.redis.get(complete_key)
+        with self.query_builder.pipeline(is_transaction) as pipe:
+            queue(pipe)
+            return pipe.execute(raise_on_error=raise_on_error)
 
-        if val is None:
-            return None
-
-        return json.loads(val)
-
-    def get_many(self, keys: list[str] | list[int], is_key_complete: bool = False)\
-            -> list[dict | None]:
+    def merge(self, complete_key: str, partial_val: dict) -> bool:
         """
-        Get cache from a key list
+        Update some columns of an existing string row in a WATCH transaction
 
-        :param keys: a key list
-        :param is_key_complete: is key already in complete form or not
-        :return: value list
+        :param complete_key: a key in "<cache_name>/<sub_name>/<key>" format
+        :param partial_val: the validated columns to update
+        :return: is_updated(bool), False if the row does not exist
         """
-        complete_keys = keys if is_key_complete else [self.get_complete_key(key) for key in keys]
-        vals = self.query_builder.redis.mget(complete_keys)
+        def update_val(pipe) -> bool:
+            return self.query_builder.queue_merge(pipe, complete_key, pipe.get(complete_key),
+                                                  partial_val)
 
-        result = []
-        for val in vals:
-            if val is None:
-                result.append(None)
-                continue
-            result.append(json.loads(val))
+        redis = self.query_builder.get_redis(complete_key)
+        return redis.transaction(update_val, complete_key, value_from_callable=True)
 
-        return result
-
-    def get_all(self) -> list[dict]:
+    def next_of(self, iterator: Iterator) -> Any:
         """
-        Get all cache in the current cache context
+        Get the next item of an iterator
 
-        :return: list of values
+        :param iterator: an iterator
+        :return: the next item, None once the iterator is exhausted
         """
-        key_prefix = self.get_complete_key('')
-        _, complete_keys = self.query_builder.redis.scan(match=f'{key_prefix}*')
-
-        return self.get_many(complete_keys, is_key_complete=True)
+        return next(iterator, None)
 
-    def get_complete_val(self, key: str | int, val: dict) -> dict:
+    def run_blocking(self, func: Callable, *args) -> Any:
         """
-        Generates a complete cache value, including the key itself
+        Call a function that blocks on file I/O
 
-        :param key: the key of a cache, the value of first element in the sub_attr
-        :param val: the val of a cache, the value of the rest in the sub_attr
-        :return:  complete_val(dict)
+        :param func: the blocking function
+        :param args: its arguments
+        :return: its result
         """
-        sub_attr_list = list(self.query_builder.sub_attr.items())
-        key_name = sub_attr_list[0][0]
-        key_type = sub_attr_list[0][1].lower()
+        return func(*args)
 
-        temp_val = {}
-        if 'integer' in key_type:
-            temp_val[key_name] = int(key)
-        else:
-            temp_val[key_name] = str(key)
-
-        temp_val = {**temp_val, **val}
-
-        return temp_val
-
-    def set(self, key: str | int, val: dict, is_key_complete: bool = False,
-            is_val_complete: bool = False) -> bool:
+    def sleep(self, seconds: float) -> None:
         """
-        Set cache with a single key
+        Wait before the next attempt
 
-        :param key: the key of a cache, the value of first element in the sub_attr
-        :param val: the val of a cache, the value of the rest in the sub_attr
-        :param is_key_complete: is key already in complete form or not
-        :param is_val_complete: is val already in complete form or not
-        :return: is_success(bool)
+        :param seconds: the time to wait
+        :return: None
         """
-        complete_key = key if is_key_complete else self.get_complete_key(key)
-        complete_val = val if is_val_complete else self.get_complete_val(key, val)
-
-        if not self.query_builder.validate(complete_val):
-            return False
+        time.sleep(seconds)
 
-        complete_val_str = str(json.dumps(complete_val))
-
-        return self.query_builder.redis.set(complete_key, complete_val_str)
-
-    def set_many(self, key_vals: dict[str, dict] | dict[int, dict], is_key_complete: bool = False,
-                 is_val_complete: bool = False) -> bool:
-        """
-        Set cache with multiple keys and values
-
-        :param key_vals: a dict contains  key and value pairs
-        :param is_key_complete: is key already in complete form or not
-        :param is_val_complete: is val already in complete form or not
-        :return: is_success(bool)
+    def single_loader(self, loader: Callable[[str | int], dict | None])\
+            -> Callable[[list], dict]:
         """
-        temp_key_vals = {}
-        for key, val in key_vals.items():
-            complete_key = key if is_key_complete else self.get_complete_key(key)
-            complete_val = val if is_val_complete else self.get_complete_val(key, val)
-
-            if not self.query_builder.validate(complete_val):
-                return False
-
-            complete_val_str = str(json.dumps(complete_val))
-            temp_key_vals[complete_key] = complete_val_str
-
-        return self.query_builder.redis.mset(temp_key_vals)
+        Make the batch_loader of get_many_or_load out of the loader of get_or_load
 
-    def unset(self, key: str | int, is_key_complete: bool = False) -> bool:
+        :param loader: called as loader(key), returns the val of the cache
+        :return: batch_loader, called as batch_loader([key])
         """
-        Unset a cache with a single key
-
-        :param key: the key of a cache, the value of first element in the sub_attr
-        :param is_key_complete: is key already in complete form or not
-        :return: is_success(bool)
-        """
-        complete_key = key if is_key_complete else self.get_complete_key(key)
-        return bool(self.query_builder.redis.delete(complete_key))
-
-    def unset_many(self, keys: list[str] | list[int], is_key_complete: bool = False) -> bool:
-        """
-        Unset multiple cache with multiple keys
-
-        :param keys: the key of a cache, the value of first element in the sub_attr
-        :param is_key_complete: is key already in complete form or not
-        :return: is_success(bool)
-        """
-        complete_keys = keys if is_key_complete else [self.get_complete_key(key) for key in keys]
-        complete_vals = self.get_many(complete_keys, is_key_complete=True)
-
-        is_all_ok = True
-        for i, complete_key in enumerate(complete_keys):
-            if complete_vals[i] is not None:
-                if not self.unset(complete_key, is_key_complete=True):
-                    is_all_ok = False
-                    break
-
-        if is_all_ok:
-            return True
-
-        key_vals = {complete_keys[i]: complete_vals[i] for i in range(len(keys))
-                    if complete_vals[i] is not None}
-        self.set_many(key_vals, is_key_complete=True, is_val_complete=True)
-        return False
-
-    def unset_all(self) -> bool:
-        """
-        Unset all cache in the context
-
-        :return: is_success(bool)
-        """
-        key_prefix = self.get_complete_key('')
-        _, complete_keys = self.query_builder.redis.scan(match=f'{key_prefix}*')
-
-        return self.unset_many(complete_keys, is_key_complete=True)
+        return lambda keys: {keys[0]: loader(keys[0])}
@@ -0,0 +1,115 @@
+""" Fixtures running Cache and AsyncCache on in-process fakeredis servers """
+
+import fakeredis
+import pytest
+from redis import Redis
+
+from async_cache import AsyncCache
+from cache import Cache
+
+PASSPHRASE = 'test'
+
+
+class FakeCache(Cache):
+    """
+    Cache on fakeredis servers, one server per host and port
+
+    methods:
+        connect_node(host,port) -> redis(fakeredis.FakeRedis)
+        connect_blueprint() -> redis(fakeredis.FakeRedis) | None
+    """
+
+    servers = {}
+
+    def connect_node(self, host: str, port: int) -> Redis:
+        """
+        Open a connection to the fakeredis server of a host and port
+
+        :param host: the IP address of the node
+        :param port: the port of the node
+        :return: fakeredis.FakeRedis connection
+        """
+        return fakeredis.FakeRedis(server=get_server(host, port))
+
+    def connect_blueprint(self) -> Redis | None:
+        """
+        Open the connection of the blueprint, on the redis_host server
+
+        :return: fakeredis.FakeRedis connection, None with file storage
+        """
+        if self.blueprint_storage != 'redis':
+            return None
+        return fakeredis.FakeRedis(server=get_server(self.redis_host, self.redis_port))
+
+
+class AsyncFakeCache(AsyncCache):
+    """
+    AsyncCache on fakeredis servers, the blueprint is still read with a sync connection
+
+    methods:
+        connect_node(host,port) -> redis(fakeredis.FakeAsyncRedis)
+        connect_blueprint() -> redis(fakeredis.FakeRedis) | None
+    """
+
+    def connect_node(self, host: str, port: int) -> fakeredis.FakeAsyncRedis:
+        """
+        Open an asyncio connection to the fakeredis server of a host and port
+
+        :param host: the IP address of the node
+        :param port: the port of the node
+        :return: fakeredis.FakeAsyncRedis connection
+        """
+        return fakeredis.FakeAsyncRedis(server=get_server(host, port))
+
+    connect_blueprint = FakeCache.connect_blueprint
+
+
+def get_server(host: str, port: int) -> fakeredis.FakeServer:
+    """
+    Get the fakeredis server of a host and port, created on first use
+
+    :param host: the IP address of the server
+    :param port: the port of the server
+    :return: fakeredis.FakeServer
+    """
+    server = FakeCache.servers.get((host, port))
+    if server is None:
+        server = FakeCache.servers[(host, port)] = fakeredis.FakeServer()
+    return server
+
+
+@pytest.fixture(autouse=True)
+def fake_servers(tmp_path, monkeypatch):
+    """ Fresh fakeredis servers, and blueprint files kept in a temporary directory """
+    monkeypatch.chdir(tmp_path)
+    FakeCache.servers.clear()
+    yield FakeCache.servers
+    FakeCache.servers.clear()
+
+
+@pytest.fixture
+def cache() -> FakeCache:
+    """ A cache with a passphrase and a `users` sub """
+    cache = FakeCache('test_cache', '127.0.0.1', 6379)
+    cache.setup_passphrase(PASSPHRASE)
+    cache.create_sub('users', {'uid': 'INTEGER', 'name': 'TEXT', 'status': 'BOOLEAN'},
+                     passphrase=PASSPHRASE)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def make_cache():
+    """ Build more caches on the same fakeredis servers, with a passphrase set """
+    caches = []
+
+    def make_cache(cache_class: type = FakeCache, **kwargs) -> Cache:
+        cache = cache_class('test_cache', '127.0.0.1', 6379, **kwargs)
+        cache.setup_passphrase(PASSPHRASE)
+        caches.append(cache)
+        return cache
+
+    yield make_cache
+    for cache in caches:
+        if not isinstance(cache, AsyncCache):
+            cache.close()
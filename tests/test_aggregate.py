@@ -0,0 +1,80 @@
+""" Tests of the server-side aggregations of sub rows """
+
+import asyncio
+
+import pytest
+
+from conftest import PASSPHRASE, AsyncFakeCache
+
+SUB_ATTR = {'pid': 'INTEGER', 'team': 'TEXT', 'score': 'REAL', 'level': 'INTEGER',
+            'status': 'BOOLEAN', 'note': 'TEXT'}
+ROWS = {1: {'team': 'a', 'score': 1.5, 'level': 1, 'status': True, 'note': 'x'},
+        2: {'team': 'a', 'score': 2.5, 'level': 3, 'status': False, 'note': 'y'},
+        3: {'team': 'b', 'score': 4.0, 'level': 2, 'status': True, 'note': 'z'},
+        4: {'team': 'b', 'score': 8.0, 'level': 5, 'status': True, 'note': 'abc' * 400}}
+
+
+# The lua of fakeredis has no cmsgpack, msgpack values can only be aggregated on a real server
+@pytest.fixture(params=[{}, {'is_positional': True}, {'storage': 'hash'},
+                        {'compression': 'zlib', 'compression_min_size': 256}],
+                ids=['json', 'positional', 'hash', 'compressed'])
+def sub(cache, request):
+    cache.create_sub('players', SUB_ATTR, passphrase=PASSPHRASE, **request.param)
+    sub = cache.sub('players')
+    sub.set_many(ROWS)
+    return sub
+
+
+def test_aggregate(sub):
+    assert sub.aggregate() == 4
+    assert sub.aggregate('count', 'note') == 4
+    assert sub.aggregate('sum', 'score', batch_size=1) == 16.0
+    assert sub.aggregate('min', 'level') == 1
+    assert sub.aggregate('max', 'level') == 5
+    assert isinstance(sub.aggregate('max', 'level'), int)
+    assert sub.aggregate('avg', 'score') == 4.0
+
+
+def test_aggregate_group_by_and_conditions(sub):
+    assert sub.aggregate(group_by='team') == {'a': 2, 'b': 2}
+    assert sub.aggregate('sum', 'score', group_by='team') == {'a': 4.0, 'b': 12.0}
+    assert sub.aggregate('max', 'score', group_by='status') == {True: 8.0, False: 2.5}
+    assert sub.aggregate('sum', 'level', status=True) == 8
+    assert sub.aggregate('avg', 'score', team='b', status=True) == 6.0
+    assert sub.aggregate(group_by='level', team='a') == {1: 1, 3: 1}
+    assert sub.aggregate('min', 'score', team='c') is None
+    assert sub.aggregate(team='c') == 0
+
+
+def test_aggregate_ignores_unset_rows(sub):
+    assert sub.unset(4)
+    assert sub.aggregate('max', 'score') == 4.0
+    assert sub.aggregate(group_by='team') == {'a': 2, 'b': 1}
+
+
+@pytest.mark.parametrize('args, kwargs', [
+    (('median', 'score'), {}),
+    (('sum',), {}),
+    (('sum', 'team'), {}),
+    (('sum', 'pid'), {}),
+    (('count', 'missing'), {}),
+    (('count',), {'group_by': 'missing'}),
+    (('count',), {'missing': 1}),
+])
+def test_aggregate_errors(sub, args, kwargs):
+    with pytest.raises(ValueError):
+        sub.aggregate(*args, **kwargs)
+
+
+def test_async_aggregate(cache, make_cache):
+    cache.create_sub('players', SUB_ATTR, passphrase=PASSPHRASE)
+    cache.sub('players').set_many(ROWS)
+
+    async def run():
+        sub = make_cache(AsyncFakeCache).sub('players')
+        assert await sub.aggregate() == 4
+        assert await sub.aggregate('sum', 'score', group_by='team', batch_size=1) == \
+            {'a': 4.0, 'b': 12.0}
+        assert await sub.aggregate('max', 'level', status=False) == 3
+
+    asyncio.run(run())
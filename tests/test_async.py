@@ -0,0 +1,57 @@
+""" Tests of AsyncCache and AsyncSub on fakeredis """
+
+import asyncio
+
+import pytest
+
+from conftest import PASSPHRASE, AsyncFakeCache
+from querybuilder.async_sub import AsyncSub
+
+
+def test_async_sub(cache, make_cache):
+    async def run():
+        async_cache = make_cache(AsyncFakeCache)
+        assert await async_cache.ping()
+        sub = async_cache.sub('users')
+        assert isinstance(sub, AsyncSub)
+        assert sub is async_cache.sub('users')
+
+        assert await sub.set(1, {'name': 'a', 'status': True})
+        assert await sub.set_many({uid: {'name': f'n{uid}', 'status': False}
+                                   for uid in range(2, 12)})
+        assert not await sub.set(99, {'name': 1, 'status': True})
+        assert await sub.get(1) == {'uid': 1, 'name': 'a', 'status': True}
+        assert await sub.get(1, fields=['name']) == {'name': 'a'}
+        assert await sub.get_many([1, 2, 404]) == [{'uid': 1, 'name': 'a', 'status': True},
+                                                   {'uid': 2, 'name': 'n2', 'status': False},
+                                                   None]
+        assert len(await sub.get_all(batch_size=4)) == 11
+        assert await sub.count() == 11
+        assert await sub.unset_many([1, 2, 404]) == 2
+        assert await sub.unset(3)
+        assert await sub.unset_all(batch_size=3) == 8
+        with pytest.raises(ValueError):
+            async_cache.close()
+        await async_cache.aclose()
+
+    asyncio.run(run())
+    # Both caches share the server and the blueprint
+    assert cache.sub('users').get_all() == []
+
+
+def test_async_delete_sub(make_cache):
+    async def run():
+        async_cache = make_cache(AsyncFakeCache)
+        async_cache.create_sub('events', {'eid': 'INTEGER', 'kind': 'TEXT'},
+                               passphrase=PASSPHRASE)
+        await async_cache.sub('events').set_many({eid: {'kind': 'k'} for eid in range(30)})
+        assert await async_cache.delete_sub('events', PASSPHRASE, batch_size=8,
+                                            is_background=True)
+        assert async_cache.is_sub_deleting('events')
+        assert await async_cache.teardowns['events'] == 30
+        assert not async_cache.is_sub_deleting('events')
+        keys = [key async for key in async_cache.redis.scan_iter(match='test_cache/events/*')]
+        await async_cache.aclose()
+        return keys
+
+    assert asyncio.run(run()) == []
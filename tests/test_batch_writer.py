@@ -0,0 +1,148 @@
+""" Tests of the write-behind batch writer """
+
+import asyncio
+import time
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from conftest import AsyncFakeCache
+
+
+def fail_once(write_batch):
+    """ Makes the first write of a batch writer fail as if the connection dropped """
+    calls = []
+
+    def flaky_write_batch(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RedisConnectionError('Connection reset by peer')
+        return write_batch(*args)
+    return flaky_write_batch
+
+
+def test_close_writes_the_buffer(cache):
+    sub = cache.sub('users')
+    sub.set(9, {'name': 'old', 'status': True})
+    with sub.batch_writer(max_items=1000, max_delay_ms=10000) as writer:
+        for uid in range(10):
+            assert writer.set(uid, {'name': f'n{uid}', 'status': True})
+        writer.set(1, {'name': 'last', 'status': False})
+        writer.unset(9)
+        assert sub.get(1) is None
+    assert sub.get(1) == {'uid': 1, 'name': 'last', 'status': False}
+    assert sub.get(9) is None
+    assert sub.count() == 9
+
+
+def test_writes_when_max_items_are_buffered(cache):
+    sub = cache.sub('users')
+    writer = sub.batch_writer(max_items=5, max_delay_ms=10000)
+    for uid in range(5):
+        writer.set(uid, {'name': 'n', 'status': True})
+    deadline = time.monotonic() + 2
+    while sub.count() < 5 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert sub.count() == 5
+    writer.close()
+
+
+def test_writes_after_max_delay(cache):
+    sub = cache.sub('users')
+    writer = sub.batch_writer(max_items=1000, max_delay_ms=10)
+    writer.set(1, {'name': 'n', 'status': True})
+    time.sleep(0.2)
+    assert sub.get(1) is not None
+    writer.close()
+
+
+def test_flush(cache):
+    sub = cache.sub('users')
+    writer = sub.batch_writer(max_delay_ms=10000)
+    writer.set(1, {'name': 'n', 'status': True})
+    writer.set(2, {'name': 'n', 'status': True})
+    assert writer.flush() == 2
+    assert sub.count() == 2
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.set(3, {'name': 'n', 'status': True})
+
+
+def test_invalid_rows_are_reported(cache):
+    errors = []
+    sub = cache.sub('users')
+    with sub.batch_writer(on_error=lambda key, invalid_cols: errors.append(key),
+                          max_errors=2) as writer:
+        for uid in range(4):
+            assert not writer.set(uid, {'name': uid, 'status': True})
+        writer.set(5, {'name': 'n', 'status': True})
+    assert errors == [0, 1, 2, 3]
+    assert list(writer.errors) == [(2, ['name']), (3, ['name'])]
+    assert writer.error_count == 4
+    assert sub.count() == 1
+
+
+def test_failed_batch_is_written_again(cache, monkeypatch):
+    sub = cache.sub('users')
+    monkeypatch.setattr(sub, 'write_batch', fail_once(sub.write_batch))
+    writer = sub.batch_writer(max_items=1000, max_delay_ms=20)
+    for uid in range(5):
+        writer.set(uid, {'name': f'n{uid}', 'status': True})
+    deadline = time.monotonic() + 2
+    while sub.count() < 5 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert sub.count() == 5
+    assert writer.flush_error_count == 1
+    assert isinstance(writer.flush_errors[0], RedisConnectionError)
+    with pytest.raises(RedisConnectionError):
+        writer.close()
+
+
+def test_failed_flush_keeps_newer_writes(cache, monkeypatch):
+    sub = cache.sub('users')
+    monkeypatch.setattr(sub, 'write_batch', fail_once(sub.write_batch))
+    with sub.batch_writer(max_items=1000, max_delay_ms=10000) as writer:
+        writer.set(1, {'name': 'old', 'status': True})
+        writer.set(2, {'name': 'n2', 'status': True})
+        with pytest.raises(RedisConnectionError):
+            writer.flush()
+        writer.set(1, {'name': 'new', 'status': False})
+        writer.unset(2)
+        assert writer.flush() == 2
+    assert sub.get(1) == {'uid': 1, 'name': 'new', 'status': False}
+    assert sub.get(2) is None
+
+
+def test_async_failed_batch_is_written_again(cache, make_cache):
+    async def run():
+        async_cache = make_cache(AsyncFakeCache)
+        sub = async_cache.sub('users')
+        sub.write_batch = fail_once(sub.write_batch)
+        writer = sub.batch_writer(max_items=1000, max_delay_ms=20)
+        for uid in range(5):
+            await writer.set(uid, {'name': f'n{uid}', 'status': True})
+        await asyncio.sleep(0.2)
+        with pytest.raises(RedisConnectionError):
+            await writer.close()
+        count = await sub.count()
+        await async_cache.aclose()
+        return count, writer.flush_error_count
+
+    assert asyncio.run(run()) == (5, 1)
+
+
+def test_async_batch_writer(cache, make_cache):
+    async def run():
+        async_cache = make_cache(AsyncFakeCache)
+        sub = async_cache.sub('users')
+        async with sub.batch_writer(max_items=10, max_delay_ms=10000) as writer:
+            for uid in range(25):
+                await writer.set(uid, {'name': f'n{uid}', 'status': True})
+            await writer.unset(0)
+            assert not await writer.set(99, {'name': 1, 'status': True})
+        count = await sub.count()
+        await async_cache.aclose()
+        return count
+
+    assert asyncio.run(run()) == 24
+    assert cache.sub('users').get(24)['name'] == 'n24'
@@ -0,0 +1,51 @@
+""" Tests of the benchmark suite on its fakeredis backend """
+
+import json
+import os
+
+import benchmark
+
+OPERATIONS = ['set', 'get', 'get_many', 'get_all', 'set_many', 'unset_many', 'unset_all',
+              'delete_sub']
+
+
+def run(tmp_path, output: str, *args: str) -> dict:
+    assert benchmark.main(['--backend', 'fakeredis', '--rows', '20', '--cols', '3',
+                           '--value-sizes', '8', '--batch-size', '5',
+                           '--output', str(tmp_path / output), *args]) == 0
+    return json.loads((tmp_path / output).read_text(encoding='UTF-8'))
+
+
+def test_benchmark_results(tmp_path):
+    cwd = os.getcwd()
+    report = run(tmp_path, 'before.json')
+    assert os.getcwd() == cwd
+    assert report['meta']['backend'] == 'fakeredis'
+    results = {result['operation']: result for result in report['results']}
+    assert list(results) == OPERATIONS
+    assert results['get']['calls'] == 20
+    assert results['get_many']['calls'] == 4
+    assert results['get_many']['rows_per_call'] == 5
+    # fakeredis has no redis memory to report, the client memory is traced on every backend
+    assert all(result['bytes_per_row'] is None for result in results.values())
+    assert len({result['client_peak_kb'] for result in results.values()}) == 1
+    assert results['get_all']['client_peak_kb'] > 0
+
+
+def test_benchmark_compare(tmp_path, capsys):
+    run(tmp_path, 'before.json')
+    capsys.readouterr()
+    run(tmp_path, 'after.json', '--compare', str(tmp_path / 'before.json'))
+    lines = [line for line in capsys.readouterr().out.splitlines() if 'rows/s' in line]
+    assert [line.split()[0] for line in lines] == OPERATIONS
+
+
+def test_measure_counts_round_trips():
+    calls = []
+    with benchmark.RoundTrips.count():
+        result = benchmark.measure([lambda: calls.append(1)] * 4, 10,
+                                   setup=lambda: calls.append(0))
+    assert calls == [0, 1] * 4
+    assert result['calls'] == 4
+    assert result['rows_per_call'] == 10
+    assert result['round_trips_per_call'] == 0
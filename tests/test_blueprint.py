@@ -0,0 +1,79 @@
+""" Tests of the versioned blueprint in redis and the memoised Sub objects """
+
+import asyncio
+
+import pytest
+
+from conftest import PASSPHRASE, AsyncFakeCache
+
+SUB_ATTR = {'uid': 'INTEGER', 'name': 'TEXT'}
+
+
+def test_sub_objects_are_memoised(cache):
+    sub = cache.sub('users')
+    assert cache.sub('users') is sub
+    cache.setup_loader('users')
+    assert cache.sub('users') is not sub
+    with pytest.raises(NameError):
+        cache.sub('unknown')
+
+
+def test_file_blueprint(cache, make_cache, tmp_path):
+    assert (tmp_path / 'test_cache_blueprint.json').exists()
+    assert make_cache().is_sub_exists('users')
+
+
+def test_redis_blueprint_is_shared(make_cache):
+    first = make_cache(blueprint_storage='redis', blueprint_refresh=None)
+    second = make_cache(blueprint_storage='redis', blueprint_refresh=None)
+    assert first.create_sub('users', SUB_ATTR, passphrase=PASSPHRASE)
+    assert not second.is_sub_exists('users')
+    assert second.refresh_blueprint()
+    assert second.is_sub_exists('users')
+    assert not second.refresh_blueprint()
+    assert first.blueprint_version == second.blueprint_version == 1
+
+
+def test_stale_blueprints_are_not_saved(make_cache):
+    first = make_cache(blueprint_storage='redis', blueprint_refresh=None)
+    second = make_cache(blueprint_storage='redis', blueprint_refresh=None)
+    assert first.create_sub('users', SUB_ATTR, passphrase=PASSPHRASE)
+    assert not second.create_sub('events', SUB_ATTR, passphrase=PASSPHRASE)
+    assert not second.is_sub_exists('events')
+    second.refresh_blueprint()
+    assert second.create_sub('events', SUB_ATTR, passphrase=PASSPHRASE)
+    assert first.refresh_blueprint()
+    assert first.is_sub_exists('events') and first.is_sub_exists('users')
+
+
+def test_sub_refreshes_the_blueprint(make_cache):
+    first = make_cache(blueprint_storage='redis', blueprint_refresh=None)
+    second = make_cache(blueprint_storage='redis', blueprint_refresh=0)
+    first.create_sub('users', SUB_ATTR, passphrase=PASSPHRASE)
+    first.sub('users').set(1, {'name': 'a'})
+    assert second.sub('users').get(1) == {'uid': 1, 'name': 'a'}
+    assert first.delete_sub('users', PASSPHRASE)
+    with pytest.raises(NameError):
+        second.sub('users')
+
+
+def test_async_cache_refreshes_off_the_event_loop(make_cache):
+    first = make_cache(blueprint_storage='redis', blueprint_refresh=None)
+    first.create_sub('users', SUB_ATTR, passphrase=PASSPHRASE)
+
+    async def run():
+        async_cache = make_cache(AsyncFakeCache, blueprint_storage='redis', blueprint_refresh=0)
+        sub = async_cache.sub('users')
+        first.create_sub('events', SUB_ATTR, passphrase=PASSPHRASE)
+        # The due check is scheduled, the current blueprint is used until it is read
+        assert async_cache.sub('users') is sub
+        assert async_cache.blueprint_task is not None
+        assert not async_cache.is_sub_exists('events')
+        await async_cache.blueprint_task
+        assert async_cache.is_sub_exists('events')
+        first.create_sub('logs', SUB_ATTR, passphrase=PASSPHRASE)
+        assert await async_cache.refresh_blueprint()
+        assert async_cache.is_sub_exists('logs')
+        await async_cache.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,114 @@
+""" Tests of the NDJSON and CSV import and export """
+
+import asyncio
+import io
+import json
+
+import pytest
+
+from conftest import AsyncFakeCache
+
+NDJSON = '\n'.join([
+    '{"uid": 1, "name": "a", "status": true}',
+    '{"uid": 2, "name": "b", "status": false}',
+    'not json',
+    '',
+    '{"uid": "x", "name": "c", "status": true}',
+    '{"uid": 4, "name": 4, "status": "yes"}',
+    '[1, 2]',
+    '{"uid": "5", "name": "e", "status": true}',
+]) + '\n'
+CSV = 'uid,name,status\n1,a,true\n2,b,false\n3,c\n,d,true\nx,e,true\n6,f,no\n'
+
+
+def test_import_ndjson_reports_every_rejected_row(cache, tmp_path):
+    path = tmp_path / 'users.ndjson'
+    path.write_text(NDJSON, encoding='UTF-8')
+    errors, progress = [], []
+    sub = cache.sub('users')
+    report = sub.import_from(path, chunk_size=2,
+                             on_error=lambda record, invalid_cols: errors.append(
+                                 (record, invalid_cols)),
+                             on_progress=lambda report: progress.append(report['rows']))
+    assert report['rows'] == 3
+    assert report['rejected'] == 4
+    assert errors == [(3, []), (4, ['uid']), (5, ['name', 'status']), (6, [])]
+    assert progress == [2]
+    assert sub.get(5) == {'uid': 5, 'name': 'e', 'status': True}
+    assert sub.count() == 3
+
+
+def test_import_csv_stream(cache):
+    errors = []
+    sub = cache.sub('users')
+    report = sub.import_from(io.BytesIO(CSV.encode('utf-8')), 'csv',
+                             on_error=lambda record, invalid_cols: errors.append(record))
+    assert (report['rows'], report['rejected']) == (3, 3)
+    assert errors == [3, 4, 5]
+    assert [row['status'] for row in sub.get_many([1, 2, 6])] == [True, False, False]
+
+
+def test_import_with_ttl(cache):
+    sub = cache.sub('users')
+    sub.import_from(io.StringIO('{"uid": 1, "name": "a", "status": true}\n'), ttl=30)
+    assert sub.ttl(1) == 30
+
+
+def test_import_empty_file(cache, tmp_path):
+    path = tmp_path / 'empty.ndjson'
+    path.write_bytes(b'')
+    assert cache.sub('users').import_from(path)['rows'] == 0
+
+
+def test_unknown_format(cache):
+    with pytest.raises(ValueError):
+        cache.sub('users').import_from(io.StringIO(''), 'xml')
+    with pytest.raises(ValueError):
+        cache.sub('users').export_to(io.StringIO(), 'xml')
+
+
+@pytest.mark.parametrize('format_', ['ndjson', 'csv'])
+def test_export_then_import(cache, tmp_path, format_):
+    sub = cache.sub('users')
+    sub.set_many({uid: {'name': f'n,{uid}', 'status': uid % 2 == 0} for uid in range(25)})
+    path = tmp_path / f'users.{format_}'
+    progress = []
+    report = sub.export_to(path, format_, batch_size=10,
+                           on_progress=lambda report: progress.append(report['rows']))
+    assert report['rows'] == 25
+    assert progress == [10, 20]
+
+    sub.unset_all()
+    assert sub.import_from(path, format_)['rows'] == 25
+    assert sub.get(3) == {'uid': 3, 'name': 'n,3', 'status': False}
+
+
+def test_export_fields(cache):
+    sub = cache.sub('users')
+    sub.set(1, {'name': 'a', 'status': True})
+    stream = io.StringIO()
+    sub.export_to(stream, fields=['name'])
+    assert [json.loads(line) for line in stream.getvalue().splitlines()] == [{'name': 'a'}]
+
+
+def test_async_import_and_export(cache, make_cache, tmp_path):
+    path = tmp_path / 'users.ndjson'
+    path.write_text(NDJSON, encoding='UTF-8')
+    errors = []
+
+    async def run():
+        async_cache = make_cache(AsyncFakeCache)
+        sub = async_cache.sub('users')
+        imported = await sub.import_from(path, chunk_size=2,
+                                         on_error=lambda record, invalid_cols: errors.append(
+                                             record))
+        exported = await sub.export_to(tmp_path / 'out.csv', 'csv', batch_size=2)
+        await async_cache.aclose()
+        return imported, exported
+
+    imported, exported = asyncio.run(run())
+    assert (imported['rows'], imported['rejected']) == (3, 4)
+    assert errors == [3, 4, 5, 6]
+    assert exported['rows'] == 3
+    assert (tmp_path / 'out.csv').read_text(encoding='UTF-8').splitlines() == \
+        ['uid,name,status', '1,a,true', '2,b,false', '5,e,true']
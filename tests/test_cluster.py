@@ -0,0 +1,95 @@
+""" Tests of the hash-tagged key layout and the slot-grouped batches """
+
+import fakeredis
+import pytest
+from redis.cluster import key_slot
+
+from conftest import PASSPHRASE
+from querybuilder.querybuilder import QueryBuilder
+from querybuilder.schema import Schema
+
+SUB_ATTR = {'uid': 'INTEGER', 'name': 'TEXT'}
+NODES = [('127.0.0.1', 7001), ('127.0.0.1', 7002)]
+
+
+def make_query_builder(sub_options: dict | None = None) -> QueryBuilder:
+    redis = fakeredis.FakeRedis()
+    return QueryBuilder(redis, 'test_cache', 'users', SUB_ATTR, Schema(SUB_ATTR, sub_options),
+                        node_client=lambda key: redis)
+
+
+def test_group_by_slot():
+    query_builder = make_query_builder()
+    complete_keys = [query_builder.get_complete_key(uid) for uid in range(50)]
+    groups = query_builder.group_by_slot(complete_keys, chunk_size=3)
+    assert sorted(key for group in groups for key in group) == sorted(complete_keys)
+    for group in groups:
+        assert len(group) <= 3
+        assert len({key_slot(key.encode('utf-8')) for key in group}) == 1
+
+
+def test_hash_tagged_keys_share_one_slot():
+    query_builder = make_query_builder({'is_hash_tagged': True})
+    assert not query_builder.is_cluster
+    assert query_builder.get_complete_key(1) == '{test_cache/users}/1'
+    complete_keys = [query_builder.get_complete_key(uid) for uid in range(50)]
+    assert query_builder.group_by_slot(complete_keys, chunk_size=20) == \
+        [complete_keys[:20], complete_keys[20:40], complete_keys[40:]]
+    keys = [*complete_keys, query_builder.index_rows_key, query_builder.registry_key]
+    assert len({key_slot(key.encode('utf-8')) for key in keys}) == 1
+
+
+class EvalRecorder:
+    """ Records the scripts queued into a pipeline """
+
+    def __init__(self):
+        self.calls = []
+
+    def execute_command(self, *args) -> None:
+        self.calls.append(args)
+
+
+def test_scripts_declare_their_keys():
+    query_builder = make_query_builder({'is_hash_tagged': True, 'indexes': ['name'],
+                                        'is_registered': True})
+    complete_keys = [query_builder.get_complete_key(uid) for uid in range(5)]
+    pipe = EvalRecorder()
+    query_builder.queue_index(pipe, complete_keys, 'set', [{'name': 'n'}] * 5, chunk_size=2)
+    query_builder.queue_index(pipe, complete_keys, 'prune')
+    query_builder.queue_register(pipe, complete_keys, 'prune')
+    query_builder.queue_expire(pipe, complete_keys)
+    assert len(pipe.calls) == 6
+    declared_keys = []
+    for _, _, numkeys, *args in pipe.calls:
+        declared_keys.extend(args[:numkeys])
+        # The index keys are built from the index key prefix passed in ARGV
+        args = [arg for arg in args[numkeys:] if str(arg).startswith(query_builder.index_prefix)]
+        declared_keys.extend(f'{arg}name/"n"' for arg in args)
+    assert set(complete_keys) <= set(declared_keys)
+    assert len({key_slot(key.encode('utf-8')) for key in declared_keys}) == 1
+
+
+def test_hash_tagged_sub(make_cache, fake_servers):
+    cache = make_cache(nodes=NODES)
+    cache.create_sub('tagged', SUB_ATTR, passphrase=PASSPHRASE, indexes=['name'],
+                     is_registered=True, is_hash_tagged=True)
+    sub = cache.sub('tagged')
+    assert sub.set_many({uid: {'name': f'n{uid % 2}'} for uid in range(20)})
+    assert [row['uid'] for row in sub.find(name='n1')] == sorted(range(1, 20, 2), key=str)
+    assert [row['uid'] for row in sub.page(limit=3)] == [0, 1, 2]
+    assert sub.count() == 20
+    # Every row, index and registry key of the sub is kept on one node
+    key_counts = [len(fakeredis.FakeRedis(server=fake_servers[node]).keys('*{test_cache/tagged}*'))
+                  for node in [('127.0.0.1', 6379), *NODES]]
+    assert sorted(key_counts)[:2] == [0, 0]
+    assert max(key_counts) > 20
+
+
+def test_spread_subs_need_a_hash_tag(make_cache):
+    cache = make_cache(nodes=NODES)
+    with pytest.raises(ValueError):
+        cache.create_sub('spread', SUB_ATTR, passphrase=PASSPHRASE, indexes=['name'])
+    with pytest.raises(ValueError):
+        cache.create_sub('spread', SUB_ATTR, passphrase=PASSPHRASE, is_registered=True)
+    assert cache.create_sub('spread', SUB_ATTR, passphrase=PASSPHRASE)
+    assert not cache.sub('spread').query_builder.schema.is_registered
@@ -0,0 +1,50 @@
+""" Tests of the value codecs and the positional encoding """
+
+import json
+
+import pytest
+
+from conftest import PASSPHRASE
+from querybuilder import codec
+from querybuilder.codec import get_codec
+
+ROWS = {1: {'name': 'a', 'score': 1.5, 'status': True},
+        2: {'name': 'b', 'score': 2.0, 'status': False}}
+COL_NAMES = ('uid', 'name', 'score', 'status')
+
+
+@pytest.mark.parametrize('is_positional', [False, True], ids=['named', 'positional'])
+@pytest.mark.parametrize('codec_name', ['json', 'orjson', 'msgpack'])
+def test_codec_round_trip(cache, codec_name, is_positional):
+    if codec.CODECS[codec_name][1] is None:
+        pytest.skip(f'{codec_name} is not installed')
+    cache.create_sub('scores', {'uid': 'INTEGER', 'name': 'TEXT', 'score': 'REAL',
+                                'status': 'BOOLEAN'},
+                     passphrase=PASSPHRASE, codec=codec_name, is_positional=is_positional)
+    sub = cache.sub('scores')
+    assert sub.set_many(ROWS)
+    assert sub.get(1) == {'uid': 1, **ROWS[1]}
+    assert sub.get_many([2, 3]) == [{'uid': 2, **ROWS[2]}, None]
+    assert sub.get(1, fields=['score']) == {'score': 1.5}
+
+
+def test_positional_values_leave_the_key_out():
+    encoded = get_codec('json', COL_NAMES, is_positional=True).encode({'uid': 1, **ROWS[1]})
+    assert json.loads(encoded) == ['a', 1.5, True]
+    assert get_codec('json', COL_NAMES, is_positional=True).decode(encoded, 1) == \
+        {'uid': 1, **ROWS[1]}
+
+
+def test_unknown_codec(cache):
+    with pytest.raises(ValueError):
+        get_codec('pickle', COL_NAMES)
+    with pytest.raises(ValueError):
+        cache.create_sub('scores', {'uid': 'INTEGER', 'name': 'TEXT'}, passphrase=PASSPHRASE,
+                         codec='pickle')
+    assert not cache.is_sub_exists('scores')
+
+
+def test_codec_not_installed(monkeypatch):
+    monkeypatch.setitem(codec.CODECS, 'msgpack', (codec.MsgpackCodec, None))
+    with pytest.raises(ValueError, match='not installed'):
+        get_codec('msgpack', COL_NAMES)
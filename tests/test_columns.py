@@ -0,0 +1,60 @@
+""" Tests of the columnar result format of get_many and get_all """
+
+import pytest
+
+from conftest import PASSPHRASE
+from querybuilder.columns import ColumnBuilder
+from querybuilder.schema import Schema
+
+numpy = pytest.importorskip('numpy')
+
+SUB_ATTR = {'uid': 'INTEGER', 'name': 'TEXT', 'score': 'REAL', 'status': 'BOOLEAN'}
+ROWS = {1: {'name': 'a', 'score': 1.5, 'status': True},
+        2: {'name': 'b', 'score': 2.5, 'status': False}}
+
+
+@pytest.fixture(params=[{}, {'is_positional': True}, {'storage': 'hash'}],
+                ids=['json', 'positional', 'hash'])
+def sub(cache, request):
+    cache.create_sub('scores', SUB_ATTR, passphrase=PASSPHRASE, **request.param)
+    sub = cache.sub('scores')
+    sub.set_many(ROWS)
+    return sub
+
+
+def test_get_many_columns(sub):
+    result = sub.get_many([1, 404, 2], format_='columns')
+    columns = result['columns']
+    assert list(columns) == ['uid', 'name', 'score', 'status']
+    assert columns['uid'].dtype == numpy.int64
+    assert columns['score'].dtype == numpy.float64
+    assert columns['status'].dtype == numpy.bool_
+    assert columns['uid'].tolist() == [1, None, 2]
+    assert columns['score'].tolist() == [1.5, None, 2.5]
+    assert result['missing'].tolist() == [False, True, False]
+    assert columns['score'].mean() == 2.0
+
+
+def test_get_many_columns_fields(sub):
+    result = sub.get_many([2, 1], fields=['status', 'uid'], format_='columns')
+    assert list(result['columns']) == ['status', 'uid']
+    assert result['columns']['status'].tolist() == [False, True]
+    assert result['columns']['uid'].tolist() == [2, 1]
+
+
+def test_get_all_columns(sub):
+    result = sub.get_all(batch_size=1, format_='columns')
+    assert sorted(result['columns']['name'].tolist()) == ['a', 'b']
+    assert not result['missing'].any()
+
+
+def test_columns_without_numpy():
+    builder = ColumnBuilder(Schema(SUB_ATTR), ['name', 'score'], is_numpy=False)
+    builder.add_rows([{'uid': 1, **ROWS[1]}, None])
+    assert builder.build() == {'columns': {'name': ['a', None], 'score': [1.5, None]},
+                               'missing': [False, True]}
+
+
+def test_unknown_result_format(sub):
+    with pytest.raises(ValueError):
+        sub.get_many([1], format_='frame')
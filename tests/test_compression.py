@@ -0,0 +1,67 @@
+""" Tests of the value compression above a size threshold """
+
+import pytest
+
+from conftest import PASSPHRASE
+from querybuilder import compression
+from querybuilder.compression import Compressor, compress, decompress, get_compressor
+
+LONG_TEXT = 'abc' * 400
+
+
+@pytest.mark.parametrize('compression_name', ['zlib', 'lzma', 'lz4', 'zstd'])
+def test_compress_round_trip(compression_name):
+    if compression.COMPRESSORS[compression_name][1] is None:
+        pytest.skip(f'{compression_name} is not installed')
+    compressor = get_compressor(compression_name)
+    data = LONG_TEXT.encode('utf-8')
+    compressed = compress(compressor, data, min_size=100)
+    assert compressed[0] == compressor.header
+    assert len(compressed) < len(data)
+    assert decompress(compressed) == data
+
+
+def test_small_or_incompressible_data_is_kept():
+    assert compress(Compressor(), 'abc' * 10, min_size=100) == 'abc' * 10
+    data = bytes(range(256))
+    assert compress(Compressor(), data) == data
+    assert decompress(data) == data
+
+
+@pytest.mark.parametrize('storage', ['string', 'hash'])
+def test_compressed_sub(cache, storage):
+    cache.create_sub('docs', {'did': 'INTEGER', 'body': 'TEXT'}, passphrase=PASSPHRASE,
+                     storage=storage, compression='zlib', compression_min_size=256)
+    sub = cache.sub('docs')
+    sub.set_many({1: {'body': LONG_TEXT}, 2: {'body': 'short'}})
+    assert [row['body'] for row in sub.get_many([1, 2])] == [LONG_TEXT, 'short']
+    assert sub.update(2, {'body': LONG_TEXT})
+    assert sub.get(2) == {'did': 2, 'body': LONG_TEXT}
+    if storage == 'string':
+        raw = sub.query_builder.redis.get(sub.get_complete_key(1))
+        assert raw[0] == Compressor.header
+        assert len(raw) < len(LONG_TEXT)
+
+
+def test_set_compression_keeps_the_old_rows_readable(cache):
+    sub = cache.sub('users')
+    sub.set(1, {'name': LONG_TEXT, 'status': True})
+    assert cache.set_compression('users', 'lzma', 100, PASSPHRASE)
+    sub = cache.sub('users')
+    sub.set(2, {'name': LONG_TEXT, 'status': True})
+    assert cache.set_compression('users', None, passphrase=PASSPHRASE)
+    rows = cache.sub('users').get_many([1, 2])
+    assert [row['name'] for row in rows] == [LONG_TEXT, LONG_TEXT]
+
+
+def test_missing_compressor_raises(cache, monkeypatch):
+    with pytest.raises(ValueError):
+        get_compressor('brotli')
+    monkeypatch.setitem(compression.COMPRESSORS, 'zstd', (compression.ZstdCompressor, None))
+    with pytest.raises(ValueError, match='not installed'):
+        cache.create_sub('docs', {'did': 'INTEGER', 'body': 'TEXT'}, passphrase=PASSPHRASE,
+                         compression='zstd')
+    assert not cache.is_sub_exists('docs')
+    monkeypatch.setitem(compression.HEADERS, Compressor.header, (Compressor, None))
+    with pytest.raises(ValueError, match='not installed'):
+        decompress(compress(Compressor(), LONG_TEXT.encode('utf-8')))
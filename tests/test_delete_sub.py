@@ -0,0 +1,48 @@
+""" Tests of delete_sub, removing the blueprint then the rows with batched UNLINK """
+
+import pytest
+
+from conftest import PASSPHRASE
+
+
+@pytest.fixture
+def filled_cache(cache):
+    cache.create_sub('events', {'eid': 'INTEGER', 'kind': 'TEXT'}, passphrase=PASSPHRASE,
+                     indexes=['kind'])
+    cache.sub('events').set_many({eid: {'kind': f'k{eid % 3}'} for eid in range(120)})
+    cache.sub('users').set(1, {'name': 'a', 'status': True})
+    return cache
+
+
+def get_event_keys(cache) -> list:
+    return [key for pattern in cache.get_key_patterns()
+            for key in cache.redis.scan_iter(match=pattern) if b'/events' in key]
+
+
+def test_delete_sub_removes_rows_and_indexes(filled_cache):
+    progress = []
+    assert get_event_keys(filled_cache)
+    assert filled_cache.delete_sub('events', PASSPHRASE, batch_size=50,
+                                   on_progress=lambda sub_name, removed: progress.append(removed))
+    assert not filled_cache.is_sub_exists('events')
+    assert get_event_keys(filled_cache) == []
+    assert progress == [50, 100, 120]
+    assert filled_cache.sub('users').get(1) is not None
+
+
+def test_delete_sub_in_background(filled_cache):
+    assert filled_cache.delete_sub('events', PASSPHRASE, batch_size=16, is_background=True)
+    assert not filled_cache.is_sub_exists('events')
+    filled_cache.teardowns['events'].join()
+    assert not filled_cache.is_sub_deleting('events')
+    assert get_event_keys(filled_cache) == []
+
+
+def test_delete_sub_checks_the_passphrase(filled_cache):
+    with pytest.raises(ValueError):
+        filled_cache.delete_sub('events')
+    with pytest.raises(ValueError):
+        filled_cache.delete_sub('events', 'wrong')
+    with pytest.raises(KeyError):
+        filled_cache.delete_sub('unknown', PASSPHRASE)
+    assert filled_cache.sub('events').count() == 120
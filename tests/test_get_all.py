@@ -0,0 +1,49 @@
+""" Tests of get_all, iter_all and unset_all over many SCAN pages or registry pages """
+
+import pytest
+
+from conftest import PASSPHRASE
+
+
+@pytest.fixture(params=[True, False], ids=['registered', 'scanned'])
+def sub(cache, request):
+    cache.create_sub('events', {'eid': 'INTEGER', 'kind': 'TEXT'}, passphrase=PASSPHRASE,
+                     is_registered=request.param)
+    sub = cache.sub('events')
+    sub.set_many({eid: {'kind': f'k{eid % 3}'} for eid in range(250)})
+    # The rows of another sub are never returned
+    cache.sub('users').set(1, {'name': 'a', 'status': True})
+    return sub
+
+
+def test_get_all_follows_every_page(sub):
+    rows = sub.get_all(batch_size=16)
+    assert sorted(row['eid'] for row in rows) == list(range(250))
+    assert rows[0].keys() == {'eid', 'kind'}
+
+
+def test_iter_complete_keys_batches(sub):
+    batches = list(sub.iter_complete_keys(batch_size=100))
+    assert all(len(complete_keys) <= 100 for complete_keys in batches)
+    assert sum(len(complete_keys) for complete_keys in batches) == 250
+
+
+def test_iter_all_fields(sub):
+    assert {row['kind'] for row in sub.iter_all(batch_size=50, fields=['kind'])} == \
+        {'k0', 'k1', 'k2'}
+
+
+def test_get_all_skips_rows_removed_behind_the_sub(sub):
+    sub.query_builder.redis.delete(sub.get_complete_key(7))
+    assert len(sub.get_all(batch_size=32)) == 249
+
+
+def test_unset_all(sub, cache):
+    assert sub.unset_all(batch_size=40) == 250
+    assert sub.get_all() == []
+    assert cache.sub('users').get(1) is not None
+
+
+def test_unset_all_with_unlink(sub):
+    assert sub.unset_all(batch_size=64, is_unlink=True) == 250
+    assert sub.get_all(batch_size=64) == []
@@ -0,0 +1,121 @@
+""" Tests of the cache-aside get_or_load with recompute locks and early refresh """
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import AsyncFakeCache
+
+
+class Loader:
+    """ Counts its calls, and takes delay seconds per call """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, uid: int) -> dict | None:
+        self.calls.append(uid)
+        time.sleep(self.delay)
+        return {'name': f'loaded{uid}', 'status': True} if uid < 100 else None
+
+
+def test_get_or_load(cache):
+    sub = cache.sub('users')
+    loader = Loader()
+    assert sub.get_or_load(1, loader) == {'uid': 1, 'name': 'loaded1', 'status': True}
+    assert sub.get_or_load(1, loader, fields=['name']) == {'name': 'loaded1'}
+    assert loader.calls == [1]
+    assert sub.get(1) is not None
+    assert sub.get_or_load(100, loader) is None
+    assert sub.get(100) is None
+    assert not sub.query_builder.redis.keys('__lock__/*')
+
+
+def test_only_one_worker_loads_a_key(cache):
+    sub = cache.sub('users')
+    loader = Loader(delay=0.1)
+    with ThreadPoolExecutor(10) as executor:
+        results = list(executor.map(lambda _: sub.get_or_load(7, loader), range(10)))
+    assert loader.calls == [7]
+    assert all(result == {'uid': 7, 'name': 'loaded7', 'status': True} for result in results)
+
+
+def test_waits_for_the_lock_holder(cache):
+    sub = cache.sub('users')
+    complete_key = sub.get_complete_key(3)
+    sub.query_builder.redis.set(f'__lock__/{complete_key}', 'other', px=5000)
+    loader = Loader()
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(sub.get_or_load, 3, loader)
+        time.sleep(0.05)
+        sub.set(3, {'name': 'from other worker', 'status': False})
+        assert future.result()['name'] == 'from other worker'
+    assert loader.calls == []
+
+
+def test_loads_anyway_after_wait_ms(cache):
+    sub = cache.sub('users')
+    sub.query_builder.redis.set(f'__lock__/{sub.get_complete_key(3)}', 'other', px=5000)
+    loader = Loader()
+    assert sub.get_or_load(3, loader, wait_ms=30)['name'] == 'loaded3'
+    assert loader.calls == [3]
+
+
+def test_a_failed_loader_releases_the_lock(cache):
+    def fail(uid):
+        raise RuntimeError('source down')
+
+    sub = cache.sub('users')
+    with pytest.raises(RuntimeError):
+        sub.get_or_load(1, fail)
+    assert not sub.query_builder.redis.keys('__lock__/*')
+    with pytest.raises(ValueError):
+        sub.get_or_load(1, lambda uid: {'name': 1, 'status': True})
+
+
+def test_early_refresh(cache):
+    sub = cache.sub('users')
+    sub.get_or_load(1, Loader(delay=0.02), ttl=100)
+    assert sub.get_or_load(1, Loader(), beta=0)['name'] == 'loaded1'
+    loader = Loader()
+    sub.get_or_load(1, loader, ttl=100, beta=1e9)
+    assert loader.calls == [1]
+
+
+def test_get_many_or_load(cache):
+    sub = cache.sub('users')
+    sub.set(2, {'name': 'cached', 'status': False})
+    calls = []
+
+    def batch_loader(uids):
+        calls.append(uids)
+        return {uid: {'name': f'loaded{uid}', 'status': True} for uid in uids if uid != 4}
+
+    rows = sub.get_many_or_load([1, 2, 3, 4, 1], batch_loader)
+    assert [row and row['name'] for row in rows] == ['loaded1', 'cached', 'loaded3', None,
+                                                     'loaded1']
+    assert calls == [[1, 3, 4]]
+    assert sub.get(4) is None
+
+
+def test_async_get_or_load(cache, make_cache):
+    calls = []
+
+    async def loader(uid):
+        calls.append(uid)
+        await asyncio.sleep(0.05)
+        return {'name': f'loaded{uid}', 'status': True}
+
+    async def run():
+        async_cache = make_cache(AsyncFakeCache)
+        sub = async_cache.sub('users')
+        results = await asyncio.gather(*(sub.get_or_load(5, loader) for _ in range(10)))
+        await async_cache.aclose()
+        return results
+
+    assert {result['name'] for result in asyncio.run(run())} == {'loaded5'}
+    assert calls == [5]
+    assert cache.sub('users').get(5)['name'] == 'loaded5'
@@ -0,0 +1,44 @@
+""" Tests of the hash storage mode, field projections and partial updates """
+
+import pytest
+
+from conftest import PASSPHRASE
+
+
+@pytest.fixture(params=['string', 'hash'])
+def sub(cache, request):
+    cache.create_sub('profiles', {'uid': 'INTEGER', 'name': 'TEXT', 'age': 'INTEGER',
+                                  'status': 'BOOLEAN'},
+                     passphrase=PASSPHRASE, storage=request.param)
+    sub = cache.sub('profiles')
+    sub.set_many({1: {'name': 'a', 'age': 30, 'status': True},
+                  2: {'name': 'b', 'age': 40, 'status': False}})
+    return sub
+
+
+def test_hash_rows_are_redis_hashes(sub):
+    key_type = sub.query_builder.redis.type(sub.get_complete_key(1))
+    assert key_type == (b'hash' if sub.query_builder.schema.is_hash else b'string')
+
+
+def test_field_projection(sub):
+    assert sub.get(1, fields=['age', 'name']) == {'age': 30, 'name': 'a'}
+    assert sub.get_many([1, 2, 3], fields=['status']) == [{'status': True}, {'status': False},
+                                                           None]
+    assert sorted(row['age'] for row in sub.get_all(fields=['age'])) == [30, 40]
+
+
+def test_update(sub):
+    assert sub.update(1, {'age': 31})
+    assert sub.get(1) == {'uid': 1, 'name': 'a', 'age': 31, 'status': True}
+    assert not sub.update(3, {'age': 31})
+    assert sub.get(3) is None
+    assert not sub.update(1, {'age': 'old'})
+    assert not sub.update(1, {'uid': 5})
+    assert sub.get(1)['age'] == 31
+
+
+def test_unknown_storage(cache):
+    with pytest.raises(ValueError):
+        cache.create_sub('profiles', {'uid': 'INTEGER', 'name': 'TEXT'}, passphrase=PASSPHRASE,
+                         storage='list')
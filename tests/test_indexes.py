@@ -0,0 +1,69 @@
+""" Tests of the secondary indexes, find and range """
+
+import pytest
+
+from conftest import PASSPHRASE
+
+ROWS = {1: {'city': 'x', 'age': 30, 'score': 1.5, 'status': True},
+        2: {'city': 'y', 'age': 25, 'score': 3.0, 'status': True},
+        3: {'city': 'x', 'age': 41, 'score': -2.0, 'status': False},
+        4: {'city': 'x', 'age': 30, 'score': 0.5, 'status': True}}
+
+
+@pytest.fixture(params=['string', 'hash'])
+def sub(cache, request):
+    cache.create_sub('people', {'pid': 'INTEGER', 'city': 'TEXT', 'age': 'INTEGER',
+                                'score': 'REAL', 'status': 'BOOLEAN'},
+                     passphrase=PASSPHRASE, storage=request.param,
+                     indexes=['city', 'age', 'score', 'status'])
+    sub = cache.sub('people')
+    sub.set_many(ROWS)
+    return sub
+
+
+def get_pids(rows: list[dict]) -> list[int]:
+    return [row['pid'] for row in rows]
+
+
+def test_find(sub):
+    assert get_pids(sub.find(city='x')) == [1, 3, 4]
+    assert get_pids(sub.find(city='x', status=True)) == [1, 4]
+    assert get_pids(sub.find(city='x', status=True, limit=1)) == [1]
+    assert sub.find(city='z') == []
+    assert sub.find(city='y', fields=['age']) == [{'age': 25}]
+
+
+@pytest.mark.parametrize('conditions', [{}, {'unknown': 1}, {'city': None}])
+def test_find_invalid_conditions(sub, conditions):
+    with pytest.raises(ValueError):
+        sub.find(**conditions)
+
+
+def test_range(sub):
+    assert get_pids(sub.range('age', 26, 41)) == [1, 4, 3]
+    assert get_pids(sub.range('age', high=30, is_desc=True)) == [4, 1, 2]
+    assert get_pids(sub.range('score', low=0.0, limit=2)) == [4, 1]
+    with pytest.raises(ValueError):
+        sub.range('city', 'a', 'z')
+
+
+def test_writes_keep_the_indexes(sub):
+    sub.set(1, {'city': 'y', 'age': 50, 'score': 1.5, 'status': False})
+    sub.update(4, {'city': 'y'})
+    sub.unset(2)
+    assert get_pids(sub.find(city='x')) == [3]
+    assert get_pids(sub.find(city='y')) == [1, 4]
+    assert get_pids(sub.range('age', 45)) == [1]
+
+
+def test_expired_rows_are_pruned(sub):
+    sub.query_builder.redis.delete(sub.get_complete_key(3))
+    assert get_pids(sub.find(city='x')) == [1, 4]
+    assert get_pids(sub.range('age', 40)) == []
+
+
+def test_drop_indexes(sub):
+    assert sub.drop_indexes() > 0
+    assert list(sub.query_builder.redis.scan_iter(match=f'{sub.query_builder.index_prefix}*')) \
+        == []
+    assert sub.get(1) is not None
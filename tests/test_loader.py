@@ -0,0 +1,97 @@
+""" Tests of the request coalescing loader of get """
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import AsyncFakeCache
+from querybuilder.loader import AsyncGetLoader, GetLoader
+
+
+@pytest.fixture
+def rows(cache):
+    cache.sub('users').set_many({uid: {'name': f'n{uid}', 'status': True} for uid in range(20)})
+    return cache
+
+
+def test_concurrent_gets_are_coalesced(rows):
+    loader = rows.setup_loader('users', window_ms=50)
+    sub = rows.sub('users')
+    keys = [uid % 25 for uid in range(40)]
+    with ThreadPoolExecutor(40) as executor:
+        results = list(executor.map(sub.get, keys))
+    assert [row and row['uid'] for row in results] == [uid if uid < 20 else None for uid in keys]
+    stats = loader.stats()
+    assert stats['calls'] == 40
+    assert stats['batches'] < 40
+    assert stats['coalesced'] > 0
+
+
+def test_waiters_get_their_own_copy():
+    loader = GetLoader(window_ms=50)
+    with ThreadPoolExecutor(2) as executor:
+        futures = [executor.submit(loader.load, 'k', lambda keys: [{'uid': 1}]) for _ in range(2)]
+        first, second = [future.result() for future in futures]
+    first['uid'] = 2
+    assert second == {'uid': 1}
+    assert loader.stats()['batches'] == 1
+
+
+def test_a_failed_read_fails_every_waiter_and_is_not_kept():
+    def fail(complete_keys):
+        raise ConnectionError('down')
+
+    loader = GetLoader(window_ms=20)
+    with ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(loader.load, key, fail) for key in ('a', 'b', 'a')]
+        for future in futures:
+            with pytest.raises(ConnectionError):
+                future.result()
+    assert loader.load('a', lambda keys: [{'key': 'a'}]) == {'key': 'a'}
+
+
+def test_writes_are_not_coalesced_into_older_reads(rows):
+    rows.setup_loader('users')
+    sub = rows.sub('users')
+    assert sub.get(1)['name'] == 'n1'
+    sub.set(1, {'name': 'new', 'status': True})
+    assert sub.get(1)['name'] == 'new'
+    rows.remove_loader('users')
+    assert sub.query_builder.loader is not None
+    assert rows.sub('users').query_builder.loader is None
+
+
+def test_async_gets_are_coalesced(rows, make_cache):
+    async def run():
+        async_cache = make_cache(AsyncFakeCache)
+        loader = async_cache.setup_loader('users', window_ms=5)
+        sub = async_cache.sub('users')
+        results = await asyncio.gather(*(sub.get(uid % 25) for uid in range(50)))
+        await async_cache.aclose()
+        return loader, results
+
+    loader, results = asyncio.run(run())
+    assert isinstance(loader, AsyncGetLoader)
+    assert [row and row['uid'] for row in results] == \
+        [uid % 25 if uid % 25 < 20 else None for uid in range(50)]
+    assert loader.stats()['batches'] == 1
+
+
+def test_async_waiters_outlive_a_cancelled_leader():
+    async def fetch_many(complete_keys):
+        await asyncio.sleep(0.01)
+        return [{'key': complete_key} for complete_key in complete_keys]
+
+    async def run():
+        loader = AsyncGetLoader(window_ms=20)
+        leader = asyncio.create_task(loader.load('a', fetch_many))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(loader.load(key, fetch_many)) for key in ('a', 'b')]
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.wait_for(asyncio.gather(*waiters), 1)
+
+    assert asyncio.run(run()) == [{'key': 'a'}, {'key': 'b'}]
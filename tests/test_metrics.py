@@ -0,0 +1,94 @@
+""" Tests of the operation metrics, hooks and Prometheus export """
+
+import asyncio
+
+import pytest
+
+from conftest import AsyncFakeCache
+from querybuilder.metered import MeteredSub
+from querybuilder.metrics import Histogram, Metrics
+
+
+def test_operations_are_measured(cache):
+    events = []
+    metrics = cache.setup_metrics(hooks=[events.append])
+    sub = cache.sub('users')
+    assert isinstance(sub, MeteredSub)
+    sub.set_many({uid: {'name': f'n{uid}', 'status': True} for uid in range(10)})
+    sub.get_many([1, 2, 3])
+    assert not sub.set(11, {'name': 1, 'status': True})
+
+    operations = metrics.snapshot()['test_cache']['users']
+    assert operations['set_many']['calls'] == 1
+    assert operations['set_many']['keys'] == 10
+    assert operations['get_many']['keys'] == 3
+    assert operations['set']['validation_failures'] == 1
+    assert {'total', 'serialize'} <= operations['set_many']['phases'].keys()
+    assert [event['operation'] for event in events] == ['set_many', 'get_many', 'set']
+    assert events[1]['sub'] == 'users' and events[1]['error'] is None
+
+
+def test_errors_are_counted(cache):
+    metrics = cache.setup_metrics()
+    with pytest.raises(ValueError):
+        cache.sub('users').find(name='a')
+    assert metrics.snapshot()['test_cache']['users']['find']['errors'] == 1
+
+
+def test_failing_hooks_do_not_fail_the_operation(cache):
+    def failing_hook(event):
+        raise RuntimeError('hook')
+
+    cache.setup_metrics(hooks=[failing_hook])
+    with pytest.warns(RuntimeWarning, match='failing_hook') as records:
+        assert cache.sub('users').set(1, {'name': 'a', 'status': True})
+        assert cache.sub('users').get(1)
+    # A failing hook is warned about once, not on every operation
+    assert len(records) == 1
+
+
+def test_remove_metrics(cache):
+    metrics = cache.setup_metrics()
+    cache.remove_metrics()
+    cache.sub('users').get(1)
+    assert metrics.snapshot() == {}
+    assert not isinstance(cache.sub('users'), MeteredSub)
+
+
+def test_prometheus_export(cache):
+    metrics = cache.setup_metrics()
+    cache.sub('users').get(1)
+    text = metrics.to_prometheus()
+    assert '# TYPE redisadapter_operation_seconds histogram' in text
+    assert 'redisadapter_operation_seconds_count{cache="test_cache",sub="users",' \
+           'operation="get",phase="total"} 1' in text
+    assert 'redisadapter_calls_total{cache="test_cache",sub="users",operation="get"} 1' in text
+    assert 'le="+Inf"' in text
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_histogram():
+    histogram = Histogram((0.001, 0.01, 0.1))
+    for seconds in (0.0005, 0.005, 0.005, 0.05, 5.0):
+        histogram.observe(seconds)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 5
+    assert snapshot['sum'] == pytest.approx(5.0605)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert 0.001 <= histogram.quantile(0.5) <= 0.01
+
+
+def test_shared_metrics_across_caches(cache, make_cache):
+    metrics = Metrics()
+    cache.setup_metrics(metrics)
+
+    async def run():
+        async_cache = make_cache(AsyncFakeCache)
+        async_cache.setup_metrics(metrics)
+        await async_cache.sub('users').get_many([1, 2])
+        await async_cache.aclose()
+
+    cache.sub('users').get_many([1])
+    asyncio.run(run())
+    assert metrics.snapshot()['test_cache']['users']['get_many']['calls'] == 2
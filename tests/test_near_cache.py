@@ -0,0 +1,113 @@
+""" Tests of the in-process near cache in front of get and get_many """
+
+import time
+
+import pytest
+from redis.exceptions import ResponseError
+
+from querybuilder.near_cache import NearCache, NearCacheInvalidator
+
+
+@pytest.fixture
+def sub(cache):
+    cache.sub('users').set_many({uid: {'name': f'n{uid}', 'status': True} for uid in range(5)})
+    cache.setup_near_cache('users', is_tracking=False)
+    return cache.sub('users')
+
+
+def write_behind_the_sub(sub, uid: int, name: str) -> None:
+    complete_key = sub.get_complete_key(uid)
+    sub.query_builder.redis.set(complete_key, sub.query_builder.encode_val(
+        {'uid': uid, 'name': name, 'status': True}))
+
+
+def test_reads_are_served_from_the_near_cache(cache, sub):
+    assert sub.get(1)['name'] == 'n1'
+    write_behind_the_sub(sub, 1, 'changed')
+    assert sub.get(1)['name'] == 'n1'
+    assert sub.get_many([1, 2])[0]['name'] == 'n1'
+    stats = cache.near_caches['users'].stats()
+    assert stats['hits'] == 2
+    assert stats['entries'] == 2
+
+
+def test_own_writes_invalidate(sub):
+    sub.get_many([1, 2, 3])
+    sub.set(1, {'name': 'set', 'status': True})
+    sub.update(2, {'name': 'updated'})
+    sub.unset(3)
+    assert [row and row['name'] for row in sub.get_many([1, 2, 3])] == ['set', 'updated', None]
+
+
+def test_rows_are_copies(sub):
+    sub.get(1)['name'] = 'mutated'
+    assert sub.get(1)['name'] == 'n1'
+
+
+def test_remove_near_cache(cache, sub):
+    sub.get(1)
+    write_behind_the_sub(sub, 1, 'changed')
+    cache.remove_near_cache('users')
+    assert cache.sub('users').get(1)['name'] == 'changed'
+
+
+def test_eviction_and_expiry():
+    near_cache = NearCache(max_entries=2, ttl=0.01)
+    for complete_key in ('a', 'b', 'c'):
+        near_cache.put(complete_key, {'key': complete_key}, near_cache.generation)
+    assert near_cache.get('a') is None
+    assert near_cache.get(b'c') == {'key': 'c'}
+    time.sleep(0.02)
+    assert near_cache.get('c') is None
+    assert near_cache.stats()['evictions'] == 1
+    assert near_cache.stats()['expirations'] == 1
+
+
+def test_rows_read_before_an_invalidation_are_dropped():
+    near_cache = NearCache()
+    generation = near_cache.generation
+    near_cache.invalidate(['a'])
+    near_cache.put('a', {'key': 'a'}, generation)
+    assert near_cache.get('a') is None
+
+
+def test_invalidation_messages():
+    near_cache = NearCache()
+    invalidator = NearCacheInvalidator(near_cache, {}, 'test_cache/users/')
+    for complete_key in ('test_cache/users/1', 'test_cache/users/2', 'test_cache/users/3'):
+        near_cache.put(complete_key, {}, near_cache.generation)
+    invalidator.handle([b'message', b'__redis__:invalidate', [b'test_cache/users/1']])
+    invalidator.handle([b'pmessage', b'__keyspace@0__:test_cache/users/*',
+                        b'__keyspace@0__:test_cache/users/2', b'set'])
+    assert near_cache.get_many(['test_cache/users/1', 'test_cache/users/2']) == [None, None]
+    assert near_cache.get('test_cache/users/3') == {}
+    invalidator.handle([b'message', b'__redis__:invalidate', None])
+    assert near_cache.stats()['entries'] == 0
+
+
+class ConfigConnection:
+    """ Answers CONFIG GET notify-keyspace-events with the given flags """
+
+    def __init__(self, flags: str | None):
+        self.flags = flags
+
+    def send_command(self, *args) -> None:
+        pass
+
+    def read_response(self) -> list:
+        if self.flags is None:
+            raise ResponseError('unknown command')
+        return [b'notify-keyspace-events', self.flags.encode('utf-8')]
+
+
+@pytest.mark.parametrize('flags', ['', 'Kx', None])
+def test_keyspace_events_must_be_enabled(flags):
+    invalidator = NearCacheInvalidator(NearCache(), {}, 'test_cache/users/')
+    with pytest.raises(ValueError):
+        invalidator.check_keyspace_events(ConfigConnection(flags))
+
+
+@pytest.mark.parametrize('flags', ['Kg$hxe', 'KA'])
+def test_keyspace_events_enabled(flags):
+    invalidator = NearCacheInvalidator(NearCache(), {}, 'test_cache/users/')
+    invalidator.check_keyspace_events(ConfigConnection(flags))
@@ -0,0 +1,68 @@
+""" Tests of the key registry, count and page """
+
+import time
+
+import pytest
+
+from conftest import PASSPHRASE
+
+
+@pytest.fixture
+def sub(cache):
+    cache.create_sub('members', {'uid': 'INTEGER', 'name': 'TEXT', 'status': 'BOOLEAN'},
+                     passphrase=PASSPHRASE, is_registered=True)
+    return cache.sub('members')
+
+
+def test_page_in_key_order(sub):
+    sub.set_many({uid: {'name': f'n{uid}', 'status': True} for uid in (10, 2, 33, 4, 1)})
+    assert [row['uid'] for row in sub.page(limit=3)] == [1, 2, 4]
+    assert [row['uid'] for row in sub.page(after=4, limit=3)] == [10, 33]
+    assert sub.page(after=33) == []
+    assert sub.page(limit=1, fields=['name']) == [{'name': 'n1'}]
+    assert sub.count() == 5
+
+
+def test_negative_keys(sub):
+    sub.set_many({uid: {'name': 'n', 'status': True} for uid in (5, -3, 0, -10)})
+    assert [row['uid'] for row in sub.page()] == [-10, -3, 0, 5]
+
+
+def test_keys_beyond_2_53_are_rejected(sub):
+    assert sub.set(2 ** 53, {'name': 'n', 'status': True})
+    with pytest.raises(ValueError):
+        sub.set(2 ** 53 + 1, {'name': 'n', 'status': True})
+    assert sub.count() == 1
+
+
+def test_count_without_registry(cache):
+    cache.create_sub('events', {'eid': 'INTEGER', 'kind': 'TEXT'}, passphrase=PASSPHRASE,
+                     is_registered=False)
+    sub = cache.sub('events')
+    sub.set_many({eid: {'kind': 'k'} for eid in range(30)})
+    assert sub.count() == 30
+    with pytest.raises(ValueError):
+        sub.page()
+
+
+def test_registry_default(cache):
+    sub = cache.sub('users')
+    assert not sub.query_builder.schema.is_registered
+    # Any INTEGER key can be set on a sub without registry
+    assert sub.set(2 ** 53 + 1, {'name': 'n', 'status': True})
+    assert sub.get(2 ** 53 + 1)['uid'] == 2 ** 53 + 1
+    assert sub.count() == 1
+
+
+def test_expired_keys_leave_the_registry(cache):
+    cache.create_sub('sessions', {'sid': 'TEXT', 'user': 'TEXT'}, passphrase=PASSPHRASE,
+                     indexes=['user'], is_registered=True)
+    sub = cache.sub('sessions')
+    sub.set_many({'a': {'user': 'u'}, 'b': {'user': 'u'}}, ttl=1)
+    sub.set('c', {'user': 'u'})
+    assert sub.count() == 3
+    time.sleep(1.1)
+    assert sub.count() == 1
+    assert [row['sid'] for row in sub.page()] == ['c']
+    index_rows = sub.query_builder.redis.hkeys(sub.query_builder.index_rows_key)
+    assert index_rows == [sub.get_complete_key('c').encode('utf-8')]
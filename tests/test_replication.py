@@ -0,0 +1,134 @@
+""" Tests of the reads sent to the replicas of a primary """
+
+import asyncio
+import threading
+import time
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from conftest import AsyncFakeCache, FakeCache, get_server
+from querybuilder.replication import AsyncReplicatedRedis, ReplicatedRedis
+
+PRIMARY = ('127.0.0.1', 6379)
+# The first replica is in sync with the primary, the second one lags behind with no data
+REPLICAS = [('127.0.0.1', 6380), ('127.0.0.1', 6381)]
+ROW = {'uid': 1, 'name': 'a', 'status': True}
+
+
+@pytest.fixture
+def make_replicated_cache(cache, make_cache, fake_servers):
+    cache.sub('users').set(1, ROW)
+    fake_servers[REPLICAS[0]] = get_server(*PRIMARY)
+    get_server(*REPLICAS[1])
+
+    def make_replicated_cache(cache_class: type = FakeCache, **kwargs):
+        return make_cache(cache_class, replicas=REPLICAS, **kwargs)
+    return make_replicated_cache
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'replicas': REPLICAS, 'is_cluster': True},
+    {'replicas': REPLICAS, 'nodes': [('127.0.0.1', 7000)]},
+    {'replicas': REPLICAS, 'read_routing': 'random'},
+])
+def test_replica_options_errors(kwargs):
+    with pytest.raises(ValueError):
+        FakeCache('test_cache', *PRIMARY, **kwargs)
+
+
+def test_reads_go_round_robin_to_the_replicas(make_replicated_cache):
+    cache = make_replicated_cache()
+    assert isinstance(cache.redis, ReplicatedRedis)
+    sub = cache.sub('users')
+    rows = [sub.get(1) for _ in range(4)]
+    assert rows in ([ROW, None, ROW, None], [None, ROW, None, ROW])
+    assert sub.get_many([1, 1]) in ([ROW, ROW], [None, None])
+    assert cache.redis.ping()
+
+
+def test_writes_go_to_the_primary(make_replicated_cache):
+    sub = make_replicated_cache().sub('users')
+    assert sub.set_many({uid: {'name': f'n{uid}', 'status': False} for uid in range(2, 6)})
+    assert sub.update(2, {'name': 'updated'})
+    primary = FakeCache.connect_node(None, *PRIMARY)
+    assert primary.exists(sub.get_complete_key(2))
+    assert not FakeCache.connect_node(None, *REPLICAS[1]).dbsize()
+
+
+def test_failing_replica_falls_back_to_the_primary(make_replicated_cache):
+    cache = make_replicated_cache()
+    sub = cache.sub('users')
+    get_server(*REPLICAS[1]).connected = False
+    assert [sub.get(1) for _ in range(4)] == [ROW] * 4
+    assert cache.redis.down_until[1] > time.monotonic()
+    assert cache.redis.down_until[0] == 0.0
+    assert sub.get_many([1, 404]) == [ROW, None]
+    assert sub.get_all() == [ROW]
+
+    get_server(*PRIMARY).connected = False
+    cache.redis.down_until[:] = [time.monotonic() + 60] * 2
+    with pytest.raises(RedisConnectionError):
+        sub.get(1)
+
+
+def test_failing_replica_scan_falls_back_to_the_primary(make_replicated_cache):
+    cache = make_replicated_cache()
+    get_server(*REPLICAS[1]).connected = False
+    for _ in range(2):
+        assert cache.sub('users').count() == 1
+
+
+def test_read_your_writes(make_replicated_cache):
+    cache = make_replicated_cache(read_your_writes=60.0)
+    cache.redis.down_until[0] = time.monotonic() + 60
+    sub = cache.sub('users')
+    assert sub.get(1) is None
+    assert not cache.redis.is_pinned()
+
+    assert sub.set(1, ROW)
+    assert cache.redis.is_pinned()
+    assert sub.get(1) == ROW
+    other = {}
+    thread = threading.Thread(target=lambda: other.update(row=sub.get(1),
+                                                          is_pinned=cache.redis.is_pinned()))
+    thread.start()
+    thread.join()
+    assert other == {'row': None, 'is_pinned': False}
+
+    cache.redis.written_at.set(time.monotonic() - 61)
+    assert sub.get(1) is None
+
+
+def test_least_latency_routing(make_replicated_cache):
+    cache = make_replicated_cache(read_routing='least_latency')
+    redis = cache.redis
+    redis.latencies[:] = [0.001, 1.0]
+    picks = [redis.choose() for _ in range(2 * redis.LATENCY_PROBE)]
+    assert picks.count(1) == 1
+    redis.observe(1, 0.0)
+    assert redis.latencies[1] == pytest.approx(0.8)
+    redis.fail(0)
+    assert redis.latencies[0] == 0.001
+    assert redis.choose() == 1
+
+
+def test_async_replicas(make_replicated_cache):
+    async def run():
+        cache = make_replicated_cache(AsyncFakeCache, read_your_writes=60.0)
+        assert isinstance(cache.redis, AsyncReplicatedRedis)
+        sub = cache.sub('users')
+        get_server(*REPLICAS[1]).connected = False
+        assert [await sub.get(1) for _ in range(4)] == [ROW] * 4
+        assert await sub.get_all() == [ROW]
+
+        async def writer():
+            await sub.set(2, {'name': 'b', 'status': False})
+            return cache.redis.is_pinned()
+
+        async def reader():
+            return cache.redis.is_pinned()
+        assert await asyncio.gather(writer(), reader()) == [True, False]
+        await cache.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,67 @@
+""" Tests of the lazy and raw row formats of get and get_many """
+
+import pytest
+
+from conftest import PASSPHRASE
+from querybuilder.rows import LazyRow
+
+SUB_ATTR = {'uid': 'INTEGER', 'name': 'TEXT', 'score': 'REAL'}
+ROWS = {1: {'name': 'a', 'score': 1.5}, 2: {'name': 'b', 'score': 2.5}}
+
+
+@pytest.fixture(params=[{}, {'is_positional': True}, {'codec': 'msgpack'}, {'storage': 'hash'}],
+                ids=['json', 'positional', 'msgpack', 'hash'])
+def sub(cache, request):
+    cache.create_sub('scores', SUB_ATTR, passphrase=PASSPHRASE, **request.param)
+    sub = cache.sub('scores')
+    sub.set_many(ROWS)
+    return sub
+
+
+def test_lazy_rows(sub):
+    row = sub.get(1, format_='lazy')
+    assert isinstance(row, LazyRow)
+    assert row.decoded is None
+    assert row['name'] == 'a'
+    assert row == {'uid': 1, 'name': 'a', 'score': 1.5}
+    assert dict(row) == row.to_dict() == sub.get(1)
+    assert len(row) == 3
+    with pytest.raises(KeyError):
+        row['missing']  # pylint: disable=pointless-statement
+    assert sub.get(404, format_='lazy') is None
+
+    rows = sub.get_many([2, 404, 1], format_='lazy')
+    assert rows[1] is None
+    assert [row.to_dict() for row in (rows[0], rows[2])] == sub.get_many([2, 1])
+
+
+def test_lazy_rows_fields(sub):
+    row = sub.get(2, fields=['score'], format_='lazy')
+    assert list(row) == ['score']
+    assert row == {'score': 2.5}
+    with pytest.raises(KeyError):
+        row['name']  # pylint: disable=pointless-statement
+    assert sub.get_many([1, 404], fields=['name', 'uid'], format_='lazy') == \
+        [{'name': 'a', 'uid': 1}, None]
+
+
+def test_raw_rows(sub):
+    codec = sub.query_builder.schema.codec
+    raw = sub.get(1, format_='raw')
+    if sub.query_builder.schema.is_hash:
+        assert codec.decode_fields(raw) == sub.get(1)
+        assert sub.get(1, fields=['name'], format_='raw') == {'name': raw[b'name']}
+    else:
+        assert isinstance(raw, bytes)
+        assert codec.decode(raw, 1) == sub.get(1)
+    assert sub.get_many([1, 404], format_='raw') == [raw, None]
+
+
+def test_row_format_errors(sub):
+    with pytest.raises(ValueError):
+        sub.get(1, format_='columns')
+    with pytest.raises(ValueError):
+        sub.get_many([1], format_='dicts')
+    if not sub.query_builder.schema.is_hash:
+        with pytest.raises(ValueError):
+            sub.get(1, fields=['name'], format_='raw')
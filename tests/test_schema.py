@@ -0,0 +1,56 @@
+""" Tests of the compiled sub schema and the validation of Sub writes """
+
+import pytest
+
+from querybuilder.schema import Schema
+
+SUB_ATTR = {'uid': 'INTEGER', 'name': 'TEXT NOT NULL', 'score': 'REAL', 'status': 'BOOLEAN'}
+
+
+def test_validate():
+    schema = Schema(SUB_ATTR)
+    assert schema.validate({'uid': 1, 'name': 'a', 'score': 1.5, 'status': True})
+    assert not schema.validate({'uid': 1, 'name': None, 'score': 1.5, 'status': True})
+    assert not schema.validate({'uid': 1, 'name': 'a', 'score': '1.5', 'status': True})
+    assert not schema.validate({'uid': 1, 'name': 'a', 'score': 1.5})
+
+
+def test_validate_many_reports_every_invalid_column():
+    schema = Schema(SUB_ATTR)
+    inputs = {
+        1: {'uid': 1, 'name': 'a', 'score': 1.5, 'status': True},
+        2: {'uid': 2, 'name': None, 'score': 'x', 'status': True},
+        3: {'uid': 3, 'name': 'c', 'score': 1.0},
+    }
+    assert schema.validate_many(inputs) == {2: ['name', 'score'], 3: ['status']}
+    assert schema.validate_many({1: inputs[1]}) == {}
+
+
+def test_validate_partial():
+    schema = Schema(SUB_ATTR)
+    assert schema.validate_partial({'name': 'b'})
+    assert schema.validate_partial({'unknown': object()})
+    assert not schema.validate_partial({'uid': 2})
+    assert not schema.validate_partial({'name': None})
+    assert not schema.validate_partial({'score': 1})
+
+
+def test_coerce_key():
+    assert Schema(SUB_ATTR).coerce_key('12') == 12
+    assert Schema({'code': 'TEXT', 'name': 'TEXT'}).coerce_key(12) == '12'
+
+
+@pytest.mark.parametrize('sub_options', [{'storage': 'list'}, {'indexes': ['unknown']}])
+def test_invalid_sub_options(sub_options):
+    with pytest.raises(ValueError):
+        Schema(SUB_ATTR, sub_options)
+
+
+def test_invalid_rows_are_not_written(cache):
+    sub = cache.sub('users')
+    assert not sub.set(1, {'name': 1, 'status': True})
+    assert not sub.set_many({2: {'name': 'b', 'status': True}, 3: {'name': 'c', 'status': 'x'}})
+    assert sub.get(1) is None
+    assert sub.get_many([2, 3]) == [None, None]
+    assert sub.set(2, {'name': 'b', 'status': True})
+    assert sub.get(2) == {'uid': 2, 'name': 'b', 'status': True}
@@ -0,0 +1,86 @@
+""" Tests of the consistent-hash sharding over standalone instances """
+
+import asyncio
+
+import fakeredis
+import pytest
+from redis.exceptions import ResponseError
+
+from conftest import PASSPHRASE, AsyncFakeCache
+from querybuilder.sharding import HashRing, ShardedRedis
+
+NODES = [('127.0.0.1', 7001), ('127.0.0.1', 7002)]
+
+
+def count_node_keys(fake_servers, node) -> int:
+    return len(fakeredis.FakeRedis(server=fake_servers[node]).keys('test_cache/*'))
+
+
+def test_hash_ring():
+    ring = HashRing(['a:1', 'b:1', 'c:1'])
+    owners = [ring.get_node(f'key/{i}') for i in range(3000)]
+    assert all(owners.count(node_name) > 700 for node_name in ('a:1', 'b:1', 'c:1'))
+    assert ring.get_node('{tag}/1') == ring.get_node('{tag}/2')
+
+    ring.add_node('d:1')
+    moved = [i for i in range(3000) if ring.get_node(f'key/{i}') != owners[i]]
+    assert all(ring.get_node(f'key/{i}') == 'd:1' for i in moved)
+    with pytest.raises(KeyError):
+        ring.add_node('d:1')
+
+
+def test_rows_are_spread_over_the_nodes(make_cache, fake_servers):
+    cache = make_cache(nodes=NODES)
+    cache.create_sub('spread', {'uid': 'INTEGER', 'name': 'TEXT'}, passphrase=PASSPHRASE)
+    sub = cache.sub('spread')
+    assert sub.set_many({uid: {'name': f'n{uid}'} for uid in range(300)})
+    counts = [count_node_keys(fake_servers, node) for node in [('127.0.0.1', 6379), *NODES]]
+    assert sum(counts) == 300
+    assert min(counts) > 50
+    assert [row['name'] for row in sub.get_many([0, 150, 299])] == ['n0', 'n150', 'n299']
+    assert len(sub.get_all(batch_size=32)) == 300
+    assert sub.count() == 300
+    assert sub.unset_many(list(range(100))) == 100
+    assert sub.unset_all() == 200
+
+
+def test_add_node_moves_keys(make_cache, fake_servers):
+    cache = make_cache(nodes=NODES)
+    cache.create_sub('spread', {'uid': 'INTEGER', 'name': 'TEXT'}, passphrase=PASSPHRASE)
+    cache.sub('spread').set_many({uid: {'name': f'n{uid}'} for uid in range(300)}, ttl=100)
+    moved = cache.add_node('127.0.0.1', 7003, PASSPHRASE, batch_size=16)
+    assert 0 < moved == count_node_keys(fake_servers, ('127.0.0.1', 7003))
+    sub = cache.sub('spread')
+    assert len(sub.get_all()) == 300
+    assert all(row is not None for row in sub.get_many(list(range(300))))
+    assert {sub.ttl(uid) for uid in range(300)} == {100}
+
+
+def test_failed_restores_stay_on_the_source():
+    keys = [b'a', b'b', b'c']
+    results = [True, ResponseError('BUSYKEY Target key name already exists.'),
+               ResponseError('OOM command not allowed')]
+    assert ShardedRedis.get_copied_keys(keys, results) == ([b'a'], [b'a', b'b'])
+
+
+def test_add_node_checks(cache, make_cache):
+    with pytest.raises(ValueError):
+        cache.add_node('127.0.0.1', 7003, PASSPHRASE)
+    with pytest.raises(ValueError):
+        make_cache(nodes=NODES).add_node('127.0.0.1', 7003, 'wrong')
+
+
+def test_async_sharded_cache(make_cache, fake_servers):
+    async def run():
+        cache = make_cache(AsyncFakeCache, nodes=NODES)
+        cache.create_sub('spread', {'uid': 'INTEGER', 'name': 'TEXT'}, passphrase=PASSPHRASE)
+        sub = cache.sub('spread')
+        assert await sub.set_many({uid: {'name': f'n{uid}'} for uid in range(100)})
+        moved = await cache.add_node('127.0.0.1', 7003, PASSPHRASE)
+        rows = await cache.sub('spread').get_many(list(range(100)))
+        await cache.aclose()
+        return moved, rows
+
+    moved, rows = asyncio.run(run())
+    assert moved == count_node_keys(fake_servers, ('127.0.0.1', 7003))
+    assert [row['name'] for row in rows] == [f'n{uid}' for uid in range(100)]
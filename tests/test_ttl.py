@@ -0,0 +1,44 @@
+""" Tests of the per-sub and per-call ttl """
+
+import pytest
+
+from conftest import PASSPHRASE
+
+
+@pytest.fixture(params=['string', 'hash'])
+def sub(cache, request):
+    cache.create_sub('sessions', {'sid': 'TEXT', 'user': 'TEXT'}, passphrase=PASSPHRASE,
+                     storage=request.param, ttl=100)
+    return cache.sub('sessions')
+
+
+def test_sub_default_ttl(sub):
+    sub.set('a', {'user': 'u'})
+    sub.set_many({'b': {'user': 'u'}, 'c': {'user': 'u'}})
+    assert [sub.ttl(sid) for sid in 'abc'] == [100, 100, 100]
+    assert sub.ttl('missing') == -2
+
+
+def test_ttl_per_call(sub):
+    sub.set('a', {'user': 'u'}, ttl=10)
+    sub.set_many({'b': {'user': 'u'}}, ttl=20)
+    sub.set('c', {'user': 'u'}, ttl=0)
+    assert [sub.ttl(sid) for sid in 'abc'] == [10, 20, -1]
+
+
+def test_update_keeps_the_ttl(sub):
+    sub.set('a', {'user': 'u'}, ttl=10)
+    assert sub.update('a', {'user': 'v'})
+    assert sub.ttl('a') == 10
+    assert sub.get('a') == {'sid': 'a', 'user': 'v'}
+
+
+def test_touch(sub):
+    sub.set_many({'a': {'user': 'u'}, 'b': {'user': 'u'}}, ttl=10)
+    assert sub.touch(['a', 'b', 'missing']) == 2
+    assert sub.ttl('a') == 100
+    assert sub.touch(['a'], ttl=5) == 1
+    assert sub.ttl('a') == 5
+    assert sub.touch(['b'], ttl=0) == 1
+    assert sub.ttl('b') == -1
+    assert sub.touch([]) == 0
@@ -0,0 +1,38 @@
+""" Tests of unset and unset_many in one transaction """
+
+from conftest import PASSPHRASE
+
+
+def test_unset(cache):
+    sub = cache.sub('users')
+    sub.set(1, {'name': 'a', 'status': True})
+    assert sub.unset(1)
+    assert not sub.unset(1)
+    assert sub.get(1) is None
+
+
+def test_unset_many_returns_the_removed_count(cache):
+    sub = cache.sub('users')
+    sub.set_many({uid: {'name': f'n{uid}', 'status': True} for uid in range(10)})
+    assert sub.unset_many([0, 1, 2, 99]) == 3
+    assert sub.unset_many([]) == 0
+    assert sub.get_many([0, 1, 2, 3]) == [None, None, None,
+                                          {'uid': 3, 'name': 'n3', 'status': True}]
+
+
+def test_unset_many_in_chunks(cache):
+    sub = cache.sub('users')
+    sub.set_many({uid: {'name': f'n{uid}', 'status': True} for uid in range(25)})
+    complete_keys = [sub.get_complete_key(uid) for uid in range(25)]
+    assert sub.unset_many(complete_keys, is_key_complete=True, is_unlink=True, chunk_size=4) == 25
+    assert sub.get_all() == []
+
+
+def test_unset_many_updates_the_registry(cache):
+    cache.create_sub('members', {'uid': 'INTEGER', 'name': 'TEXT', 'status': 'BOOLEAN'},
+                     passphrase=PASSPHRASE, is_registered=True)
+    sub = cache.sub('members')
+    sub.set_many({uid: {'name': f'n{uid}', 'status': True} for uid in range(5)})
+    sub.unset_many([1, 3])
+    assert sub.count() == 3
+    assert [row['uid'] for row in sub.page()] == [0, 2, 4]